@@ -1,6 +1,30 @@
 # -*- coding: utf-8 -*-
 
-import geospatial
-import interleave
-import morton
-import zorder
+"""
+The submodules are imported on first access, e.g. `pyindex.morton`, so
+that `import pyindex` costs next to nothing and programs only pay for the
+submodules (and dependencies, like numpy) they use.  See importtime.py.
+"""
+
+import importlib
+
+__all__ = [
+    'alternative_interleave', 'bulkload', 'cache', 'compute', 'coverer',
+    'diskindex', 'geohash', 'geospatial', 'hilbert', 'importtime', 'index',
+    'ingest', 'interleave', 'morton', 'parallel', 'server', 'tiles',
+    'zorder',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deferred imports, so that importing a module of the package only pays for
+the dependencies it needs straight away.
+"""
+
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands for a module which is only imported on first attribute access:
+
+        np = LazyModule('numpy')
+
+    at the top of a module imports numpy the first time one of its batch
+    functions uses `np`, rather than every time the module is imported.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name)
+
+    def __getattr__(self, attr):
+        # only called for attributes missing from the proxy: copy those of
+        # the module over, so that later lookups are as fast as on the
+        # module itself
+        module = importlib.import_module(self.__name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+External-memory bulk loading of points into an index file (see
+diskindex.py), for datasets which do not fit in memory.
+
+Points are read a chunk at a time and encoded into Morton keys.  Once the
+memory budget is full, the buffered keys are sorted and spilled to a
+temporary run file.  The runs are then merged into the index file a block
+at a time, so memory use stays bounded whatever the number of points.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .diskindex import DEFAULT_FENCE_STRIDE, IndexWriter
+from .morton import interleave_64_batch
+
+RECORD_DTYPE = np.dtype([('key', '<u8'), ('id', '<i8')])
+
+# Bytes of memory needed per buffered point: the record itself, plus the
+# sort order and the sorted copy made while sorting it.
+BYTES_PER_POINT = 3 * RECORD_DTYPE.itemsize
+
+# Smallest number of records read from each run at a time while merging;
+# with more runs than the memory budget allows at this size, runs are
+# merged in several passes.
+MIN_MERGE_BLOCK = 4096
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 ** 2
+
+_Progress = namedtuple('_Progress', ['stage', 'rows', 'seconds'])
+class Progress(_Progress):
+    """
+    Progress report of bulk_load(): the number of rows sorted into runs
+    (stage 'sort') or merged into the index (stage 'merge') so far, and the
+    seconds elapsed since the start.
+    """
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """
+    Returns a number of bytes from an integer or a string such as '2GB',
+    '512M' or '1.5 GiB'.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.match(r'^\s*([\d.]+)\s*([KMGT]?)(?:i?B)?\s*$', size, re.I)
+    if not match:
+        raise ValueError("invalid size: {!r}".format(size))
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def print_progress(progress):
+    """
+    Prints a Progress report, for use as the `report` argument of
+    bulk_load().
+    """
+    print("{}: {} rows in {:.1f}s ({:.0f} rows/s)".format(
+        progress.stage, progress.rows, progress.seconds,
+        progress.rows_per_second
+    ))
+
+
+class _Run(object):
+    """
+    Sorted run file, read back a block of records at a time.
+    """
+
+    def __init__(self, path, block_size):
+        self.file = open(path, 'rb')
+        self.block_size = block_size
+        self.exhausted = False
+        self.buffer = np.empty(0, dtype=RECORD_DTYPE)
+        self.fill()
+
+    def fill(self):
+        if self.exhausted or len(self.buffer):
+            return
+        self.buffer = np.fromfile(self.file, RECORD_DTYPE, self.block_size)
+        if len(self.buffer) < self.block_size:
+            self.exhausted = True
+            self.file.close()
+
+
+def _merge(runs, emit):
+    """
+    Merges sorted runs, calling `emit` with sorted blocks of records.
+
+    Every record up to the smallest last key of the runs still being read
+    can be emitted: whatever these runs hold next cannot be smaller.
+    """
+    while runs:
+        pending = [run for run in runs if not run.exhausted]
+        if pending:
+            bound = min(run.buffer['key'][-1] for run in pending)
+        else:
+            bound = None
+
+        parts = []
+        for run in runs:
+            if bound is None:
+                cut = len(run.buffer)
+            else:
+                cut = np.searchsorted(run.buffer['key'], bound, side='right')
+            parts.append(run.buffer[:cut])
+            run.buffer = run.buffer[cut:]
+
+        block = np.concatenate(parts)
+        emit(block[np.argsort(block['key'], kind='mergesort')])
+
+        for run in runs:
+            run.fill()
+        runs = [run for run in runs if len(run.buffer)]
+
+
+def _merge_pass(paths, memory_limit, fan_in):
+    """
+    Merges groups of `fan_in` run files into new run files, and returns
+    their paths.
+    """
+    merged_paths = []
+    for start in range(0, len(paths), fan_in):
+        group = paths[start:start + fan_in]
+        block_size = max(1, memory_limit // (BYTES_PER_POINT * len(group)))
+        # named after the first run of the group, which is removed below
+        path = group[0] + '.merged'
+        with open(path, 'wb') as merged:
+            _merge([_Run(run_path, block_size) for run_path in group],
+                   lambda block: block.tofile(merged))
+        for run_path in group:
+            os.remove(run_path)
+        merged_paths.append(path)
+    return merged_paths
+
+
+def bulk_load(chunks, path, memory_limit=DEFAULT_MEMORY_LIMIT,
+              encode=interleave_64_batch, with_ids=False,
+              fence_stride=DEFAULT_FENCE_STRIDE, temp_dir=None, report=None):
+    """
+    Builds an index file from chunks of points without holding them all in
+    memory, and returns the number of points loaded.
+
+    chunks: iterable of tuples of co-ordinate arrays, e.g. (x, y)
+    path: index file to write, see diskindex.py
+    memory_limit: memory budget in bytes or as a string such as '2GB'; the
+                  chunks themselves are not counted
+    encode: function turning the co-ordinate arrays of a chunk into an
+            array of keys, e.g. LonLat.interleave_batch for (lon, lat)
+    with_ids: whether the last array of each chunk holds the ids of the
+              points; otherwise their position in the input is used
+    temp_dir: directory for the sorted runs, defaults to the system's
+    report: function called with a Progress namedtuple after every run
+            and merged block, e.g. print_progress
+    """
+    memory_limit = parse_size(memory_limit)
+    run_size = max(1, memory_limit // BYTES_PER_POINT)
+    directory = tempfile.mkdtemp(prefix='pyindex-', dir=temp_dir)
+    start = time.time()
+
+    def progress(stage, rows):
+        if report is not None:
+            report(Progress(stage, rows, time.time() - start))
+
+    try:
+        run_paths = []
+        buffered = []
+        buffered_count = 0
+        count = 0
+
+        def spill():
+            records = np.concatenate(buffered)
+            records = records[np.argsort(records['key'], kind='mergesort')]
+            run_path = os.path.join(directory, 'run-{}'.format(len(run_paths)))
+            records.tofile(run_path)
+            run_paths.append(run_path)
+            del buffered[:]
+            progress('sort', count)
+
+        for chunk in chunks:
+            if with_ids:
+                chunk, ids = chunk[:-1], np.asarray(chunk[-1])
+            keys = encode(*chunk)
+            if not with_ids:
+                ids = np.arange(count, count + len(keys))
+
+            records = np.empty(len(keys), dtype=RECORD_DTYPE)
+            records['key'] = keys
+            records['id'] = ids
+
+            # split chunks larger than what is left of the run
+            while len(records):
+                taken = records[:run_size - buffered_count]
+                records = records[len(taken):]
+                buffered.append(taken)
+                buffered_count += len(taken)
+                count += len(taken)
+                if buffered_count == run_size:
+                    spill()
+                    buffered_count = 0
+
+        if buffered_count:
+            spill()
+
+        # merge in several passes if there are too many runs to read a
+        # decent block of each of them at once
+        fan_in = max(2, memory_limit // (BYTES_PER_POINT * MIN_MERGE_BLOCK))
+        while len(run_paths) > fan_in:
+            run_paths = _merge_pass(run_paths, memory_limit, fan_in)
+
+        block_size = max(
+            1, memory_limit // (BYTES_PER_POINT * max(1, len(run_paths)))
+        )
+        with IndexWriter(path, count, fence_stride) as writer:
+            merged = [0]
+
+            def emit(block):
+                writer.append(block['key'], block['id'])
+                merged[0] += len(block)
+                progress('merge', merged[0])
+
+            _merge([_Run(run_path, block_size) for run_path in run_paths],
+                   emit)
+
+        return count
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of the key ranges covering query boxes, for workloads such as tile
+serving where the same boxes are queried over and over.
+
+    cache = RangeCache(maxsize=4096, ttl=300)
+    index = MortonIndex.build(x, y, range_cache=cache)
+    ...
+    print(cache.stats())
+"""
+
+from __future__ import division
+
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+from .zorder import MAX_RANGES, morton_bbox_ranges
+
+CacheStats = namedtuple('CacheStats', [
+    'hits', 'misses', 'evictions', 'expirations', 'size', 'maxsize'
+])
+
+
+class RangeCache(object):
+    """
+    Bounded, thread-safe cache of the ranges of zorder.morton_bbox_ranges(),
+    keyed on the box, `max_ranges` and `max_depth`.
+
+    The least recently used box is evicted once the cache holds `maxsize`
+    boxes, and boxes older than `ttl` seconds are computed again.  Hits,
+    misses, evictions (by size) and expirations (by age) are counted for
+    sizing the cache, see stats().
+
+    maxsize: maximum number of cached boxes
+    ttl: maximum age of a cached box in seconds, or None to keep it until
+         it is evicted
+    clock: function returning the current time in seconds
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # key -> (time stored, ranges), least recently used first
+        self._entries = OrderedDict()
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ranges(self, x_min, y_min, x_max, y_max, max_ranges=MAX_RANGES,
+               max_depth=None):
+        """
+        Returns the ranges of morton_bbox_ranges() for the box, as a tuple
+        of inclusive (first, last) tuples.
+        """
+        key = (x_min, y_min, x_max, y_max, max_ranges, max_depth)
+        now = self.clock()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored, ranges = entry
+                if self.ttl is None or now - stored < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return ranges
+                del self._entries[key]
+                self._expirations += 1
+            self._misses += 1
+
+        # computed without the lock, so that other threads are not held up;
+        # two threads missing the same box both compute it
+        ranges = tuple(morton_bbox_ranges(
+            x_min, y_min, x_max, y_max, max_ranges=max_ranges,
+            max_depth=max_depth
+        ))
+
+        with self._lock:
+            self._entries[key] = (now, ranges)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+        return ranges
+
+    def stats(self):
+        """
+        Returns the counters of the cache as a CacheStats namedtuple.
+        """
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              self._expirations, len(self._entries),
+                              self.maxsize)
+
+    def clear(self):
+        """
+        Removes every box from the cache, and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = 0
+            self._evictions = self._expirations = 0
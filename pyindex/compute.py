@@ -1,42 +1,233 @@
 # -*- coding: utf-8 -*-
 
-from collections import defaultdict
+"""
+Generates the forward and reverse Morton lookup tables used by morton.py,
+for any number of dimensions and chunk width.
 
-morton16 = defaultdict(lambda: list())
-morton32 = defaultdict(lambda: list())
+The forward table maps every `chunk_bits`-bit integer to the same integer
+with `dims - 1` 0 bits inserted between each of its bits.
 
+The reverse table maps every chunk of `reverse_bits` bits of an
+interleaved integer (`dims` bits for each integer, at least `chunk_bits`
+in total) to the bits of each integer in that chunk.  These are put in
+lanes of `lane_bits` bits (64 // dims, which is enough for any 64-bit
+interleaved integer), so that the lookups of consecutive chunks can be
+shifted and or-ed together and the integers split apart at the end.
 
-for i in range(256):
-    def mangle(x, y):
-        return (((i >> x) & 1) << y)
+The tables are `array` objects.  get_tables() builds them once per
+process, or reads them from a cache directory where they are saved the
+first time, as larger tables (e.g. 16-bit chunks) take a while to build:
 
-    # 2x8
-    morton16[1].append(mangle(7, 15) + mangle(6, 7) + mangle(5, 14) + \
-                       mangle(4, 6) + mangle(3, 13) + mangle(2, 5) + \
-                       mangle(1, 12) + mangle(0, 4))
-    morton16[0].append(mangle(7, 11) + mangle(6, 3) + mangle(5, 10) + \
-                       mangle(4, 2) + mangle(3, 9) + mangle(2, 1) + \
-                       mangle(1, 8) + mangle(0, 0))
+    python -m pyindex.compute 3 16 --cache-dir ~/.cache/pyindex
 
+prints the tables as hex literals, and saves them if given a directory.
+"""
 
-    # 4x8
-    morton32[3].append(mangle(7, 31) + mangle(6, 23) + mangle(5, 15) + \
-                       mangle(4, 7) + mangle(3, 30) + mangle(2, 22) + \
-                       mangle(1, 14) + mangle(0, 6))
-    morton32[2].append(mangle(7, 29) + mangle(6, 21) + mangle(5, 13) + \
-                       mangle(4, 5) + mangle(3, 28) + mangle(2, 20) + \
-                       mangle(1, 12) + mangle(0, 4))
-    morton32[1].append(mangle(7, 27) + mangle(6, 19) + mangle(5, 11) + \
-                       mangle(4, 3) + mangle(3, 26) + mangle(2, 18) + \
-                       mangle(1, 10) + mangle(0, 2))
-    morton32[0].append(mangle(7, 25) + mangle(6, 17) + mangle(5, 9) + \
-                       mangle(4, 1) + mangle(3, 24) + mangle(2, 16) + \
-                       mangle(1, 8) + mangle(0, 0))
+from __future__ import print_function
 
+import array
+from collections import namedtuple
+import os
+import struct
+import sys
 
-for i in range(2):
-    print ', '.join(map(str, map(hex, morton16[i])))
+# Suggested chunk widths: tables of 256 entries, of 2048 entries (which
+# fit in the CPU cache) and of 65536 entries, for when memory is not an
+# issue.
+CHUNK_BITS = (8, 11, 16)
 
+MAGIC = b'PYMORTON'
+VERSION = 1
 
-for i in range(4):
-    print ', '.join(map(str, morton16[i]))
+# magic, version, dims, chunk_bits, reverse_bits, lane_bits
+HEADER = struct.Struct('<8sHHHHH')
+
+MortonTables = namedtuple('MortonTables', [
+    'dims', 'chunk_bits', 'forward', 'reverse', 'reverse_bits', 'lane_bits'
+])
+
+_TABLES = {}
+
+
+def _typecode(bits):
+    """
+    Returns the typecode of the smallest unsigned `array` type holding
+    `bits` bits.
+    """
+    for typecode in 'BHILQ':
+        if array.array(typecode).itemsize * 8 >= bits:
+            return typecode
+    raise ValueError("no array type holds {} bits".format(bits))
+
+
+def _layout(dims, chunk_bits):
+    """
+    Returns the reverse chunk width and the lane width of the tables.
+    """
+    if dims < 1 or not 1 <= chunk_bits <= 16:
+        raise ValueError(
+            "tables need at least one dimension and 1 to 16-bit chunks"
+        )
+    if dims * chunk_bits > 64:
+        raise ValueError(
+            "{}-bit chunks of {} integers do not fit in 64 bits".format(
+                chunk_bits, dims
+            )
+        )
+    # whole groups of one bit of each integer
+    reverse_bits = dims * -(-chunk_bits // dims)
+    if reverse_bits > 18:
+        raise ValueError(
+            "the reverse table of {} integers would be too large".format(dims)
+        )
+    return reverse_bits, 64 // dims
+
+
+def make_tables(dims, chunk_bits=8):
+    """
+    Builds the forward and reverse Morton lookup tables of `dims` integers
+    interleaved `chunk_bits` bits at a time, and returns them as a
+    MortonTables namedtuple.
+    """
+    reverse_bits, lane_bits = _layout(dims, chunk_bits)
+
+    forward = array.array(_typecode(dims * chunk_bits))
+    for chunk in range(1 << chunk_bits):
+        spread = 0
+        for bit in range(chunk_bits):
+            spread |= ((chunk >> bit) & 1) << (dims * bit)
+        forward.append(spread)
+
+    reverse = array.array(
+        _typecode((dims - 1) * lane_bits + reverse_bits // dims)
+    )
+    for chunk in range(1 << reverse_bits):
+        lanes = 0
+        for bit in range(reverse_bits):
+            lanes |= ((chunk >> bit) & 1) << \
+                (lane_bits * (bit % dims) + bit // dims)
+        reverse.append(lanes)
+
+    return MortonTables(dims, chunk_bits, forward, reverse, reverse_bits,
+                        lane_bits)
+
+
+def _cache_path(cache_dir, dims, chunk_bits):
+    return os.path.join(
+        cache_dir, 'morton-{}x{}.bin'.format(dims, chunk_bits)
+    )
+
+
+def save_tables(tables, path):
+    """
+    Saves tables to a binary file: a header followed by the forward and
+    reverse tables, as little-endian integers.
+    """
+    with open(path, 'wb') as table_file:
+        table_file.write(HEADER.pack(
+            MAGIC, VERSION, tables.dims, tables.chunk_bits,
+            tables.reverse_bits, tables.lane_bits
+        ))
+        for table in (tables.forward, tables.reverse):
+            if sys.byteorder == 'big':
+                table = array.array(table.typecode, table)
+                table.byteswap()
+            table.tofile(table_file)
+
+
+def load_tables(path):
+    """
+    Reads tables saved by save_tables().
+    """
+    with open(path, 'rb') as table_file:
+        magic, version, dims, chunk_bits, reverse_bits, lane_bits = \
+            HEADER.unpack(table_file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a Morton table file".format(path))
+        if (reverse_bits, lane_bits) != _layout(dims, chunk_bits):
+            raise ValueError("{} has an unknown table layout".format(path))
+
+        forward = array.array(_typecode(dims * chunk_bits))
+        forward.fromfile(table_file, 1 << chunk_bits)
+        reverse = array.array(
+            _typecode((dims - 1) * lane_bits + reverse_bits // dims)
+        )
+        reverse.fromfile(table_file, 1 << reverse_bits)
+        if sys.byteorder == 'big':
+            forward.byteswap()
+            reverse.byteswap()
+
+    return MortonTables(dims, chunk_bits, forward, reverse, reverse_bits,
+                        lane_bits)
+
+
+def get_tables(dims, chunk_bits=8, cache_dir=None):
+    """
+    Returns the MortonTables of `dims` integers and `chunk_bits`-bit
+    chunks, built once per process.
+
+    cache_dir: directory to read the tables from, where they are saved if
+               they are not there yet
+    """
+    key = (dims, chunk_bits)
+    if key in _TABLES:
+        return _TABLES[key]
+
+    path = None
+    if cache_dir is not None:
+        path = _cache_path(cache_dir, dims, chunk_bits)
+        if os.path.exists(path):
+            _TABLES[key] = load_tables(path)
+            return _TABLES[key]
+
+    tables = make_tables(dims, chunk_bits)
+    if path is not None:
+        # write to a temporary file first so that concurrent processes
+        # never read half a table
+        temp_path = '{}.{}'.format(path, os.getpid())
+        save_tables(tables, temp_path)
+        os.rename(temp_path, path)
+
+    _TABLES[key] = tables
+    return tables
+
+
+def _print_table(table, width):
+    digits = -(-width // 4)
+    for start in range(0, len(table), 8):
+        print('    ' + ', '.join(
+            '0x{:0{}X}'.format(entry, digits)
+            for entry in table[start:start + 8]
+        ) + ',')
+
+
+def main(args=None):
+    # only needed here, kept off the import path of morton.py
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Print the Morton lookup tables of DIMS integers."
+    )
+    parser.add_argument('dims', type=int)
+    parser.add_argument('chunk_bits', type=int, nargs='?', default=8)
+    parser.add_argument('--cache-dir',
+                        help="save the tables to this directory too")
+    args = parser.parse_args(args)
+
+    if args.cache_dir is not None:
+        tables = get_tables(args.dims, args.chunk_bits, args.cache_dir)
+    else:
+        tables = make_tables(args.dims, args.chunk_bits)
+
+    print("# {} entries morton table -- for {} bits which will "
+          "become {}".format(len(tables.forward), tables.chunk_bits,
+                             tables.dims * tables.chunk_bits))
+    _print_table(tables.forward, tables.dims * tables.chunk_bits)
+    print("# {} entries reverse morton table -- for {} bits in {}-bit "
+          "lanes".format(len(tables.reverse), tables.reverse_bits,
+                         tables.lane_bits))
+    _print_table(tables.reverse, tables.dims * tables.lane_bits)
+
+
+if __name__ == '__main__':
+    main()
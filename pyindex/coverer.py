@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+
+"""
+Coverings of polygons with Morton cells, for geofencing.
+
+A cell is a (prefix, level) pair, as in zorder.cell_range(): the
+morton.interleave_64 keys starting with the 2 * level bits of `prefix`,
+which are a square of the 32-bit grid (a tile of tiles.py at zoom
+`level`).
+
+RegionCoverer approximates a region with at most `max_cells` cells of
+levels between `min_level` and `max_level`, like the RegionCoverer of S2,
+as two lists: the interior cells, entirely inside the region, and the
+boundary cells, which its edges cross.  Whether a point is inside then
+takes a lookup of its key in the sorted cells, and only the points of the
+boundary cells need the exact polygon test.  GeofenceIndex does this for
+many polygons and points at once.
+
+Polygons have straight edges on the grid of the keys, i.e. in longitude
+and latitude for geospatial.LonLat, and do not cross the antimeridian.
+Points are tested at their position on the grid, so up to a grid cell
+(under a centimetre) from their co-ordinates.
+
+Ref.: http://s2geometry.io/devguide/s2cell_hierarchy.html#coverings
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+from ._lazy import LazyModule
+from .geospatial import LonLat
+from .morton import deinterleave_64_batch, UINT32
+from .zorder import cell_range, INSIDE, merge_ranges, OUTSIDE, PARTIAL
+
+# numpy is only imported once a polygon needs it
+np = LazyModule('numpy')
+
+# level at which a cell is a single point of the 32-bit grid
+MAX_LEVEL = 32
+
+# number of (cell or point, edge) pairs tested at once
+BLOCK = 1 << 20
+
+Covering = namedtuple('Covering', ['interior', 'boundary'])
+
+
+def _crossings(x, y, x1, y1, x2, y2):
+    """
+    Returns whether the rays going east of the points (x, y) cross the
+    edges from (x1, y1) to (x2, y2), for arrays broadcast together.
+    """
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return straddles & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+
+
+def _blocks(count, width):
+    """
+    Returns the slices of `count` rows of `width` values each to work on
+    at once.
+    """
+    step = max(1, BLOCK // max(width, 1))
+    return [slice(start, start + step) for start in range(0, count, step)]
+
+
+class Polygon(object):
+    """
+    Polygon of (lon, lat) vertices on the grid of the interleave_64 keys
+    of `lonlat`.  The last vertex of a ring is joined to the first.
+
+    Points inside an odd number of the rings are inside, so holes may be
+    given as further rings.
+
+    exterior: sequence of the (lon, lat) vertices of the outline
+    holes: sequence of sequences of (lon, lat) vertices
+    lonlat: geospatial.LonLat or one of its subclasses
+    """
+
+    def __init__(self, exterior, holes=(), lonlat=LonLat):
+        self.lonlat = lonlat
+        lon_range, lat_range = lonlat._ranges()
+
+        starts = []
+        for ring in [exterior] + list(holes):
+            ring = np.asarray(ring, dtype=np.float64)
+            if ring.ndim != 2 or ring.shape[1] != 2 or len(ring) < 3:
+                raise ValueError("a ring must have at least 3 (lon, lat) "
+                                 "vertices")
+            # onto the grid, where keys of points truncate these
+            starts.append(
+                (ring + (lon_range / 2, lat_range / 2)) /
+                (lon_range, lat_range) * UINT32
+            )
+        ends = [np.roll(ring, -1, axis=0) for ring in starts]
+
+        # the edges as (x1, y1, x2, y2) rows
+        self.edges = np.hstack([np.concatenate(starts),
+                                np.concatenate(ends)])
+        vertices = self.edges[:, :2]
+        self.bounds = tuple(vertices.min(axis=0)) + \
+            tuple(vertices.max(axis=0))
+
+    def __len__(self):
+        return len(self.edges)
+
+    def contains_grid_batch(self, x, y):
+        """
+        Returns a boolean array of whether the points of arrays of grid
+        co-ordinates are inside the polygon.  Points on an edge may be
+        either.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        x_min, y_min, x_max, y_max = self.bounds
+        candidates = np.flatnonzero(
+            (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        )
+
+        inside = np.zeros(len(x), dtype=bool)
+        x1, y1, x2, y2 = self.edges.T
+        for block in _blocks(len(candidates), len(self.edges)):
+            points = candidates[block]
+            crossings = _crossings(x[points, np.newaxis],
+                                   y[points, np.newaxis], x1, y1, x2, y2)
+            inside[points] = np.count_nonzero(crossings, axis=1) % 2 == 1
+        return inside
+
+    def contains_batch(self, lon, lat):
+        """
+        Returns a boolean array of whether the points of arrays of
+        longitudes and latitudes are inside the polygon, computed on the
+        grid of their keys.
+        """
+        return self.contains_grid_batch(*self.lonlat.grid_batch(lon, lat))
+
+    def classify(self, mins, maxs):
+        """
+        Classifies cells for zorder.cover_ranges_batch(): takes the
+        inclusive (mins, maxs) corners of cells as (y, x) arrays of grid
+        co-ordinates and returns an array of OUTSIDE, PARTIAL or INSIDE.
+
+        A cell is PARTIAL when an edge passes within one grid unit of it,
+        so that all the points of the other cells are clear of the edges,
+        and rounding cannot put them on the wrong side.
+        """
+        south = mins[0] - 1.0
+        west = mins[1] - 1.0
+        north = maxs[0] + 1.0
+        east = maxs[1] + 1.0
+
+        kinds = np.full(len(south), OUTSIDE, dtype=np.int8)
+        x_min, y_min, x_max, y_max = self.bounds
+        near = np.flatnonzero((west <= x_max) & (east >= x_min) &
+                              (south <= y_max) & (north >= y_min))
+
+        x1, y1, x2, y2 = self.edges.T
+        edge_west, edge_east = np.minimum(x1, x2), np.maximum(x1, x2)
+        edge_south, edge_north = np.minimum(y1, y2), np.maximum(y1, y2)
+        crossed = np.zeros(len(near), dtype=bool)
+        for block in _blocks(len(near), len(self.edges)):
+            cells = near[block]
+            cell_west = west[cells, np.newaxis]
+            cell_east = east[cells, np.newaxis]
+            cell_south = south[cells, np.newaxis]
+            cell_north = north[cells, np.newaxis]
+            overlaps = (edge_west <= cell_east) & (edge_east >= cell_west) & \
+                (edge_south <= cell_north) & (edge_north >= cell_south)
+
+            # the side of the line of the edge of each corner is the sign
+            # of dx * (y - y1) - dy * (x - x1), relative to the edge so
+            # that rounding stays well under a grid unit
+            along_y = (x2 - x1) * (np.stack([cell_south, cell_north]) - y1)
+            along_x = (y2 - y1) * (np.stack([cell_west, cell_east]) - x1)
+            lowest = along_y.min(axis=0) - along_x.max(axis=0)
+            highest = along_y.max(axis=0) - along_x.min(axis=0)
+            crossed[block] = (
+                overlaps & (lowest <= 0) & (highest >= 0)
+            ).any(axis=1)
+
+        kinds[near[crossed]] = PARTIAL
+        # the other cells are all inside or all outside: test a point
+        clear = near[~crossed]
+        inside = self.contains_grid_batch(mins[1][clear], mins[0][clear])
+        kinds[clear[inside]] = INSIDE
+        return kinds
+
+
+def covering_ranges(cells):
+    """
+    Returns the sorted list of merged inclusive (first, last) key ranges
+    of a list of (prefix, level) cells, e.g. of a Covering.
+    """
+    return merge_ranges(sorted(
+        cell_range(prefix, level) for prefix, level in cells
+    ))
+
+
+def _sorted_cells(cells):
+    """
+    Returns a list of (prefix, level) tuples sorted by key from a list of
+    (prefixes, level) pairs of uint64 arrays and levels.
+    """
+    return sorted(
+        ((prefix, level) for prefixes, level in cells
+         for prefix in prefixes.tolist()),
+        key=lambda cell: cell[0] << (2 * (MAX_LEVEL - cell[1]))
+    )
+
+
+class RegionCoverer(object):
+    """
+    Approximates regions with cells of interleave_64 keys, like the
+    RegionCoverer of S2.
+
+    Cells crossing the boundary of the region are split, the largest
+    first and among those the ones with the fewest children in the region
+    first, while the covering stays within `max_cells` cells.  Cells
+    inside the region are not split.
+
+    min_level: level of the largest cells, larger ones are split even if
+               the covering then has more than `max_cells` cells
+    max_level: level of the smallest cells
+    max_cells: maximum number of cells of a covering
+    """
+
+    def __init__(self, min_level=0, max_level=MAX_LEVEL, max_cells=8):
+        if not 0 <= min_level <= max_level <= MAX_LEVEL:
+            raise ValueError(
+                "levels must be 0 <= min_level <= max_level <= {}".format(
+                    MAX_LEVEL
+                ))
+        if max_cells < 1:
+            raise ValueError("max_cells must be at least 1")
+        self.min_level = min_level
+        self.max_level = max_level
+        self.max_cells = max_cells
+
+    def covering(self, region):
+        """
+        Returns the Covering of `region`: the lists of its interior and
+        boundary cells, as (prefix, level) tuples sorted by key.
+
+        region: Polygon, or any object with a classify() method like
+                Polygon.classify()
+        """
+        zero = np.zeros(1, dtype=np.int64)
+        kind = region.classify((zero, zero), (zero + UINT32, zero + UINT32))
+        if kind[0] == OUTSIDE:
+            return Covering([], [])
+
+        prefixes = np.zeros(1, dtype=np.uint64)
+        mins = (zero, zero)
+        kinds = kind.astype(np.int8)
+        interior, boundary = [], []
+        level = 0
+        children = np.arange(4, dtype=np.uint64)
+        # the (y, x) offsets of the children, y being the lower bit
+        offsets = (np.array([0, 1, 0, 1]), np.array([0, 0, 1, 1]))
+
+        while level < self.max_level:
+            if level >= self.min_level:
+                # the largest cells are settled, only boundary ones are split
+                inside = kinds == INSIDE
+                interior.append((prefixes[inside], level))
+                prefixes = prefixes[~inside]
+                mins = tuple(low[~inside] for low in mins)
+                kinds = kinds[~inside]
+                if not prefixes.size:
+                    break
+
+            half = 1 << (MAX_LEVEL - level - 1)
+            child_prefixes = ((prefixes[:, np.newaxis] << np.uint64(2)) |
+                              children).ravel()
+            child_mins = tuple(
+                (low[:, np.newaxis] + offset * half).ravel()
+                for low, offset in zip(mins, offsets)
+            )
+            # the children of interior cells, split to reach min_level, are
+            # inside too
+            child_kinds = np.repeat(kinds, 4)
+            split = child_kinds != INSIDE
+            child_kinds[split] = region.classify(
+                tuple(low[split] for low in child_mins),
+                tuple(low[split] + (half - 1) for low in child_mins)
+            )
+
+            if level >= self.min_level:
+                # every split replaces a cell with its children in the
+                # region: take the cheapest splits within the budget
+                growth = np.count_nonzero(
+                    child_kinds.reshape(-1, 4) != OUTSIDE, axis=1
+                ) - 1
+                count = sum(len(cells) for cells, _ in interior) + \
+                    sum(len(cells) for cells, _ in boundary) + len(prefixes)
+                order = np.argsort(growth, kind='stable')
+                fits = np.cumsum(growth[order]) <= self.max_cells - count
+                accepted = np.zeros(len(prefixes), dtype=bool)
+                accepted[order[fits]] = True
+                boundary.append((prefixes[~accepted], level))
+                if not accepted.any():
+                    prefixes = prefixes[accepted]
+                    break
+                keep = np.repeat(accepted, 4)
+            else:
+                keep = np.ones(len(child_kinds), dtype=bool)
+
+            keep &= child_kinds != OUTSIDE
+            prefixes = child_prefixes[keep]
+            mins = tuple(low[keep] for low in child_mins)
+            kinds = child_kinds[keep]
+            level += 1
+
+        if prefixes.size:
+            # at max_level
+            inside = kinds == INSIDE
+            interior.append((prefixes[inside], level))
+            boundary.append((prefixes[~inside], level))
+
+        return Covering(_sorted_cells(interior), _sorted_cells(boundary))
+
+    def interior_covering(self, region):
+        """
+        Returns the interior cells of the covering of `region`.
+        """
+        return self.covering(region).interior
+
+
+class GeofenceIndex(object):
+    """
+    Finds which of many polygons points are in.
+
+    Every polygon is covered with `coverer`, and the key ranges of the
+    cells of all of them are bisected in the sorted keys of the points:
+    points in interior cells are inside their polygons, and only those in
+    boundary cells are tested against the edges of theirs, in one
+    vectorised pass for all the polygons.
+
+    polygons: sequence of Polygon, which must share their `lonlat`
+    coverer: RegionCoverer, defaults to one of max_cells=64
+    """
+
+    def __init__(self, polygons, coverer=None):
+        self.polygons = list(polygons)
+        lonlats = set(polygon.lonlat for polygon in self.polygons)
+        if len(lonlats) > 1:
+            raise ValueError("the polygons must share their lonlat")
+        self.lonlat = lonlats.pop() if lonlats else LonLat
+        self.coverer = coverer or RegionCoverer(max_cells=64)
+
+        # the key ranges of the cells of all the polygons, in no order
+        ranges, fences, interior = [], [], []
+        for fence, polygon in enumerate(self.polygons):
+            covering = self.coverer.covering(polygon)
+            for cells, inside in ((covering.interior, True),
+                                  (covering.boundary, False)):
+                ranges.extend(cell_range(prefix, level)
+                              for prefix, level in cells)
+                fences.extend([fence] * len(cells))
+                interior.extend([inside] * len(cells))
+        self._firsts, self._lasts = np.array(
+            ranges, dtype=np.uint64
+        ).reshape(-1, 2).T
+        self._fences = np.array(fences, dtype=np.intp)
+        self._interior = np.array(interior, dtype=bool)
+
+        # the edges of all the polygons, those of polygon i starting at
+        # edge_starts[i]
+        sizes = [len(polygon) for polygon in self.polygons]
+        self._edge_counts = np.array(sizes, dtype=np.intp)
+        self._edge_starts = np.cumsum([0] + sizes[:-1]).astype(np.intp)
+        self._edges = np.concatenate(
+            [polygon.edges for polygon in self.polygons] or
+            [np.empty((0, 4))]
+        )
+
+    def _candidates(self, keys):
+        """
+        Returns the arrays of positions in `keys`, polygons and whether
+        the cell is interior, of the cells the keys are in.
+
+        The keys are sorted once and the ranges of all the cells bisected
+        in them, which is much cheaper than looking up every key when
+        there are fewer cells than keys.
+        """
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.searchsorted(sorted_keys, self._firsts, 'left')
+        lengths = np.searchsorted(sorted_keys, self._lasts, 'right') - starts
+        # every key of every cell, one after the other
+        ends = np.cumsum(lengths)
+        total = ends[-1] if len(ends) else 0
+        cells = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(total) + np.repeat(starts - ends + lengths,
+                                                 lengths)
+        return order[positions], self._fences[cells], self._interior[cells]
+
+    def _contains_pairs(self, x, y, fences):
+        """
+        Returns a boolean array of whether the grid points (x, y) are
+        inside the parallel array of polygons `fences`.
+        """
+        inside = np.zeros(len(fences), dtype=bool)
+        counts = self._edge_counts[fences]
+        ends = np.cumsum(counts)
+        # blocks of pairs testing about BLOCK edges at once
+        splits = np.searchsorted(ends, np.arange(BLOCK, ends[-1] if len(ends)
+                                                 else 0, BLOCK))
+        for pairs in np.split(np.arange(len(fences)), splits):
+            if not pairs.size:
+                continue
+            lengths = counts[pairs]
+            block_ends = np.cumsum(lengths)
+            # every edge of the polygon of every pair
+            owners = np.repeat(np.arange(len(pairs)), lengths)
+            edges = self._edges[
+                np.arange(block_ends[-1]) +
+                np.repeat(self._edge_starts[fences[pairs]] - block_ends +
+                          lengths, lengths)
+            ]
+            crossings = _crossings(x[pairs][owners], y[pairs][owners],
+                                   *edges.T)
+            inside[pairs] = np.bincount(owners[crossings],
+                                        minlength=len(pairs)) % 2 == 1
+        return inside
+
+    def locate_keys_batch(self, keys):
+        """
+        Returns the arrays of the positions in `keys` and the indices in
+        `polygons` of each point inside a polygon, sorted by position and
+        polygon.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        points, fences, interior = self._candidates(keys)
+
+        boundary = np.flatnonzero(~interior)
+        x, y = deinterleave_64_batch(keys[points[boundary]])
+        inside = interior.copy()
+        inside[boundary] = self._contains_pairs(
+            x.astype(np.float64), y.astype(np.float64), fences[boundary]
+        )
+
+        points, fences = points[inside], fences[inside]
+        order = np.lexsort((fences, points))
+        return points[order], fences[order]
+
+    def locate_batch(self, lon, lat):
+        """
+        Returns the arrays of the positions in the arrays of longitudes
+        and latitudes and the indices in `polygons` of each point inside a
+        polygon, sorted by position and polygon.
+        """
+        return self.locate_keys_batch(self.lonlat.interleave_batch(lon, lat))
+
+    def contains_batch(self, lon, lat):
+        """
+        Returns a boolean array of whether the points of arrays of
+        longitudes and latitudes are inside any of the polygons.
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        points, _ = self.locate_batch(lon, lat)
+        inside = np.zeros(lon.shape, dtype=bool)
+        inside.flat[points] = True
+        return inside
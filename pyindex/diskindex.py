@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk format for Morton indexes, read through mmap.
+
+A file holds, in this order and little-endian:
+
+- a 64-byte header (see HEADER): magic, version, number of points, fence
+  stride and count, and the offsets of the three blocks below
+- the sorted uint64 Morton keys
+- the int64 payload ids, parallel to the keys
+- the fence: every `fence_stride`th key, a sparse top-level index
+
+The reader maps the file and looks the keys up in place, so opening an
+index costs a few system calls whatever its size, processes opening the
+same file share its pages through the page cache, and a query only
+touches the fence and the pages around its ranges.
+"""
+
+from __future__ import division
+
+import mmap
+import struct
+
+import numpy as np
+
+from .index import LonLatIndex, MortonIndex
+
+MAGIC = b'PYINDEXM'
+VERSION = 1
+
+# magic, version, reserved, count, fence_stride, fence_count, keys_offset,
+# ids_offset, fence_offset
+HEADER = struct.Struct('<8sII6Q')
+
+DEFAULT_FENCE_STRIDE = 512
+
+KEY_DTYPE = np.dtype('<u8')
+ID_DTYPE = np.dtype('<i8')
+
+
+def _layout(count, fence_stride):
+    """
+    Returns the fence count and the offsets of the key, id and fence blocks
+    of a file of `count` points.
+    """
+    fence_count = (count + fence_stride - 1) // fence_stride
+    keys_offset = HEADER.size
+    ids_offset = keys_offset + count * KEY_DTYPE.itemsize
+    fence_offset = ids_offset + count * ID_DTYPE.itemsize
+    return fence_count, keys_offset, ids_offset, fence_offset
+
+
+class IndexWriter(object):
+    """
+    Writes an index file from sorted chunks of keys and ids, so that
+    indexes larger than memory can be written a chunk at a time.
+
+    count: total number of points which will be appended
+    """
+
+    def __init__(self, path, count, fence_stride=DEFAULT_FENCE_STRIDE):
+        self.count = count
+        self.fence_stride = fence_stride
+        self.written = 0
+        self.last_key = None
+        self.fence = []
+
+        (self.fence_count, self.keys_offset, self.ids_offset,
+         self.fence_offset) = _layout(count, fence_stride)
+
+        self.file = open(path, 'wb')
+        self.file.truncate(
+            self.fence_offset + self.fence_count * KEY_DTYPE.itemsize
+        )
+
+    def append(self, keys, ids):
+        """
+        Appends sorted keys and their ids, all greater than or equal to the
+        keys appended before.
+        """
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        ids = np.asarray(ids, dtype=ID_DTYPE)
+        if keys.shape != ids.shape:
+            raise ValueError("keys and ids must have the same shape")
+        if self.written + len(keys) > self.count:
+            raise ValueError(
+                "cannot write more than {} points".format(self.count)
+            )
+        if not len(keys):
+            return
+        if (self.last_key is not None and keys[0] < self.last_key) or \
+                (keys[1:] < keys[:-1]).any():
+            raise ValueError("keys must be appended in sorted order")
+
+        first_fence = -self.written % self.fence_stride
+        self.fence.append(keys[first_fence::self.fence_stride])
+
+        self.file.seek(self.keys_offset + self.written * KEY_DTYPE.itemsize)
+        keys.tofile(self.file)
+        self.file.seek(self.ids_offset + self.written * ID_DTYPE.itemsize)
+        ids.tofile(self.file)
+
+        self.written += len(keys)
+        self.last_key = keys[-1]
+
+    def close(self):
+        """
+        Writes the fence and the header, and closes the file.
+        """
+        if self.file.closed:
+            return
+        if self.written != self.count:
+            self.file.close()
+            raise ValueError("{} points were written instead of {}".format(
+                self.written, self.count
+            ))
+
+        self.file.seek(self.fence_offset)
+        if self.fence:
+            np.concatenate(self.fence).astype(KEY_DTYPE).tofile(self.file)
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, 0, self.count, self.fence_stride,
+            self.fence_count, self.keys_offset, self.ids_offset,
+            self.fence_offset
+        ))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def write(path, index, fence_stride=DEFAULT_FENCE_STRIDE):
+    """
+    Writes a MortonIndex (or LonLatIndex) to an index file.
+    """
+    with IndexWriter(path, len(index), fence_stride) as writer:
+        writer.append(index.keys, index.ids)
+
+
+class _MappedIndex(object):
+    """
+    Mixin opening an index file through mmap and replacing the bisection of
+    the whole key array by a bisection of the fence followed by one of a
+    single `fence_stride` block of keys.
+    """
+
+    def _open(self, path):
+        with open(path, 'rb') as index_file:
+            self.mmap = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        (magic, version, _, count, self.fence_stride, fence_count,
+         keys_offset, ids_offset, fence_offset) = \
+            HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            self.mmap.close()
+            raise ValueError("{} is not an index file".format(path))
+        if version != VERSION:
+            self.mmap.close()
+            raise ValueError(
+                "unsupported index file version {}".format(version)
+            )
+
+        self.fence = np.frombuffer(
+            self.mmap, KEY_DTYPE, fence_count, fence_offset
+        )
+        return (np.frombuffer(self.mmap, KEY_DTYPE, count, keys_offset),
+                np.frombuffer(self.mmap, ID_DTYPE, count, ids_offset))
+
+    def _search(self, firsts, lasts):
+        return (self._fenced_search(firsts, 'left'),
+                self._fenced_search(lasts, 'right'))
+
+    def _fenced_search(self, values, side):
+        """
+        Returns the positions np.searchsorted(keys, values, side) without
+        bisecting the whole key array: all the values bisect the fence,
+        then the block of keys between their two fence keys together.
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        blocks = np.searchsorted(self.fence, values, side=side)
+
+        # the key at fence `block` bounds the result from above, the one
+        # at fence `block - 1` from below
+        low = np.maximum(blocks - 1, 0) * self.fence_stride
+        high = np.minimum(blocks * self.fence_stride + 1, len(self.keys))
+        while True:
+            searching = low < high
+            if not searching.any():
+                return low if low.ndim else low[()]
+            middle = (low + high) // 2
+            # past the end for the values which are done, which keep theirs
+            below = self.keys[np.where(searching, middle, 0)]
+            below = (below < values) if side == 'left' else (below <= values)
+            low = np.where(searching & below, middle + 1, low)
+            high = np.where(searching & ~below, middle, high)
+
+    def close(self):
+        """
+        Unmaps the file.  The index cannot be used afterwards.
+
+        Arrays still viewing the file, like `keys` or `ids` taken from the
+        index, keep it mapped until they are released.
+        """
+        if self.mmap is None:
+            return
+        self.keys = self.ids = self.fence = None
+        mapped, self.mmap = self.mmap, None
+        try:
+            mapped.close()
+        except BufferError:
+            # the views hold the mmap, which unmaps itself once they go
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MortonIndexFile(_MappedIndex, MortonIndex):
+    """
+    MortonIndex read from an index file.
+    """
+
+    def __init__(self, path, max_ranges=64, range_cache=None):
+        keys, ids = self._open(path)
+        super(MortonIndexFile, self).__init__(
+            keys, ids, max_ranges=max_ranges, range_cache=range_cache
+        )
+
+
+class LonLatIndexFile(_MappedIndex, LonLatIndex):
+    """
+    LonLatIndex read from an index file.  The file must have been written
+    from an index with the same `lonlat` class.
+    """
+
+    def __init__(self, path, max_ranges=64, lonlat=None, range_cache=None):
+        keys, ids = self._open(path)
+        kwargs = {} if lonlat is None else {'lonlat': lonlat}
+        super(LonLatIndexFile, self).__init__(
+            keys, ids, max_ranges=max_ranges, range_cache=range_cache,
+            **kwargs
+        )
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+Geohashes from Morton keys.
+
+A geohash of `precision` characters is the top 5 * precision bits of the
+interleaved longitude and latitude bits, longitude first, written in a
+base 32 alphabet.  morton.interleave_64 puts the longitude (x) bits in the
+odd positions, so the top bits of its keys are those of the geohash, and
+a geohash is encoded by interleaving once and cutting the key, rather than
+by bisecting the cell a bit at a time.
+
+The grid is that of geospatial.LonLat, scaled to 2 ** 32 rather than
+UINT32 so that its cells are those of the geohash bisections.
+"""
+
+from __future__ import division
+
+from ._lazy import LazyModule
+from .geospatial import LonLat
+from .morton import deinterleave_64, deinterleave_64_batch, interleave_64, \
+    interleave_64_batch, UINT32
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+_DECODE = dict((char, value) for value, char in enumerate(BASE32))
+
+# characters of 5 bits in 64-bit keys
+MAX_PRECISION = 12
+
+# (dx, dy) of the neighbours of a cell
+DIRECTIONS = {
+    'n': (0, 1), 'ne': (1, 1), 'e': (1, 0), 'se': (1, -1),
+    's': (0, -1), 'sw': (-1, -1), 'w': (-1, 0), 'nw': (-1, 1),
+}
+
+
+def _check_precision(precision):
+    if not 1 <= precision <= MAX_PRECISION:
+        raise ValueError("precision must be between 1 and {}, not {}".format(
+            MAX_PRECISION, precision
+        ))
+
+
+def _bits(precision):
+    """
+    Returns the number of longitude and latitude bits of a geohash.
+    """
+    bits = 5 * precision
+    return bits - bits // 2, bits // 2
+
+
+def key(lon, lat):
+    """
+    Returns the 64-bit key of (lon, lat) whose top bits are its geohash.
+    """
+    lon_range, lat_range = LonLat._ranges()
+    x = min(int((lon + lon_range / 2) / lon_range * (1 << 32)), UINT32)
+    y = min(int((lat + lat_range / 2) / lat_range * (1 << 32)), UINT32)
+    return interleave_64(max(x, 0), max(y, 0))
+
+
+def keys_batch(lon, lat):
+    """
+    Returns a uint64 array of the keys of arrays of longitudes and
+    latitudes.  This is the array equivalent of key().
+    """
+    lon_range, lat_range = LonLat._ranges()
+    x = np.asarray(lon, dtype=np.float64) + lon_range / 2
+    x *= (1 << 32) / lon_range
+    y = np.asarray(lat, dtype=np.float64) + lat_range / 2
+    y *= (1 << 32) / lat_range
+    return interleave_64_batch(
+        np.clip(x, 0, UINT32).astype(np.uint32),
+        np.clip(y, 0, UINT32).astype(np.uint32)
+    )
+
+
+def _value(geohash):
+    """
+    Returns the bits of a geohash as an integer.
+    """
+    _check_precision(len(geohash))
+    value = 0
+    for char in geohash:
+        try:
+            value = (value << 5) | _DECODE[char]
+        except KeyError:
+            raise ValueError("{!r} is not a geohash".format(geohash))
+    return value
+
+
+def _cell(value, precision):
+    """
+    Returns the x and y of the cell of the geohash bits `value`.
+    """
+    if precision % 2:
+        # an odd number of bits ends with a longitude bit
+        x, y = deinterleave_64(value << 1)
+        return x, y >> 1
+    return deinterleave_64(value)
+
+
+def _uncell(x, y, precision):
+    """
+    Returns the geohash bits of the cell (x, y).  This is the inverse of
+    _cell().
+    """
+    if precision % 2:
+        return interleave_64(x, y << 1) >> 1
+    return interleave_64(x, y)
+
+
+def _string(value, precision):
+    return ''.join(
+        BASE32[(value >> shift) & 31]
+        for shift in range(5 * precision - 5, -1, -5)
+    )
+
+
+def encode(lon, lat, precision=MAX_PRECISION):
+    """
+    Returns the geohash of (lon, lat) with `precision` characters.
+    """
+    _check_precision(precision)
+    return _string(key(lon, lat) >> (64 - 5 * precision), precision)
+
+
+def bbox(geohash):
+    """
+    Returns the (lon_min, lat_min, lon_max, lat_max) box of a geohash.
+    """
+    precision = len(geohash)
+    x, y = _cell(_value(geohash), precision)
+    lon_bits, lat_bits = _bits(precision)
+    lon_range, lat_range = LonLat._ranges()
+    width = lon_range / (1 << lon_bits)
+    height = lat_range / (1 << lat_bits)
+    lon_min = x * width - lon_range / 2
+    lat_min = y * height - lat_range / 2
+    return lon_min, lat_min, lon_min + width, lat_min + height
+
+
+def decode(geohash):
+    """
+    Returns the LonLat of the centre of a geohash.
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox(geohash)
+    return LonLat((lon_min + lon_max) / 2, (lat_min + lat_max) / 2)
+
+
+def neighbours(geohash):
+    """
+    Returns the geohashes of the cells around a geohash, as a dict from
+    their direction ('n', 'ne', ... 'nw') to their geohash.  Cells wrap
+    around the antimeridian, and there are none past the poles.
+    """
+    precision = len(geohash)
+    x, y = _cell(_value(geohash), precision)
+    lon_bits, lat_bits = _bits(precision)
+
+    found = {}
+    for direction, (dx, dy) in DIRECTIONS.items():
+        if not 0 <= y + dy < 1 << lat_bits:
+            continue
+        value = _uncell((x + dx) % (1 << lon_bits), y + dy, precision)
+        found[direction] = _string(value, precision)
+    return found
+
+
+def prefix_range(geohash):
+    """
+    Returns the inclusive (first, last) range of the keys (see key())
+    whose geohash starts with `geohash`.
+    """
+    shift = 64 - 5 * len(geohash)
+    value = _value(geohash)
+    return value << shift, ((value + 1) << shift) - 1
+
+
+def encode_batch(lon, lat, precision=MAX_PRECISION):
+    """
+    Returns an array of the geohashes of arrays of longitudes and
+    latitudes.  This is the array equivalent of encode().
+    """
+    _check_precision(precision)
+    values = keys_batch(lon, lat) >> np.uint64(64 - 5 * precision)
+    shifts = np.arange(5 * precision - 5, -1, -5, dtype=np.uint64)
+    # one byte per character, read back as strings of `precision` bytes
+    chars = np.frombuffer(BASE32.encode('ascii'), dtype=np.uint8)[
+        (values[..., np.newaxis] >> shifts) & np.uint64(31)
+    ]
+    return chars.view('S{}'.format(precision))[..., 0].astype(
+        'U{}'.format(precision)
+    )
+
+
+def decode_batch(geohashes):
+    """
+    Returns arrays of the longitudes and latitudes of the centres of an
+    array of geohashes, which must all have the same precision.  This is
+    the array equivalent of decode().
+    """
+    geohashes = np.asarray(geohashes, dtype=np.bytes_)
+    precision = geohashes.dtype.itemsize
+    _check_precision(precision)
+
+    # 255 for the characters which are not in the alphabet, including the
+    # null bytes padding shorter geohashes
+    table = np.full(256, 255, dtype=np.uint8)
+    table[np.frombuffer(BASE32.encode('ascii'), dtype=np.uint8)] = \
+        np.arange(32)
+    chars = table[np.frombuffer(
+        np.ascontiguousarray(geohashes).tobytes(), dtype=np.uint8
+    ).reshape(geohashes.shape + (precision,))]
+    if (chars == 255).any():
+        raise ValueError("geohashes must be strings of the same length of "
+                         "the base 32 alphabet")
+
+    values = np.zeros(geohashes.shape, dtype=np.uint64)
+    for char in range(precision):
+        values <<= np.uint64(5)
+        values |= chars[..., char]
+
+    lon_bits, lat_bits = _bits(precision)
+    x, y = deinterleave_64_batch(values << np.uint64(precision % 2))
+    if precision % 2:
+        y >>= np.uint32(1)
+
+    lon_range, lat_range = LonLat._ranges()
+    lon = (x + 0.5) * (lon_range / (1 << lon_bits)) - lon_range / 2
+    lat = (y + 0.5) * (lat_range / (1 << lat_bits)) - lat_range / 2
+    return lon, lat
@@ -9,7 +9,20 @@ from __future__ import division
 from collections import namedtuple
 import math
 
-from morton import deinterleave_64, interleave_64, UINT32
+from ._lazy import LazyModule
+from .morton import (
+    deinterleave_16, deinterleave_16_batch, deinterleave_32,
+    deinterleave_32_batch, deinterleave_64, deinterleave_64_batch,
+    interleave_16, interleave_16_batch, interleave_32, interleave_32_batch,
+    interleave_64, interleave_64_batch, UINT32
+)
+from .zorder import cover_ranges_batch, INSIDE, OUTSIDE, PARTIAL
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
+# Mean radius of the Earth, in metres
+EARTH_RADIUS = 6371008.8
 
 _LonLat = namedtuple('_LonLat', ['lon', 'lat'])
 class LonLat(_LonLat):
@@ -34,13 +47,21 @@ class LonLat(_LonLat):
     def y(self):
         return self.lat
 
+    @classmethod
+    def _ranges(cls):
+        """
+        Returns the longitude and latitude ranges used to scale the
+        co-ordinates to 32-bit integers.
+        """
+        return (int(math.ceil(cls.MAX_LON - cls.MIN_LON)),
+                int(math.ceil(cls.MAX_LAT - cls.MIN_LAT)))
+
     @property
     def interleaved(self):
         """
         Returns a 64-bit interleaved integer of the co-ordinates.
         """
-        lon_range = int(math.ceil(self.MAX_LON - self.MIN_LON))
-        lat_range = int(math.ceil(self.MAX_LAT - self.MIN_LAT))
+        lon_range, lat_range = self._ranges()
 
         # Preventing ourselves from exceeding the range.
         # These will be between [0..1]
@@ -61,8 +82,7 @@ class LonLat(_LonLat):
 
     @classmethod
     def deinterleave(cls, coordinates):
-        lon_range = int(math.ceil(cls.MAX_LON - cls.MIN_LON))
-        lat_range = int(math.ceil(cls.MAX_LAT - cls.MIN_LAT))
+        lon_range, lat_range = cls._ranges()
 
         lon, lat = deinterleave_64(coordinates)
 
@@ -72,6 +92,284 @@ class LonLat(_LonLat):
 
         return cls(lon=deranged_lon, lat=deranged_lat)
 
+    @classmethod
+    def interleave_batch(cls, lon, lat=None, out=None):
+        """
+        Returns an array of 64-bit interleaved integers from arrays of
+        longitudes and latitudes, without building a LonLat per point.
+
+        lon: array of longitudes, or a structured array with `lon` and
+             `lat` fields if `lat` is not given
+        lat: array of latitudes
+        out: optional uint64 array to write the result to
+        """
+        if lat is None:
+            lon, lat = lon['lon'], lon['lat']
+
+        return interleave_64_batch(*cls.grid_batch(lon, lat), out=out)
+
+    @classmethod
+    def grid_batch(cls, lon, lat):
+        """
+        Returns arrays of the 32-bit integer co-ordinates that
+        interleave_batch() interleaves for arrays of longitudes and
+        latitudes.
+        """
+        lon_range, lat_range = cls._ranges()
+
+        # Unlike interleaved, out of range co-ordinates are clamped to the
+        # edges of the grid rather than wrapping around.
+        indexed_lon = np.asarray(lon, dtype=np.float64) + lon_range / 2
+        indexed_lon /= lon_range
+        np.clip(indexed_lon, 0, 1, out=indexed_lon)
+        indexed_lon *= UINT32
+
+        indexed_lat = np.asarray(lat, dtype=np.float64) + lat_range / 2
+        indexed_lat /= lat_range
+        np.clip(indexed_lat, 0, 1, out=indexed_lat)
+        indexed_lat *= UINT32
+
+        return indexed_lon.astype(np.uint32), indexed_lat.astype(np.uint32)
+
+    @classmethod
+    def deinterleave_batch(cls, coordinates):
+        """
+        Returns arrays of longitudes and latitudes from an array of 64-bit
+        interleaved integers.  This is the inverse of interleave_batch().
+        """
+        lon_range, lat_range = cls._ranges()
+
+        lon, lat = deinterleave_64_batch(coordinates)
+
+        deranged_lon = lon.astype(np.float64)
+        deranged_lon *= lon_range / UINT32
+        deranged_lon -= lon_range / 2
+
+        deranged_lat = lat.astype(np.float64)
+        deranged_lat *= lat_range / UINT32
+        deranged_lat -= lat_range / 2
+
+        return deranged_lon, deranged_lat
+
+    @classmethod
+    def project_batch(cls, lon, lat):
+        """
+        Returns arrays of the co-ordinates that grid_batch() takes for
+        arrays of longitudes and latitudes.  These are the longitudes and
+        latitudes themselves, but subclasses projecting them override this,
+        so that code given any LonLat class can take degrees.
+        """
+        return (np.asarray(lon, dtype=np.float64),
+                np.asarray(lat, dtype=np.float64))
+
+    @classmethod
+    def deproject_batch(cls, lon, lat):
+        """
+        Returns arrays of longitudes and latitudes from arrays of the
+        co-ordinates that deinterleave_batch() returns.  This is the inverse
+        of project_batch().
+        """
+        return (np.asarray(lon, dtype=np.float64),
+                np.asarray(lat, dtype=np.float64))
+
+
+def haversine(a, b):
+    """
+    Returns the great circle distance in metres between two LonLat points.
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (a.lon, a.lat, b.lon, b.lat))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(h)))
+
+
+def haversine_batch(lon1, lat1, lon2, lat2):
+    """
+    Returns the great circle distances in metres between arrays (or
+    scalars) of longitudes and latitudes.
+    """
+    lon1, lat1, lon2, lat2 = (
+        np.radians(np.asarray(value, dtype=np.float64))
+        for value in (lon1, lat1, lon2, lat2)
+    )
+    h = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1, np.sqrt(h)))
+
+
+def radius_bboxes(lon, lat, metres):
+    """
+    Returns the smallest longitude/latitude boxes containing every point
+    within `metres` of (lon, lat), as a list of
+    (lon_min, lat_min, lon_max, lat_max) tuples.
+
+    There are two boxes when the circle crosses the antimeridian, one on
+    each side of it.  When it contains a pole, the box spans all
+    longitudes.
+
+    Ref.: http://janmatuschek.de/LatitudeLongitudeBoundingCoordinates
+    """
+    angle = metres / EARTH_RADIUS
+    lat_min = lat - math.degrees(angle)
+    lat_max = lat + math.degrees(angle)
+
+    if lat_min <= -90 or lat_max >= 90:
+        return [(-180, max(lat_min, -90), 180, min(lat_max, 90))]
+
+    # the longitudes the circle reaches get wider with the latitude
+    delta_lon = math.degrees(
+        math.asin(min(1, math.sin(angle) / math.cos(math.radians(lat))))
+    )
+    lon_min = lon - delta_lon
+    lon_max = lon + delta_lon
+
+    if lon_max - lon_min >= 360:
+        return [(-180, lat_min, 180, lat_max)]
+    if lon_min < -180:
+        return [(lon_min + 360, lat_min, 180, lat_max),
+                (-180, lat_min, lon_max, lat_max)]
+    if lon_max > 180:
+        return [(lon_min, lat_min, 180, lat_max),
+                (-180, lat_min, lon_max - 360, lat_max)]
+    return [(lon_min, lat_min, lon_max, lat_max)]
+
+
+def circle_classifier(lon, lat, metres, lonlat=LonLat):
+    """
+    Returns a classify function for zorder.cover_ranges_batch() of the
+    points within `metres` of (lon, lat), on the grid of the interleave_64
+    keys of `lonlat`, whose dimensions are (y, x).
+
+    A cell is OUTSIDE when its nearest point is further than `metres`, so
+    that the cover never misses a point of the circle, and INSIDE when its
+    farthest point is within `metres`.  Both take the longitudes getting
+    closer towards the poles and the antimeridian into account.
+    """
+    lon_range, lat_range = lonlat._ranges()
+    lon_scale = lon_range / UINT32
+    lat_scale = lat_range / UINT32
+
+    lon, lat = math.radians(lon), math.radians(lat)
+    sin_lat, cos_lat = math.sin(lat), math.cos(lat)
+    antipode_lon = (lon + 2 * math.pi) % (2 * math.pi) - math.pi
+
+    # points are compared by the haversine of their angle to the centre,
+    # which grows with the angle up to pi
+    if math.isnan(metres):
+        raise ValueError("metres must be a number")
+    radius = metres / EARTH_RADIUS
+    # with leeway for the rounding of the co-ordinates of the cells
+    outer_radius = radius * (1 + 1e-9) + 1e-12
+    inner_haversine = math.sin(min(radius, math.pi) / 2) ** 2
+    outer_haversine = math.sin(min(outer_radius, math.pi) / 2) ** 2
+    # beyond a quarter of a great circle, the farthest point of a cell may
+    # be inside one of its edges: no cell is classified INSIDE then
+    farthest_at_edges = radius < math.pi / 2
+
+    def haversine(point_lon, point_lat):
+        return np.sin((point_lat - lat) / 2) ** 2 + cos_lat * \
+            np.cos(point_lat) * np.sin((point_lon - lon) / 2) ** 2
+
+    def apart(a, b):
+        # the angle between a and b around a circle
+        return np.abs((a - b + math.pi) % (2 * math.pi) - math.pi)
+
+    def classify(mins, maxs):
+        if radius >= math.pi:
+            # half way around the Earth, the circle is the whole sphere
+            return np.full(len(mins[0]), INSIDE)
+
+        # the cells hold the co-ordinates truncated to their grid cells
+        # (y, x), so they end where the next grid cells start.  Projections
+        # keep meridians and parallels straight, so the cells are still
+        # bounded by them once deprojected.
+        west, south = lonlat.deproject_batch(
+            mins[1] * lon_scale - lon_range / 2,
+            mins[0] * lat_scale - lat_range / 2
+        )
+        east, north = lonlat.deproject_batch(
+            (maxs[1] + 1) * lon_scale - lon_range / 2,
+            (maxs[0] + 1) * lat_scale - lat_range / 2
+        )
+        west, east = np.radians(west), np.radians(east)
+        south = np.maximum(np.radians(south), -math.pi / 2)
+        north = np.minimum(np.radians(north), math.pi / 2)
+
+        # along the parallels, the angle grows with the difference of
+        # longitude: the nearest point is on the meridian of the centre if
+        # the cell spans it, or else on the nearer of its west and east
+        # edges
+        meridian = np.where(apart(west, lon) <= apart(east, lon), west, east)
+        # around the great circle of that meridian, the angle is smallest
+        # at this latitude (beyond a pole if the meridian is more than 90
+        # degrees away) and grows with the distance to it either way
+        foot = np.arctan2(sin_lat, cos_lat * np.cos(meridian - lon))
+        nearest = np.where(
+            (south <= foot) & (foot <= north), foot,
+            np.where(apart(foot, south) < apart(foot, north), south, north)
+        )
+        outside = np.where(
+            (west <= lon) & (lon <= east),
+            np.maximum(south - lat, lat - north) > outer_radius,
+            haversine(meridian, nearest) > outer_haversine
+        )
+        kinds = np.where(outside, OUTSIDE, PARTIAL)
+        if not farthest_at_edges:
+            return kinds
+
+        # the farthest point is a corner, or where the parallels cross the
+        # meridian opposite the centre
+        farthest = np.maximum.reduce([
+            haversine(meridian, parallel)
+            for meridian in (west, east) for parallel in (south, north)
+        ])
+        opposite = (west <= antipode_lon) & (antipode_lon <= east)
+        if opposite.any():
+            farthest = np.where(opposite, np.maximum.reduce([
+                farthest, haversine(antipode_lon, south),
+                haversine(antipode_lon, north),
+                haversine(antipode_lon, np.clip(-lat, south, north))
+            ]), farthest)
+        kinds[~outside & (farthest <= inner_haversine)] = INSIDE
+        return kinds
+
+    return classify
+
+
+def circle_ranges(lon, lat, metres, max_ranges=64, max_depth=None,
+                  lonlat=LonLat):
+    """
+    Returns a sorted list of inclusive (first, last) ranges of the
+    interleave_64 keys of `lonlat` covering every point within `metres` of
+    (lon, lat).
+
+    The cover follows the circle rather than the box around it, so fewer
+    keys outside the circle are fetched for the same number of ranges, but
+    the keys inside the ranges still need refine_circle_batch().
+
+    max_ranges: maximum number of ranges to return
+    max_depth: maximum number of bits per axis to split cells to
+    """
+    return cover_ranges_batch(
+        circle_classifier(lon, lat, metres, lonlat), 2, 32,
+        max_ranges=max_ranges, max_depth=max_depth
+    )
+
+
+def refine_circle_batch(keys, lon, lat, metres, lonlat=LonLat):
+    """
+    Returns a boolean array of whether each of the interleave_64 `keys` of
+    `lonlat` is within `metres` of (lon, lat), computed with one
+    haversine_batch() call.
+
+    lon, lat, metres: scalars, or arrays parallel to `keys` to test every
+                      key against its own circle
+    """
+    distances = haversine_batch(lon, lat, *lonlat.deproject_batch(
+        *lonlat.deinterleave_batch(np.asarray(keys, np.uint64))
+    ))
+    return distances <= metres
+
 
 class MercatorLonLat(LonLat):
     """
@@ -94,6 +392,10 @@ class MercatorLonLat(LonLat):
     # the Web Mercator projection (EPSG 3785).
     HALF_CIRCUMFERENCE = math.pi * 6378137
 
+    # Latitude at which the Web Mercator projection becomes a square,
+    # i.e. atan(sinh(pi)).  Tilers clamp latitudes beyond this.
+    MAX_LATITUDE = 85.0511287798066
+
     MIN_LON = 0.0
     MAX_LON = 40075016.68557849
 
@@ -132,3 +434,203 @@ class MercatorLonLat(LonLat):
         proj_lat *= cls.HALF_CIRCUMFERENCE / 180
 
         return cls(lon=proj_lon, lat=proj_lat)
+
+    @classmethod
+    def deproject_batch(cls, lon, lat):
+        """
+        Deprojects arrays of projected longitudes and latitudes and returns
+        arrays of longitudes and latitudes in degrees.
+
+        Unlike deproject(), projected latitudes beyond the edge of the
+        Web Mercator square are clamped to +/-MAX_LATITUDE.
+        """
+        deproj_lon = np.asarray(lon, dtype=np.float64) / \
+            cls.HALF_CIRCUMFERENCE * 180
+
+        deproj_lat = np.clip(
+            np.asarray(lat, dtype=np.float64),
+            -cls.HALF_CIRCUMFERENCE, cls.HALF_CIRCUMFERENCE
+        ) / cls.HALF_CIRCUMFERENCE * 180
+        adjusted_lat = 180 / math.pi * \
+            (2 * np.arctan(np.exp(deproj_lat * math.pi / 180)) - math.pi / 2)
+
+        return deproj_lon, adjusted_lat
+
+    @classmethod
+    def project_batch(cls, lon, lat):
+        """
+        Projects arrays of longitudes and latitudes and returns arrays of
+        projected longitudes and latitudes.
+
+        Unlike project(), latitudes beyond +/-MAX_LATITUDE are clamped
+        the way Web Mercator tilers do rather than failing.
+        """
+        proj_lon = np.asarray(lon, dtype=np.float64) * \
+            cls.HALF_CIRCUMFERENCE / 180
+
+        clamped_lat = np.clip(
+            np.asarray(lat, dtype=np.float64),
+            -cls.MAX_LATITUDE, cls.MAX_LATITUDE
+        )
+        proj_lat = np.log(np.tan((90 + clamped_lat) * math.pi / 360)) / \
+            (math.pi / 180)
+        proj_lat *= cls.HALF_CIRCUMFERENCE / 180
+
+        return proj_lon, proj_lat
+
+    @classmethod
+    def project_interleave_batch(cls, lon, lat, out=None):
+        """
+        Projects arrays of longitudes and latitudes and returns an array of
+        their 64-bit interleaved integers, the same as projecting each
+        point and taking its `interleaved` property.
+
+        out: optional uint64 array to write the result to
+        """
+        return cls.interleave_batch(*cls.project_batch(lon, lat), out=out)
+
+
+class WebMercatorLonLat(MercatorLonLat):
+    """
+    MercatorLonLat whose grid spans the whole Web Mercator square, from
+    -MAX_LATITUDE to MAX_LATITUDE rather than from 85°S to 85°N, so that
+    the top 2 * zoom bits of its keys are the slippy map tile of the point
+    at that zoom (see tiles.py).
+    """
+
+    MAX_LON = 2 * MercatorLonLat.HALF_CIRCUMFERENCE
+    MAX_LAT = 2 * MercatorLonLat.HALF_CIRCUMFERENCE
+
+    @classmethod
+    def _ranges(cls):
+        # not rounded up, or the tiles would be off by a fraction of a
+        # metre
+        return cls.MAX_LON - cls.MIN_LON, cls.MAX_LAT - cls.MIN_LAT
+
+
+class LonLatEncoder(object):
+    """
+    Interleaves longitudes and latitudes at `bits` bits per axis, rather
+    than the 32 of LonLat.interleaved, into keys of 16 (up to 8 bits per
+    axis), 32 (up to 16 bits) or 64 bits:
+
+        encoder = LonLatEncoder(16)   # cells of 611m x 305m at the equator
+        key = encoder.encode(2.3522, 48.8566)
+        lonlat = encoder.decode(key)
+
+    Keys which fit in 32 bits halve the memory of 64-bit ones, and stay
+    in the 16 and 32-bit code paths of morton.py.  The scale of each axis
+    is computed once, here, rather than on every call.
+
+    bits: number of bits per axis, 1 to 32
+    lonlat: LonLat class whose ranges scale the co-ordinates, e.g.
+            MercatorLonLat for projected co-ordinates
+    """
+
+    def __init__(self, bits=32, lonlat=LonLat):
+        if not 1 <= bits <= 32:
+            raise ValueError(
+                "bits must be between 1 and 32, not {}".format(bits)
+            )
+        self.bits = bits
+        self.lonlat = lonlat
+
+        if bits <= 8:
+            self.key_bits = 16
+            self._interleave, self._deinterleave = \
+                interleave_16, deinterleave_16
+            self._interleave_batch, self._deinterleave_batch = \
+                interleave_16_batch, deinterleave_16_batch
+        elif bits <= 16:
+            self.key_bits = 32
+            self._interleave, self._deinterleave = \
+                interleave_32, deinterleave_32
+            self._interleave_batch, self._deinterleave_batch = \
+                interleave_32_batch, deinterleave_32_batch
+        else:
+            self.key_bits = 64
+            self._interleave, self._deinterleave = \
+                interleave_64, deinterleave_64
+            self._interleave_batch, self._deinterleave_batch = \
+                interleave_64_batch, deinterleave_64_batch
+
+        # the largest co-ordinate on the grid, UINT32 for 32 bits as in
+        # LonLat.interleaved
+        self.max_value = (1 << bits) - 1
+        lon_range, lat_range = lonlat._ranges()
+        self._lon_offset = lon_range / 2
+        self._lat_offset = lat_range / 2
+        self._lon_scale = self.max_value / lon_range
+        self._lat_scale = self.max_value / lat_range
+        self._lon_unscale = lon_range / self.max_value
+        self._lat_unscale = lat_range / self.max_value
+
+    def __repr__(self):
+        return 'LonLatEncoder({}, {})'.format(self.bits, self.lonlat.__name__)
+
+    @property
+    def dtype(self):
+        """
+        numpy dtype of the keys.
+        """
+        return np.dtype('uint{}'.format(self.key_bits))
+
+    def grid(self, lon, lat):
+        """
+        Returns the integer co-ordinates of (lon, lat) on the grid, clamped
+        to its edges.
+        """
+        x = int((lon + self._lon_offset) * self._lon_scale)
+        y = int((lat + self._lat_offset) * self._lat_scale)
+        return (min(max(x, 0), self.max_value),
+                min(max(y, 0), self.max_value))
+
+    def encode(self, lon, lat):
+        """
+        Returns the key of (lon, lat).
+        """
+        return self._interleave(*self.grid(lon, lat))
+
+    def decode(self, key):
+        """
+        Returns the LonLat (of the `lonlat` class) of the lower corner of
+        the cell of `key`.  This is the inverse of encode().
+        """
+        x, y = self._deinterleave(key)
+        return self.lonlat(lon=x * self._lon_unscale - self._lon_offset,
+                           lat=y * self._lat_unscale - self._lat_offset)
+
+    def grid_batch(self, lon, lat):
+        """
+        Returns uint32 arrays of the integer co-ordinates of arrays of
+        longitudes and latitudes.  This is the array equivalent of grid().
+        """
+        x = np.asarray(lon, dtype=np.float64) + self._lon_offset
+        x *= self._lon_scale
+        np.clip(x, 0, self.max_value, out=x)
+        y = np.asarray(lat, dtype=np.float64) + self._lat_offset
+        y *= self._lat_scale
+        np.clip(y, 0, self.max_value, out=y)
+        return x.astype(np.uint32), y.astype(np.uint32)
+
+    def encode_batch(self, lon, lat, out=None):
+        """
+        Returns an array of the keys of arrays of longitudes and latitudes,
+        of the encoder's dtype.  This is the array equivalent of encode().
+
+        out: optional array of the encoder's dtype to write the result to
+        """
+        return self._interleave_batch(*self.grid_batch(lon, lat), out=out)
+
+    def decode_batch(self, keys):
+        """
+        Returns arrays of the longitudes and latitudes of the lower corners
+        of the cells of an array of keys.  This is the array equivalent of
+        decode().
+        """
+        x, y = self._deinterleave_batch(np.asarray(keys, dtype=self.dtype))
+        lon = x * self._lon_unscale
+        lon -= self._lon_offset
+        lat = y * self._lat_unscale
+        lat -= self._lat_offset
+        return lon, lat
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hilbert curve equivalents of the Morton functions in morton.py and
+interleave.py.
+
+The Z-order curve jumps across the key space at every quadrant border,
+so a query box often needs many key ranges.  The Hilbert curve only ever
+moves to an adjacent cell, so the same box needs fewer ranges, at the
+cost of a slower encoding.  compare_with_morton() measures both.
+
+These use John Skilling's algorithm, "Programming the Hilbert curve"
+(2004), which works for any number of dimensions: the co-ordinates are
+transformed in place (the "transpose") and then interleaved like a Morton
+key.
+
+Ref.: http://doi.org/10.1063/1.1751381
+"""
+
+from __future__ import division
+
+import time
+
+import numpy as np
+
+from .interleave import deinterleave2, deinterleave3, interleave3
+from .morton import deinterleave_64, deinterleave_64_batch, interleave_64, \
+    interleave_64_batch, UINT32
+from . import zorder
+
+
+def _axes_to_transpose(axes, bits):
+    """
+    Transforms a list of co-ordinates into the transpose of their Hilbert
+    index.  Works both on integers and on numpy arrays.
+    """
+    axes = list(axes)
+    dims = len(axes)
+
+    # Inverse undo excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for i in range(dims):
+            flip = (axes[i] & q) != 0
+            swap = (axes[0] ^ axes[i]) & p
+            if isinstance(flip, np.ndarray):
+                dtype = swap.dtype.type
+                swap = np.where(flip, dtype(0), swap)
+                axes[0] = axes[0] ^ np.where(flip, dtype(p), swap)
+            elif flip:
+                swap = 0
+                axes[0] ^= p
+            else:
+                axes[0] ^= swap
+            if i:
+                axes[i] = axes[i] ^ swap
+        q >>= 1
+
+    # Gray encode
+    for i in range(1, dims):
+        axes[i] = axes[i] ^ axes[i - 1]
+    t = axes[0] & 0
+    q = 1 << (bits - 1)
+    while q > 1:
+        if isinstance(t, np.ndarray):
+            dtype = t.dtype.type
+            t = t ^ np.where((axes[-1] & q) != 0, dtype(q - 1), dtype(0))
+        elif axes[-1] & q:
+            t ^= q - 1
+        q >>= 1
+
+    return [axis ^ t for axis in axes]
+
+
+def _transpose_to_axes(transpose, bits):
+    """
+    Transforms the transpose of a Hilbert index back into a list of
+    co-ordinates.  Works both on integers and on numpy arrays.
+    """
+    axes = list(transpose)
+    dims = len(axes)
+
+    # Gray decode
+    t = axes[-1] >> 1
+    for i in range(dims - 1, 0, -1):
+        axes[i] = axes[i] ^ axes[i - 1]
+    axes[0] = axes[0] ^ t
+
+    # Undo excess work
+    q = 2
+    while q != 1 << bits:
+        p = q - 1
+        for i in range(dims - 1, -1, -1):
+            flip = (axes[i] & q) != 0
+            swap = (axes[0] ^ axes[i]) & p
+            if isinstance(flip, np.ndarray):
+                dtype = swap.dtype.type
+                swap = np.where(flip, dtype(0), swap)
+                axes[0] = axes[0] ^ np.where(flip, dtype(p), swap)
+            elif flip:
+                swap = 0
+                axes[0] ^= p
+            else:
+                axes[0] ^= swap
+            if i:
+                axes[i] = axes[i] ^ swap
+        q <<= 1
+
+    return axes
+
+
+def hilbert_64(x, y):
+    """
+    Returns the 64-bit Hilbert index of two 32-bit integers.  This is the
+    Hilbert equivalent of morton.interleave_64().
+    """
+    transpose = _axes_to_transpose((x & UINT32, y & UINT32), 32)
+    # the first axis holds the highest bit of each pair
+    return interleave_64(*transpose)
+
+
+def dehilbert_64(n):
+    """
+    Returns the two 32-bit integers of a 64-bit Hilbert index.  This is the
+    Hilbert equivalent of morton.deinterleave_64().
+    """
+    return tuple(_transpose_to_axes(deinterleave_64(n), 32))
+
+
+def hilbert3(x, y, z):
+    """
+    Returns the 30-bit Hilbert index of three 10-bit integers.  This is the
+    Hilbert equivalent of interleave.interleave3().
+    """
+    transpose = _axes_to_transpose((x & 0x3FF, y & 0x3FF, z & 0x3FF), 10)
+    return interleave3(*reversed(transpose))
+
+
+def dehilbert3(n):
+    """
+    Returns the three 10-bit integers of a 30-bit Hilbert index.  This is
+    the Hilbert equivalent of interleave.deinterleave3().
+    """
+    return tuple(_transpose_to_axes(reversed(deinterleave3(n)), 10))
+
+
+def hilbert_64_batch(x, y, out=None):
+    """
+    Returns an array of the 64-bit Hilbert indices of two arrays of 32-bit
+    integers.
+
+    out: optional uint64 array to write the result to
+    """
+    transpose = _axes_to_transpose(
+        (np.asarray(x).astype(np.uint32), np.asarray(y).astype(np.uint32)),
+        32
+    )
+    return interleave_64_batch(*transpose, out=out)
+
+
+def dehilbert_64_batch(n):
+    """
+    Returns two arrays of the 32-bit integers of an array of 64-bit
+    Hilbert indices.
+    """
+    return tuple(_transpose_to_axes(deinterleave_64_batch(n), 32))
+
+
+def hilbert3_batch(x, y, z):
+    """
+    Returns a uint32 array of the 30-bit Hilbert indices of three arrays of
+    10-bit integers.
+    """
+    transpose = _axes_to_transpose(
+        [np.asarray(axis).astype(np.uint32) & 0x3FF for axis in (x, y, z)],
+        10
+    )
+
+    result = np.zeros(transpose[0].shape, dtype=np.uint32)
+    for bit in range(10):
+        for offset, axis in enumerate(reversed(transpose)):
+            result |= ((axis >> np.uint32(bit)) & np.uint32(1)) << \
+                np.uint32(3 * bit + offset)
+    return result
+
+
+def dehilbert3_batch(n):
+    """
+    Returns three uint32 arrays of the 10-bit integers of an array of
+    30-bit Hilbert indices.
+    """
+    n = np.asarray(n).astype(np.uint32)
+    transpose = []
+    for offset in (2, 1, 0):
+        axis = np.zeros(n.shape, dtype=np.uint32)
+        for bit in range(10):
+            axis |= ((n >> np.uint32(3 * bit + offset)) & np.uint32(1)) << \
+                np.uint32(bit)
+        transpose.append(axis)
+    return tuple(_transpose_to_axes(transpose, 10))
+
+
+def _merged_count(ranges):
+    return len(zorder.merge_ranges(sorted(ranges)))
+
+
+def compare_with_morton(queries=100, depth=8, points=10 ** 6, seed=0):
+    """
+    Compares the Hilbert and Morton curves on random query boxes and
+    random points, and prints:
+
+    - the average number of key ranges covering each box, with cells
+      split down to `depth` bits per dimension
+    - the time taken to encode `points` points with the batch functions
+      and 10000 points with the scalar ones
+
+    Results
+    -------
+    compare_with_morton()
+    Ranges per query (depth 8): morton 169.0, hilbert 86.5
+    Batch encoding of 1000000 points: morton 0.0254s, hilbert 1.18s
+    Scalar encoding of 10000 points: morton 0.0165s, hilbert 0.547s
+
+    The Hilbert curve needs about half as many ranges per box, but encodes
+    30 to 45 times slower, so it pays off for read-heavy workloads where
+    each range lookup is expensive (e.g. a seek on disk).
+    """
+    random = np.random.RandomState(seed)
+
+    morton_ranges = hilbert_ranges = 0
+    for _ in range(queries):
+        corners = random.randint(0, UINT32, 4, dtype=np.uint64)
+        lower = (int(min(corners[0], corners[1])),
+                 int(min(corners[2], corners[3])))
+        upper = (int(max(corners[0], corners[1])),
+                 int(max(corners[2], corners[3])))
+        cells = zorder.cover_cells(
+            zorder.box_classifier(lower, upper), 2, 32, max_depth=depth
+        )
+
+        morton_ranges += _merged_count(
+            zorder.cell_range(prefix, level) for prefix, level, _ in cells
+        )
+
+        # a quadtree cell is a contiguous block of Hilbert indices too
+        cell_ranges = []
+        for prefix, level, _ in cells:
+            x, y = deinterleave2(prefix)
+            shift = 32 - level
+            low_bits = (1 << (2 * shift)) - 1
+            key = hilbert_64(x << shift, y << shift)
+            cell_ranges.append((key & ~low_bits, key | low_bits))
+        hilbert_ranges += _merged_count(cell_ranges)
+
+    print("Ranges per query (depth {}): morton {:.1f}, hilbert {:.1f}".format(
+        depth, morton_ranges / queries, hilbert_ranges / queries
+    ))
+
+    x = random.randint(0, UINT32, points, dtype=np.uint64).astype(np.uint32)
+    y = random.randint(0, UINT32, points, dtype=np.uint64).astype(np.uint32)
+    timings = []
+    for func in (interleave_64_batch, hilbert_64_batch):
+        start = time.time()
+        func(x, y)
+        timings.append(time.time() - start)
+    print("Batch encoding of {} points: morton {:.3}s, hilbert {:.3}s".format(
+        points, *timings
+    ))
+
+    pairs = list(zip(x[:10000].tolist(), y[:10000].tolist()))
+    timings = []
+    for func in (interleave_64, hilbert_64):
+        start = time.time()
+        for pair in pairs:
+            func(*pair)
+        timings.append(time.time() - start)
+    print("Scalar encoding of {} points: morton {:.3}s, hilbert {:.3}s".format(
+        len(pairs), *timings
+    ))
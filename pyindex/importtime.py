@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the time taken to import the package and each of its modules,
+each in a fresh interpreter, as short-lived processes pay it on every run.
+
+    python -m pyindex.importtime
+"""
+
+from __future__ import division, print_function
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import __all__ as SUBMODULES
+
+# the package itself, then each of its lazily imported submodules
+MODULES = ['pyindex'] + ['pyindex.' + name for name in SUBMODULES]
+
+
+def import_time(module, repeat=5):
+    """
+    Returns the smallest time in seconds taken to import `module` in a
+    fresh interpreter over `repeat` runs, and whether it imported numpy.
+    Uses the interpreter's -X importtime option (Python 3.8 or later).
+
+    The bytecode is cached in a temporary directory by a first run, as in
+    a normal installation, so the source files are not compiled again.
+    """
+    cache = tempfile.mkdtemp(prefix='pyindex-importtime-')
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    command = [
+        sys.executable, '-X', 'importtime', '-X',
+        'pycache_prefix=' + cache, '-c',
+        'import {}; import sys; print("numpy" in sys.modules)'.format(module)
+    ]
+
+    try:
+        times = []
+        for _ in range(repeat + 1):
+            output = subprocess.check_output(
+                command, stderr=subprocess.STDOUT, env=env,
+                universal_newlines=True
+            )
+            # sum the cumulative times (in us) of the top-level imports,
+            # from the first one of the package on
+            lines = re.findall(
+                r'^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', output, re.M
+            )
+            first = next(i for i, (_, name) in enumerate(lines)
+                         if name.startswith('pyindex'))
+            times.append(sum(int(time) for time, _ in lines[first:]) / 1e6)
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    numpy_imported = output.strip().splitlines()[-1] == 'True'
+    # the first run compiled the bytecode
+    return min(times[1:]), numpy_imported
+
+
+def main(modules=MODULES, repeat=5):
+    """
+    Prints the import time of every module.
+
+    Results
+    -------
+    python -m pyindex.importtime
+    pyindex: 0.5ms
+    pyindex.alternative_interleave: 34.2ms
+    pyindex.bulkload: 81.3ms (with numpy)
+    pyindex.cache: 4.6ms
+    pyindex.compute: 3.4ms
+    pyindex.coverer: 5.2ms
+    pyindex.diskindex: 86.7ms (with numpy)
+    pyindex.geohash: 7.0ms
+    pyindex.geospatial: 6.7ms
+    pyindex.hilbert: 110.3ms (with numpy)
+    pyindex.importtime: 22.0ms
+    pyindex.index: 104.2ms (with numpy)
+    pyindex.ingest: 113.3ms (with numpy)
+    pyindex.interleave: 1.7ms
+    pyindex.morton: 6.5ms
+    pyindex.parallel: 143.8ms (with numpy)
+    pyindex.server: 146.2ms (with numpy)
+    pyindex.tiles: 7.8ms
+    pyindex.zorder: 1.6ms
+
+    numpy accounts for about 70ms of these: the modules whose scalar
+    functions are pure Python (interleave, morton, geospatial, zorder, and
+    cache, coverer, geohash and tiles built on them) only import it when a
+    batch function is first called.
+    """
+    for module in modules:
+        try:
+            seconds, numpy_imported = import_time(module, repeat)
+        except subprocess.CalledProcessError:
+            print("{}: cannot be imported".format(module))
+            continue
+        print("{}: {:.1f}ms{}".format(
+            module, seconds * 1000, ' (with numpy)' if numpy_imported else ''
+        ))
+
+
+if __name__ == '__main__':
+    main()
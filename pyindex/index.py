@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-memory spatial index of points on the 32-bit grid of
+morton.interleave_64.
+
+Points are kept as a sorted, contiguous array of 64-bit Morton keys with a
+parallel array of payload ids, so an index costs 16 bytes per point.  Box
+queries are answered by covering the box with key ranges (see
+zorder.morton_bbox_ranges) and bisecting the key array for each of them.
+"""
+
+from __future__ import division
+
+import math
+
+import numpy as np
+
+from .geospatial import circle_ranges, haversine_batch, LonLat, \
+    radius_bboxes, refine_circle_batch
+from .morton import deinterleave_64_batch, interleave_64, \
+    interleave_64_batch, UINT32
+from .zorder import morton_bbox_ranges
+
+
+class MortonIndex(object):
+    """
+    Index of (x, y) points with 32-bit integer co-ordinates.
+
+    keys: sorted uint64 array of morton.interleave_64 keys
+    ids: array of payload ids, parallel to `keys`
+    max_ranges: maximum number of key ranges used to cover a query box;
+                more ranges fetch fewer keys outside the box, but need more
+                bisections
+    range_cache: optional cache.RangeCache of the ranges covering the
+                 query boxes, which may be shared between indexes
+    """
+
+    def __init__(self, keys, ids, max_ranges=64, range_cache=None):
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.ids = np.asarray(ids)
+        if self.keys.shape != self.ids.shape:
+            raise ValueError("keys and ids must have the same shape")
+        self.max_ranges = max_ranges
+        self.range_cache = range_cache
+
+    @classmethod
+    def build(cls, x, y, ids=None, **kwargs):
+        """
+        Builds an index from arrays of x and y co-ordinates.
+
+        ids: array of payload ids for each point, defaults to the position
+             of the point in `x` and `y`
+        """
+        keys = interleave_64_batch(x, y)
+        if ids is None:
+            ids = np.arange(len(keys), dtype=np.int64)
+
+        # a stable sort keeps the ids of duplicate points in input order
+        order = np.argsort(keys, kind='mergesort')
+        return cls(keys[order], np.asarray(ids)[order], **kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _search(self, firsts, lasts):
+        """
+        Returns the start and stop positions in `keys` of the inclusive key
+        ranges between `firsts` and `lasts`.
+        """
+        return (np.searchsorted(self.keys, firsts, side='left'),
+                np.searchsorted(self.keys, lasts, side='right'))
+
+    def _positions(self, ranges):
+        """
+        Returns the positions in `keys` of the keys inside `ranges`.
+        """
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+
+        firsts, lasts = zip(*ranges)
+        starts, stops = self._search(np.array(firsts, dtype=np.uint64),
+                                     np.array(lasts, dtype=np.uint64))
+        return np.concatenate([
+            np.arange(start, stop) for start, stop in zip(starts, stops)
+        ])
+
+    def _ranges(self, x_min, y_min, x_max, y_max):
+        if self.range_cache is None:
+            return morton_bbox_ranges(
+                x_min, y_min, x_max, y_max, max_ranges=self.max_ranges
+            )
+        return self.range_cache.ranges(
+            x_min, y_min, x_max, y_max, max_ranges=self.max_ranges
+        )
+
+    def _box_positions(self, x_min, y_min, x_max, y_max):
+        x_min, y_min = max(x_min, 0), max(y_min, 0)
+        x_max, y_max = min(x_max, UINT32), min(y_max, UINT32)
+        if x_min > x_max or y_min > y_max:
+            return np.empty(0, dtype=np.intp)
+
+        positions = self._positions(self._ranges(x_min, y_min, x_max, y_max))
+
+        # the ranges may cover keys outside the box when they are merged
+        x, y = deinterleave_64_batch(self.keys[positions])
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return positions[inside]
+
+    def _scan_batch(self, range_lists):
+        """
+        Returns the positions in `keys` of the keys inside each list of
+        ranges, one list after the other, and the index of the list each
+        of them was found for.
+
+        The ranges of all the lists are bisected together, which saves most
+        of the numpy overhead of one _positions() call per list.
+        """
+        ranges = [key_range for key_ranges in range_lists
+                  for key_range in key_ranges]
+        if not ranges:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        firsts, lasts = zip(*ranges)
+        starts, stops = self._search(np.array(firsts, dtype=np.uint64),
+                                     np.array(lasts, dtype=np.uint64))
+        lengths = stops - starts
+        # the positions covered by every range one after the other
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1]) + np.repeat(starts - ends + lengths,
+                                                    lengths)
+        owners = np.repeat(
+            np.repeat(np.arange(len(range_lists)),
+                      [len(key_ranges) for key_ranges in range_lists]),
+            lengths
+        )
+        return positions, owners
+
+    def _box_positions_batch(self, boxes):
+        """
+        Returns the positions in `keys` of the points inside each of the
+        inclusive (x_min, y_min, x_max, y_max) `boxes`, as a list of arrays.
+
+        The keys covered by the ranges of all the boxes are found (see
+        _scan_batch()) and decoded in one pass.
+        """
+        if not boxes:
+            return []
+
+        bounds = np.empty((len(boxes), 4), dtype=np.int64)
+        range_lists = []
+        for i, (x_min, y_min, x_max, y_max) in enumerate(boxes):
+            x_min, y_min = max(x_min, 0), max(y_min, 0)
+            x_max, y_max = min(x_max, UINT32), min(y_max, UINT32)
+            bounds[i] = x_min, y_min, x_max, y_max
+            if x_min > x_max or y_min > y_max:
+                range_lists.append(())
+            else:
+                range_lists.append(self._ranges(x_min, y_min, x_max, y_max))
+
+        positions, owners = self._scan_batch(range_lists)
+        x, y = deinterleave_64_batch(self.keys[positions])
+        box = bounds[owners]
+        inside = (x >= box[:, 0]) & (x <= box[:, 2]) & \
+            (y >= box[:, 1]) & (y <= box[:, 3])
+        sizes = np.bincount(owners[inside], minlength=len(boxes))
+        return np.split(positions[inside], np.cumsum(sizes)[:-1])
+
+    def query(self, x_min, y_min, x_max, y_max):
+        """
+        Returns the ids of the points inside the inclusive box between
+        (x_min, y_min) and (x_max, y_max), in key order.
+        """
+        return self.ids[self._box_positions(x_min, y_min, x_max, y_max)]
+
+    def query_batch(self, boxes):
+        """
+        Returns the ids of the points inside each of the inclusive
+        (x_min, y_min, x_max, y_max) `boxes`, as a list of arrays in key
+        order.  This is faster than calling query() for each box.
+        """
+        return [self.ids[positions]
+                for positions in self._box_positions_batch(boxes)]
+
+    def count(self, x_min, y_min, x_max, y_max):
+        """
+        Returns the number of points inside the inclusive box between
+        (x_min, y_min) and (x_max, y_max).
+        """
+        return len(self._box_positions(x_min, y_min, x_max, y_max))
+
+    def lookup(self, x, y):
+        """
+        Returns the ids of the points at exactly (x, y).
+        """
+        key = np.uint64(interleave_64(x, y))
+        start, stop = self._search(key, key)
+        return self.ids[start:stop].copy()
+
+    def _nearest(self, key, k, distances, boxes):
+        """
+        Returns the positions and distances of the `k` nearest points,
+        closest first.
+
+        The points next to `key` along the curve give an upper bound of
+        the distance to the kth nearest point, but it can be far off where
+        the curve jumps between quadrants.  So the search starts with a
+        smaller ring around the query, which grows until it holds `k`
+        points no further than its radius, or reaches the bound.
+
+        key: key of the query point
+        distances: function returning the distances to the query of the
+                   points at the given positions
+        boxes: function returning a list of boxes (in the x, y grid)
+               containing every point within the given distance
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        position = int(self._search(np.uint64(key), np.uint64(key))[0])
+        neighbours = np.arange(max(0, position - k),
+                               min(len(self), position + k))
+        bound = np.partition(distances(neighbours), k - 1)[k - 1]
+        if not np.isfinite(bound):
+            # NaN comparisons would never end the search
+            raise ValueError("the query point must be finite")
+
+        radius = bound / 4
+        while True:
+            radius = min(radius, bound)
+            positions = np.concatenate([
+                self._box_positions(*box) for box in boxes(radius)
+            ])
+            if radius >= bound:
+                # the neighbours hold k points no further than the bound,
+                # so the search ends here even if the boxes miss some
+                positions = np.union1d(positions, neighbours)
+            if len(positions) >= k:
+                candidates = distances(positions)
+                nearest = np.argsort(candidates, kind='mergesort')[:k]
+                if candidates[nearest[-1]] <= radius or radius >= bound:
+                    return positions[nearest], candidates[nearest]
+            radius *= 2
+
+    def nearest(self, x, y, k=1):
+        """
+        Returns the ids of the `k` points nearest to (x, y) and their
+        Euclidean distances in grid units, as two arrays sorted by
+        distance.
+        """
+        def distances(positions):
+            px, py = deinterleave_64_batch(self.keys[positions])
+            return np.hypot(px - float(x), py - float(y))
+
+        def boxes(radius):
+            return [(int(math.floor(x - radius)), int(math.floor(y - radius)),
+                     int(math.ceil(x + radius)), int(math.ceil(y + radius)))]
+
+        positions, found = self._nearest(
+            interleave_64(x, y), k, distances, boxes
+        )
+        return self.ids[positions], found
+
+
+class LonLatIndex(MortonIndex):
+    """
+    MortonIndex of longitude/latitude points, keyed with
+    LonLat.interleave_batch (or the same method of a LonLat subclass given
+    as `lonlat`).
+
+    Points and queries are longitudes and latitudes in degrees whatever the
+    class: those of a projecting class such as MercatorLonLat (for index
+    files written by ingest.py --mercator) go through its project_batch()
+    before being keyed, and keys through its deproject_batch() before
+    distances are computed.
+    """
+
+    def __init__(self, keys, ids, max_ranges=64, lonlat=LonLat,
+                 range_cache=None):
+        super(LonLatIndex, self).__init__(
+            keys, ids, max_ranges=max_ranges, range_cache=range_cache
+        )
+        self.lonlat = lonlat
+
+    @classmethod
+    def build(cls, lon, lat, ids=None, lonlat=LonLat, **kwargs):
+        """
+        Builds an index from arrays of longitudes and latitudes.
+
+        ids: array of payload ids for each point, defaults to the position
+             of the point in `lon` and `lat`
+        """
+        x, y = lonlat.grid_batch(*lonlat.project_batch(lon, lat))
+        index = super(LonLatIndex, cls).build(x, y, ids, **kwargs)
+        index.lonlat = lonlat
+        return index
+
+    def _grid(self, lon, lat):
+        # grid co-ordinates of longitudes and latitudes in degrees
+        return self.lonlat.grid_batch(*self.lonlat.project_batch(lon, lat))
+
+    def _coordinates(self, positions):
+        # longitudes and latitudes in degrees of the points at `positions`
+        return self.lonlat.deproject_batch(
+            *self.lonlat.deinterleave_batch(self.keys[positions])
+        )
+
+    def _grid_box(self, lon_min, lat_min, lon_max, lat_max):
+        (x_min, x_max), (y_min, y_max) = self._grid(
+            [lon_min, lon_max], [lat_min, lat_max]
+        )
+        return int(x_min), int(y_min), int(x_max), int(y_max)
+
+    def _grid_boxes(self, boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        x, y = self._grid(boxes[:, 0::2], boxes[:, 1::2])
+        return np.column_stack(
+            [x[:, 0], y[:, 0], x[:, 1], y[:, 1]]
+        ).astype(np.int64).tolist()
+
+    def query(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        Returns the ids of the points inside the box between
+        (lon_min, lat_min) and (lon_max, lat_max), in key order.
+        """
+        return super(LonLatIndex, self).query(
+            *self._grid_box(lon_min, lat_min, lon_max, lat_max)
+        )
+
+    def query_batch(self, boxes):
+        """
+        Returns the ids of the points inside each of the
+        (lon_min, lat_min, lon_max, lat_max) `boxes`, as a list of arrays
+        in key order.  This is faster than calling query() for each box.
+        """
+        return super(LonLatIndex, self).query_batch(self._grid_boxes(boxes))
+
+    def count(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        Returns the number of points inside the box between
+        (lon_min, lat_min) and (lon_max, lat_max).
+        """
+        return super(LonLatIndex, self).count(
+            *self._grid_box(lon_min, lat_min, lon_max, lat_max)
+        )
+
+    def within(self, lon, lat, metres):
+        """
+        Returns the ids of the points within `metres` (great circle
+        distance) of (lon, lat).
+        """
+        return self.within_batch([lon], [lat], [metres])[0]
+
+    def within_batch(self, lon, lat, metres):
+        """
+        Returns the ids of the points within `metres` of each of the
+        centres given by arrays of longitudes and latitudes, as a list of
+        arrays in key order.  `metres` is a scalar or an array of radii.
+
+        Each circle is covered with key ranges following its outline (see
+        geospatial.circle_ranges()), the keys of all of them are found
+        together and their distances computed in one
+        geospatial.refine_circle_batch() call.
+        """
+        lon, lat, metres = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(lon, dtype=np.float64)),
+            np.atleast_1d(np.asarray(lat, dtype=np.float64)),
+            np.atleast_1d(np.asarray(metres, dtype=np.float64))
+        )
+        if not lon.size:
+            return []
+
+        positions, owners = self._scan_batch([
+            circle_ranges(*circle, max_ranges=self.max_ranges,
+                          lonlat=self.lonlat)
+            for circle in zip(lon.tolist(), lat.tolist(), metres.tolist())
+        ])
+        inside = refine_circle_batch(
+            self.keys[positions], lon[owners], lat[owners], metres[owners],
+            lonlat=self.lonlat
+        )
+        sizes = np.bincount(owners[inside], minlength=len(lon))
+        return np.split(self.ids[positions[inside]], np.cumsum(sizes)[:-1])
+
+    def lookup(self, lon, lat):
+        """
+        Returns the ids of the points in the same grid cell as (lon, lat).
+        """
+        x, y = self._grid([lon], [lat])
+        return super(LonLatIndex, self).lookup(int(x[0]), int(y[0]))
+
+    def nearest(self, lon, lat, k=1, distance='haversine'):
+        """
+        Returns the ids of the `k` points nearest to (lon, lat) and their
+        distances, as two arrays sorted by distance.
+
+        distance: 'haversine' for great circle distances in metres, or
+                  'euclidean' for planar distances in degrees
+        """
+        if distance == 'haversine':
+            def distances(positions):
+                return haversine_batch(lon, lat, *self._coordinates(positions))
+
+            def boxes(radius):
+                return [self._grid_box(*box)
+                        for box in radius_bboxes(lon, lat, radius)]
+        elif distance == 'euclidean':
+            def distances(positions):
+                plon, plat = self._coordinates(positions)
+                return np.hypot(plon - lon, plat - lat)
+
+            def boxes(radius):
+                return [self._grid_box(lon - radius, lat - radius,
+                                       lon + radius, lat + radius)]
+        else:
+            raise ValueError(
+                "distance must be 'haversine' or 'euclidean', not "
+                "{!r}".format(distance)
+            )
+
+        if not (math.isfinite(lon) and math.isfinite(lat)):
+            raise ValueError("lon and lat must be finite")
+        x, y = self._grid([lon], [lat])
+        key = interleave_64(int(x[0]), int(y[0]))
+        positions, found = self._nearest(key, k, distances, boxes)
+        return self.ids[positions], found
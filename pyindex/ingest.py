@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming ingestion of points from CSV or newline-delimited GeoJSON into
+Morton keys.
+
+The pipeline is a chain of generators over fixed-size chunks of points:
+
+    parse -> (optional) Mercator projection -> quantise -> interleave_64
+
+so memory use stays flat whatever the size of the input.  Use ingest() as
+an iterator of uint64 key arrays, or run it from the command line:
+
+    python -m pyindex.ingest points.csv --output keys.bin
+    python -m pyindex.ingest points.geojson --format geojson --mercator \\
+        --index points.idx --memory-limit 2GB
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import csv
+import io
+import json
+import math
+import sys
+
+import numpy as np
+
+from .bulkload import bulk_load, DEFAULT_MEMORY_LIMIT, print_progress
+from .geospatial import LonLat, MercatorLonLat
+from .morton import interleave_64_batch
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _open(source, **kwargs):
+    """
+    Returns a text file object for a path, '-' for stdin, or a file object,
+    and whether it should be closed after use.
+    """
+    if source == '-':
+        return sys.stdin, False
+    if hasattr(source, 'read'):
+        return source, False
+    return io.open(source, 'r', **kwargs), True
+
+
+def _chunked(points, chunk_size):
+    """
+    Groups an iterator of (lon, lat) pairs into chunks of (lon, lat)
+    float64 arrays.
+    """
+    lons = []
+    lats = []
+    for lon, lat in points:
+        lons.append(lon)
+        lats.append(lat)
+        if len(lons) == chunk_size:
+            yield (np.array(lons, dtype=np.float64),
+                   np.array(lats, dtype=np.float64))
+            lons = []
+            lats = []
+    if lons:
+        yield (np.array(lons, dtype=np.float64),
+               np.array(lats, dtype=np.float64))
+
+
+def _checked(points, errors):
+    """
+    Yields the (lon, lat) pairs of an iterator of (line, parse) pairs,
+    where parse() returns the pair or raises an error for a bad line.
+
+    NaN and infinite co-ordinates are bad too: float() accepts them, but
+    they have no grid cell to be quantised to.
+    """
+    if errors not in ('strict', 'skip'):
+        raise ValueError(
+            "errors must be 'strict' or 'skip', not {!r}".format(errors)
+        )
+
+    for line, parse in points:
+        try:
+            lon, lat = parse()
+            if not (math.isfinite(lon) and math.isfinite(lat)):
+                raise ValueError("co-ordinates must be finite, not {!r}, "
+                                 "{!r}".format(lon, lat))
+        except (ValueError, KeyError, IndexError, TypeError) as error:
+            if errors == 'strict':
+                raise ValueError("line {}: {}".format(line, error))
+        else:
+            yield lon, lat
+
+
+def read_csv(source, lon_column='lon', lat_column='lat', delimiter=',',
+             chunk_size=DEFAULT_CHUNK_SIZE, errors='strict'):
+    """
+    Yields chunks of (lon, lat) arrays from a CSV file with a header row.
+
+    source: path, '-' for stdin, or text file object
+    errors: 'strict' to raise a ValueError on a bad row, 'skip' to ignore it
+    """
+    csv_file, close = _open(source, newline='')
+    try:
+        reader = csv.reader(csv_file, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            lon_index = header.index(lon_column)
+            lat_index = header.index(lat_column)
+        except ValueError:
+            raise ValueError("CSV header must have {!r} and {!r} columns".format(
+                lon_column, lat_column
+            ))
+
+        points = (
+            (line, lambda row=row: (float(row[lon_index]),
+                                    float(row[lat_index])))
+            for line, row in enumerate(reader, 2)
+        )
+        for chunk in _chunked(_checked(points, errors), chunk_size):
+            yield chunk
+    finally:
+        if close:
+            csv_file.close()
+
+
+def _geojson_point(line):
+    """
+    Returns the (lon, lat) of a GeoJSON Point feature or geometry.
+    """
+    geometry = json.loads(line)
+    if geometry.get('type') == 'Feature':
+        geometry = geometry['geometry']
+    if geometry.get('type') != 'Point':
+        raise ValueError("not a Point: {!r}".format(geometry.get('type')))
+    lon, lat = geometry['coordinates'][:2]
+    return float(lon), float(lat)
+
+
+def read_geojson(source, chunk_size=DEFAULT_CHUNK_SIZE, errors='strict'):
+    """
+    Yields chunks of (lon, lat) arrays from a newline-delimited GeoJSON
+    file of Point features (or geometries), one per line.
+
+    source: path, '-' for stdin, or text file object
+    errors: 'strict' to raise a ValueError on a bad line, 'skip' to ignore
+            it
+    """
+    geojson_file, close = _open(source)
+    try:
+        points = (
+            (line, lambda text=text: _geojson_point(text))
+            for line, text in enumerate(geojson_file, 1)
+            if text.strip()
+        )
+        for chunk in _chunked(_checked(points, errors), chunk_size):
+            yield chunk
+    finally:
+        if close:
+            geojson_file.close()
+
+
+READERS = {
+    'csv': read_csv,
+    'geojson': read_geojson,
+}
+
+
+def project(chunks):
+    """
+    Projects chunks of (lon, lat) arrays with the Web Mercator projection.
+    """
+    for lon, lat in chunks:
+        yield MercatorLonLat.project_batch(lon, lat)
+
+
+def quantise(chunks, lonlat=LonLat):
+    """
+    Turns chunks of (lon, lat) arrays into chunks of (x, y) uint32 arrays
+    on the grid of `lonlat` (see LonLat.grid_batch).
+    """
+    for lon, lat in chunks:
+        yield lonlat.grid_batch(lon, lat)
+
+
+def encode(chunks):
+    """
+    Turns chunks of (x, y) uint32 arrays into uint64 arrays of
+    morton.interleave_64 keys.
+    """
+    for x, y in chunks:
+        yield interleave_64_batch(x, y)
+
+
+def ingest(source, format='csv', mercator=False,
+           chunk_size=DEFAULT_CHUNK_SIZE, **reader_kwargs):
+    """
+    Yields uint64 arrays of the Morton keys of the points of a CSV or
+    newline-delimited GeoJSON file, `chunk_size` points at a time.
+
+    The keys are the same as LonLat.interleave_batch, or
+    MercatorLonLat.project_interleave_batch if `mercator` is set.
+
+    reader_kwargs: passed on to read_csv() or read_geojson()
+    """
+    try:
+        reader = READERS[format]
+    except KeyError:
+        raise ValueError("unknown format {!r}, expected one of {}".format(
+            format, ', '.join(sorted(READERS))
+        ))
+
+    chunks = reader(source, chunk_size=chunk_size, **reader_kwargs)
+    if mercator:
+        chunks = quantise(project(chunks), MercatorLonLat)
+    else:
+        chunks = quantise(chunks, LonLat)
+    return encode(chunks)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pyindex.ingest',
+        description="Encode the points of a CSV or newline-delimited "
+                    "GeoJSON file into 64-bit Morton keys."
+    )
+    parser.add_argument('input', help="input file, or - for stdin")
+    parser.add_argument('--format', choices=sorted(READERS), default='csv')
+    parser.add_argument('--lon-column', default='lon',
+                        help="CSV longitude column (default: lon)")
+    parser.add_argument('--lat-column', default='lat',
+                        help="CSV latitude column (default: lat)")
+    parser.add_argument('--mercator', action='store_true',
+                        help="project with Web Mercator before encoding")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--skip-errors', action='store_true',
+                        help="skip bad rows instead of failing")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--output',
+                        help="write the keys as little-endian uint64 to "
+                             "this file instead of as text to stdout")
+    output.add_argument('--index',
+                        help="bulk load the keys into this index file, with "
+                             "the row numbers as ids")
+    parser.add_argument('--memory-limit', default=DEFAULT_MEMORY_LIMIT,
+                        help="memory budget of --index, e.g. 2GB")
+    args = parser.parse_args(args)
+
+    reader_kwargs = {'errors': 'skip' if args.skip_errors else 'strict'}
+    if args.format == 'csv':
+        reader_kwargs.update(lon_column=args.lon_column,
+                             lat_column=args.lat_column)
+    keys = ingest(args.input, args.format, args.mercator, args.chunk_size,
+                  **reader_kwargs)
+
+    try:
+        if args.index:
+            count = bulk_load(((chunk,) for chunk in keys), args.index,
+                              memory_limit=args.memory_limit,
+                              encode=lambda chunk: chunk,
+                              report=lambda progress: print_progress(progress)
+                              if progress.stage == 'merge' else None)
+            print("{} points indexed into {}".format(count, args.index))
+        elif args.output:
+            with open(args.output, 'wb') as output_file:
+                for chunk in keys:
+                    chunk.astype('<u8').tofile(output_file)
+        else:
+            for chunk in keys:
+                sys.stdout.write(''.join('{}\n'.format(key) for key in chunk))
+    except ValueError as error:
+        # bad rows without --skip-errors, raised as the keys are read
+        parser.error(str(error))
+
+
+if __name__ == '__main__':
+    main()
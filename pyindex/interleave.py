@@ -11,10 +11,13 @@ them to be slower.
 """
 from __future__ import division
 
-import timeit
-
 from math import ceil
 
+from ._lazy import LazyModule
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
 
 def part1by1(n):
     """
@@ -317,36 +320,14 @@ def make_mask(masklength, oneslength, zeroslength):
     zeroslength: number of zeros in each mask group
 
     """
-    # number of groups of ones and zeros in the total mask length
-    mask_groups = masklength // (oneslength + zeroslength)
-
-    # start with the number of ones in the first mask group
-    # eg. mask to be 00110011
-    first_ones = 1
-    for i in xrange(oneslength - 1):
-        first_ones = (first_ones << 1) | first_ones
-    # first_ones = 11
-
-    # left shift by the number of zeros
-    mask = first_ones << zeroslength
-    # mask = 1100
-    # this makes one mask group after the initial ones
-
-    for i in xrange(mask_groups - 1):
-        # << by length of ones + zeros, | by itself
-        mask = mask << (oneslength + zeroslength) | mask
-        # mask = 11001100
+    # eg. mask to be 00110011: groups of 11 every 4 bits
+    ones = (1 << oneslength) - 1
+    mask = 0
+    for shift in range(0, masklength, oneslength + zeroslength):
+        mask |= ones << shift
 
-    # add in the first ones:
-    # shift by the number of ones in the first group, | with first_ones
-    mask = (mask << oneslength) | first_ones
-
-    # remove the extra leading ones group
-    onesmask = 1
-    for i in xrange(masklength - 1):
-        onesmask = (onesmask << 1) | onesmask
-
-    return mask & onesmask
+    # remove the extra leading ones
+    return mask & ((1 << masklength) - 1)
 
 
 def part1by(n, offset):
@@ -359,10 +340,7 @@ def part1by(n, offset):
     # mask the input n to the appropriate number of bits that can be
     # interleaved in 32bit
     bits_to_include = 32 // (offset + 1)
-    mask = 1
-    for i in xrange(bits_to_include - 1):
-        mask = (mask << 1) | mask
-    n &= mask
+    n &= (1 << bits_to_include) - 1
 
     # split 16bit into two 8bit groups with enough zero bits inbetween
     # to fit the other numbers when interleaved, by shifting by offset * 8
@@ -546,6 +524,507 @@ def interleave_any_input_output(*integers):
     return ret
 
 
+# Magic numbers of part1by2(), part1by3() and their inverses, as the mask
+# applied first and the (shift, mask) pairs applied after it.  The batch
+# functions below apply them to whole numpy arrays.
+PART1BY2_32 = (0x00003FFF, (
+    (16, 0xFF0000FF), (8, 0x0300F00F), (4, 0x030C30C3), (2, 0x09249249)
+))
+UNPART1BY2_32 = (0x09249249, (
+    (2, 0x030C30C3), (4, 0x0300F00F), (8, 0xFF0000FF), (16, 0x000003FF)
+))
+PART1BY3_64 = (0x000000000000FFFF, (
+    (24, 0x000000FF000000FF), (12, 0x000F000F000F000F),
+    (6, 0x0303030303030303), (3, 0x1111111111111111)
+))
+UNPART1BY3_64 = (0x1111111111111111, (
+    (3, 0x0303030303030303), (6, 0x000F000F000F000F),
+    (12, 0x0000FF000000FF), (24, 0x0000000000FFFF)
+))
+
+
+def _magic_batch(n, out, magic, left):
+    """
+    Applies the magic numbers of a part or unpart function to every integer
+    in `n`, writing the result to `out`.
+
+    left: whether to shift left (part) or right (unpart)
+    """
+    dtype = out.dtype.type
+    mask, steps = magic
+    np.copyto(out, n, casting='unsafe')
+    out &= dtype(mask)
+
+    for shift, mask in steps:
+        if left:
+            out ^= out << dtype(shift)
+        else:
+            out ^= out >> dtype(shift)
+        out &= dtype(mask)
+
+    return out
+
+
+def _interleave_batch(arrays, magic, dtype, out):
+    arrays = [np.asarray(array) for array in arrays]
+    shape = arrays[0].shape
+    if any(array.shape != shape for array in arrays):
+        raise ValueError("the arrays must have the same shape, not {}".format(
+            ', '.join(str(array.shape) for array in arrays)
+        ))
+    for array in arrays:
+        if array.dtype.kind not in 'ui':
+            raise ValueError(
+                "cannot interleave a {} array".format(array.dtype)
+            )
+
+    dtype = np.dtype(dtype)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != dtype:
+        raise ValueError(
+            "out must be a {} array of shape {}, not a {} array of "
+            "shape {}".format(dtype, shape, out.dtype, out.shape)
+        )
+
+    parted = np.empty(shape, dtype=dtype)
+    out[...] = 0
+    for offset, array in enumerate(arrays):
+        _magic_batch(array, parted, magic, left=True)
+        parted <<= dtype.type(offset)
+        out |= parted
+
+    return out
+
+
+def _deinterleave_batch(n, count, magic, dtype, result_dtype):
+    n = np.asarray(n).astype(dtype)
+    return tuple(
+        _magic_batch(n >> dtype(offset), np.empty(n.shape, dtype=dtype),
+                     magic, left=False).astype(result_dtype)
+        for offset in range(count)
+    )
+
+
+def interleave3_batch(x, y, z, out=None):
+    """
+    Interleaves three arrays of 10-bit integers into one array of 32-bit
+    integers.  This is the array equivalent of interleave3().
+
+    out: optional uint32 array of the same shape as `x`, `y` and `z` to
+         write the result to
+    """
+    return _interleave_batch((x, y, z), PART1BY2_32, np.uint32, out)
+
+
+def deinterleave3_batch(n):
+    """
+    Deinterleaves an array of 32-bit integers into three arrays of 10-bit
+    integers, as uint16.  This is the array equivalent of deinterleave3().
+    """
+    return _deinterleave_batch(n, 3, UNPART1BY2_32, np.uint32, np.uint16)
+
+
+def interleave4_batch(v, x, y, z, out=None):
+    """
+    Interleaves four arrays of 16-bit integers into one array of 64-bit
+    integers.  This is the array equivalent of interleave4().
+
+    out: optional uint64 array of the same shape as `v`, `x`, `y` and `z`
+         to write the result to
+    """
+    return _interleave_batch((v, x, y, z), PART1BY3_64, np.uint64, out)
+
+
+def deinterleave4_batch(n):
+    """
+    Deinterleaves an array of 64-bit integers into four arrays of 16-bit
+    integers.  This is the array equivalent of deinterleave4().
+    """
+    return _deinterleave_batch(n, 4, UNPART1BY3_64, np.uint64, np.uint16)
+
+
+class MortonCodec(object):
+    """
+    Interleaves `dims` integers of `bits_per_dim` bits each, with the first
+    integer in the lowest bit.  For integers of at most `bits_per_dim`
+    bits, this gives the same result as interleave_any_input_output().
+
+    The shifts and masks of the magic number method are computed once for
+    the given sizes, and compiled into unrolled encode() and decode()
+    functions, which run about as fast as the hand-written interleave2(),
+    interleave3() and interleave4() (see time_taken()).  Unlike part1by()
+    and part1byany(), they do not call make_mask() on every call.
+
+    The batch functions work on numpy arrays and need keys of at most 64
+    bits.
+    """
+
+    def __init__(self, dims, bits_per_dim):
+        if dims < 1 or bits_per_dim < 1:
+            raise ValueError(
+                "a codec needs at least one dimension and one bit each"
+            )
+        self.dims = dims
+        self.bits_per_dim = bits_per_dim
+        self.bits = dims * bits_per_dim
+        self.part, self.unpart = self._magic_numbers()
+
+        name = 'MortonCodec({}, {})'.format(dims, bits_per_dim)
+        self.encode = self._compile(name + '.encode', self._encode_source())
+        self.decode = self._compile(name + '.decode', self._decode_source())
+
+        self.dtype = None
+        for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+            if np.iinfo(dtype).bits >= self.bits:
+                self.dtype = np.dtype(dtype)
+                break
+
+    def __repr__(self):
+        return 'MortonCodec({}, {})'.format(self.dims, self.bits_per_dim)
+
+    def _magic_numbers(self):
+        """
+        Returns the magic numbers of the part and unpart functions, in the
+        format of PART1BY2_32 and UNPART1BY2_32.
+
+        The bits are moved in groups of `size` bits, halving the size at
+        every stage: after the stage of a given size, bit `i` of the input
+        is at `i + (dims - 1) * (i & ~(size - 1))`, and the mask keeps
+        these positions.
+        """
+        def mask(size):
+            return sum(
+                1 << (i + (self.dims - 1) * (i & ~(size - 1)))
+                for i in range(self.bits_per_dim)
+            )
+
+        sizes = []
+        size = 1
+        while size < self.bits_per_dim and self.dims > 1:
+            sizes.append(size)
+            size <<= 1
+
+        shifts = [size * (self.dims - 1) for size in sizes]
+        part = (mask(size), tuple(
+            (shift, mask(size))
+            for shift, size in reversed(list(zip(shifts, sizes)))
+        ))
+        unpart = (mask(1), tuple(
+            (shift, mask(2 * size)) for shift, size in zip(shifts, sizes)
+        ))
+        return part, unpart
+
+    @staticmethod
+    def _compile(name, source):
+        namespace = {}
+        exec(compile(source, '<{}>'.format(name), 'exec'), namespace)
+        func = namespace.pop('func')
+        func.__name__ = func.__qualname__ = name
+        func.__module__ = __name__
+        return func
+
+    def _encode_source(self):
+        args = ['i{}'.format(i) for i in range(self.dims)]
+        mask, steps = self.part
+        lines = ['def func({}):'.format(', '.join(args))]
+        for arg in args:
+            lines.append('    {0} &= 0x{1:X}'.format(arg, mask))
+            for shift, step_mask in steps:
+                lines.append('    {0} = ({0} ^ ({0} << {1})) & 0x{2:X}'.format(
+                    arg, shift, step_mask
+                ))
+        lines.append('    return ' + ' | '.join(
+            '({} << {})'.format(arg, i) for i, arg in enumerate(args)
+        ))
+        return '\n'.join(lines) + '\n'
+
+    def _decode_source(self):
+        args = ['i{}'.format(i) for i in range(self.dims)]
+        mask, steps = self.unpart
+        lines = ['def func(n):']
+        for i, arg in enumerate(args):
+            lines.append('    {} = (n >> {}) & 0x{:X}'.format(arg, i, mask))
+            for shift, step_mask in steps:
+                lines.append('    {0} = ({0} ^ ({0} >> {1})) & 0x{2:X}'.format(
+                    arg, shift, step_mask
+                ))
+        lines.append('    return {},'.format(', '.join(args)))
+        return '\n'.join(lines) + '\n'
+
+    def _check_batch(self):
+        if self.dtype is None:
+            raise ValueError(
+                "batch functions need keys of at most 64 bits, not "
+                "{}".format(self.bits)
+            )
+
+    def encode_batch(self, *arrays, **kwargs):
+        """
+        Interleaves `dims` arrays of integers into one array of integers of
+        the smallest unsigned dtype holding `dims * bits_per_dim` bits.
+
+        kwargs['out']: optional array of that dtype to write the result to
+        """
+        self._check_batch()
+        if len(arrays) != self.dims:
+            raise ValueError("expected {} arrays, not {}".format(
+                self.dims, len(arrays)
+            ))
+        return _interleave_batch(arrays, self.part, self.dtype,
+                                 kwargs.get('out'))
+
+    def decode_batch(self, n):
+        """
+        Deinterleaves an array of integers into `dims` arrays of integers,
+        of the smallest unsigned dtype holding `bits_per_dim` bits.
+        """
+        self._check_batch()
+        result_dtype = np.min_scalar_type((1 << self.bits_per_dim) - 1)
+        return _deinterleave_batch(n, self.dims, self.unpart,
+                                   self.dtype.type, result_dtype)
+
+
+class VariableWidthCodec(object):
+    """
+    Interleaves integers of different widths into a compact key of
+    `sum(bits)` bits, with no padding bits, e.g. 24-bit longitudes and
+    latitudes with 16-bit times into 64-bit keys:
+
+        codec = VariableWidthCodec((24, 24, 16))
+        key = codec.encode(lon, lat, time)
+
+    The bits of each integer are spread evenly over the key: bit `j` of an
+    integer of `b` bits is ranked by `(j + 0.5) / b`, and the key holds the
+    bits in the order of their ranks (ties in the order of the integers).
+    So the time bits above are two in every eight bits, all along the key
+    ('yxtyxtyx' from the top), and any prefix of the key splits each
+    dimension about as finely as the others relative to its range.  With
+    equal widths, this gives the same result as MortonCodec.
+
+    Keys are built by looking up each byte of each integer in a table of
+    its bits deposited at their key positions, and split with a table per
+    byte of the key, like the tables of morton.py.
+
+    bits: width of each integer, in order
+    """
+
+    def __init__(self, bits):
+        self.bits = tuple(bits)
+        if not self.bits or min(self.bits) < 1:
+            raise ValueError(
+                "a codec needs at least one integer and one bit each"
+            )
+        self.dims = len(self.bits)
+        self.key_bits = sum(self.bits)
+
+        ranks = sorted(
+            ((j + 0.5) / width, d, j)
+            for d, width in enumerate(self.bits) for j in range(width)
+        )
+        # key bit position of every bit of every integer
+        self.positions = [[0] * width for width in self.bits]
+        for position, (_, d, j) in enumerate(ranks):
+            self.positions[d][j] = position
+
+        # deposit tables: [integer][byte of the integer][byte value]
+        self.deposit = [
+            [self._table(lambda i, d=d, k=k: self._bit(d, 8 * k + i))
+             for k in range(-(-width // 8))]
+            for d, width in enumerate(self.bits)
+        ]
+
+        # extract tables: [byte of the key][byte value], giving the bits of
+        # each integer in lanes of `lane_bits` bits
+        self.lane_bits = max(self.bits)
+        owners = [None] * self.key_bits
+        for d, positions in enumerate(self.positions):
+            for j, position in enumerate(positions):
+                owners[position] = (d, j)
+        self.extract = [
+            self._table(lambda i, k=k: self._lane_bit(owners, 8 * k + i))
+            for k in range(-(-self.key_bits // 8))
+        ]
+
+        self.dtype = None
+        if self.key_bits <= 64:
+            self.dtype = np.dtype(np.uint64)
+            self._deposit_arrays = [
+                [np.array(table, dtype=np.uint64) for table in tables]
+                for tables in self.deposit
+            ]
+            # one table per integer, as lanes may not fit in 64 bits
+            self._extract_arrays = [
+                [np.array([(lanes >> (d * self.lane_bits)) &
+                           ((1 << width) - 1) for lanes in table],
+                          dtype=np.uint64)
+                 for d, width in enumerate(self.bits)]
+                for table in self.extract
+            ]
+
+    def __repr__(self):
+        return 'VariableWidthCodec({!r})'.format(self.bits)
+
+    @staticmethod
+    def _table(bit):
+        """
+        Returns a 256 entries table of the sum of bit(i) for the set bits i
+        of each byte.
+        """
+        bits = [bit(i) for i in range(8)]
+        return [
+            sum(bits[i] for i in range(8) if byte >> i & 1)
+            for byte in range(256)
+        ]
+
+    def _bit(self, d, j):
+        if j >= self.bits[d]:
+            return 0
+        return 1 << self.positions[d][j]
+
+    def _lane_bit(self, owners, position):
+        if position >= self.key_bits:
+            return 0
+        d, j = owners[position]
+        return 1 << (d * self.lane_bits + j)
+
+    def encode(self, *integers):
+        """
+        Returns the key of `dims` integers, masked to their widths.
+        """
+        if len(integers) != self.dims:
+            raise ValueError("expected {} integers, not {}".format(
+                self.dims, len(integers)
+            ))
+        key = 0
+        for integer, tables in zip(integers, self.deposit):
+            for table in tables:
+                key |= table[integer & 0xFF]
+                integer >>= 8
+        return key
+
+    def decode(self, n):
+        """
+        Returns the `dims` integers of a key.
+        """
+        lanes = 0
+        for table in self.extract:
+            lanes |= table[n & 0xFF]
+            n >>= 8
+        lane_mask = (1 << self.lane_bits) - 1
+        return tuple(
+            (lanes >> (d * self.lane_bits)) & lane_mask
+            for d in range(self.dims)
+        )
+
+    def _check_batch(self):
+        if self.dtype is None:
+            raise ValueError(
+                "batch functions need keys of at most 64 bits, not "
+                "{}".format(self.key_bits)
+            )
+
+    def encode_batch(self, *arrays, **kwargs):
+        """
+        Returns a uint64 array of the keys of `dims` arrays of integers.
+
+        kwargs['out']: optional uint64 array to write the result to
+        """
+        self._check_batch()
+        if len(arrays) != self.dims:
+            raise ValueError("expected {} arrays, not {}".format(
+                self.dims, len(arrays)
+            ))
+        arrays = [np.asarray(array).astype(np.uint64) for array in arrays]
+        shape = arrays[0].shape
+        if any(array.shape != shape for array in arrays):
+            raise ValueError("the arrays must have the same shape")
+
+        out = kwargs.get('out')
+        if out is None:
+            out = np.zeros(shape, dtype=np.uint64)
+        elif out.shape != shape or out.dtype != np.uint64:
+            raise ValueError(
+                "out must be a uint64 array of shape {}".format(shape)
+            )
+        else:
+            out[...] = 0
+
+        for array, tables in zip(arrays, self._deposit_arrays):
+            for k, table in enumerate(tables):
+                out |= table[(array >> np.uint64(8 * k)) & np.uint64(0xFF)]
+        return out
+
+    def decode_batch(self, n):
+        """
+        Returns `dims` uint64 arrays of the integers of an array of keys.
+        """
+        self._check_batch()
+        n = np.asarray(n).astype(np.uint64)
+        integers = [np.zeros(n.shape, dtype=np.uint64)
+                    for _ in range(self.dims)]
+        for k, tables in enumerate(self._extract_arrays):
+            byte = (n >> np.uint64(8 * k)) & np.uint64(0xFF)
+            for integer, table in zip(integers, tables):
+                integer |= table[byte]
+        return tuple(integers)
+
+
+_CODECS = {}
+
+
+def _codec(dims, bits_per_dim):
+    """
+    Returns a MortonCodec, compiled once per process.
+    """
+    key = (dims, bits_per_dim)
+    if key not in _CODECS:
+        _CODECS[key] = MortonCodec(dims, bits_per_dim)
+    return _CODECS[key]
+
+
+def deinterleave_any(n, count):
+    """
+    Deinterleaves an integer of any length into `count` integers.  This is
+    the inverse of interleave_any_input_output(), and of interleave_any()
+    and interleave_any_with_lookup_table() for the bits they keep.
+
+    The integer is split into chunks of 32 bits of each integer, which
+    are deinterleaved with the precomputed masks of a MortonCodec.
+
+    n: interleaved integer
+    count: number of integers interleaved in `n`
+    """
+    codec = _codec(count, 32)
+    chunk_mask = (1 << codec.bits) - 1
+
+    if n < 1 << codec.bits:
+        return codec.decode(n)
+
+    integers = [0] * count
+    shift = 0
+    while n:
+        for i, part in enumerate(codec.decode(n & chunk_mask)):
+            integers[i] |= part << shift
+        n >>= codec.bits
+        shift += 32
+
+    return tuple(integers)
+
+
+def deinterleave_any_batch(n, count):
+    """
+    Deinterleaves an array of integers of up to 64 bits into `count`
+    arrays of integers of `64 // count` bits.  This is the array
+    equivalent of deinterleave_any().
+    """
+    if not 1 <= count <= 64:
+        raise ValueError("cannot deinterleave {} integers".format(count))
+    return _codec(count, 64 // count).decode_batch(
+        np.asarray(n).astype(np.uint64)
+    )
+
+
 def time_taken(*args, **kwargs):
     """
     A function to time the various interleave functions.  Take the minimum of
@@ -591,6 +1070,20 @@ def time_taken(*args, **kwargs):
     Function (interleave.interleave_any_input_output): 1.122952e-03
     Function (interleave.interleave_any_with_lookup_table): 7.581711e-05
 
+    Comparison with lookup table methods from morton.py, measured in the
+    same run (10-bit integers, as interleave3 only keeps 10 bits each):
+    time_taken(interleave3, interleave3_32, interleave3_64,
+        integers=(0x3FF, 0x000, 0x3FF))
+    Function (interleave.interleave3): 1.232400e-05
+    Function (morton.interleave3_32): 5.334000e-06
+    Function (morton.interleave3_64): 7.606000e-06
+
+    time_taken(deinterleave3, deinterleave3_32, deinterleave3_64,
+        integers=(0x249249,))
+    Function (interleave.deinterleave3): 1.025200e-05
+    Function (morton.deinterleave3_32): 4.907000e-06
+    Function (morton.deinterleave3_64): 7.016000e-06
+
     INTERLEAVE4 Results
     -------------------
     time_taken(interleave4, interleave4_to_32bit, interleave4_any_length_input,
@@ -605,15 +1098,81 @@ def time_taken(*args, **kwargs):
     Function (interleave.interleave_any_input_output): 1.908064e-03
     Function (interleave.interleave_any_with_lookup_table): 8.797646e-05
 
+    MORTONCODEC Results
+    -------------------
+    Compiled MortonCodec functions against the hand-written ones, printed
+    by one script running:
+    c2, c3, c4 = MortonCodec(2, 16), MortonCodec(3, 10), MortonCodec(4, 16)
+    time_taken(interleave2, c2.encode, interleave_any_input_output,
+        integers=(0xFFFF, 0x0000))
+    Function (pyindex.interleave.interleave2): 1.883000e-05
+    Function (pyindex.interleave.MortonCodec(2, 16).encode): 7.955000e-06
+    Function (pyindex.interleave.interleave_any_input_output): 9.709900e-05
+    time_taken(interleave3, c3.encode, interleave_any_input_output,
+        integers=(0x3FF, 0x000, 0x3FF))
+    Function (pyindex.interleave.interleave3): 1.188700e-05
+    Function (pyindex.interleave.MortonCodec(3, 10).encode): 1.081000e-05
+    Function (pyindex.interleave.interleave_any_input_output): 1.378550e-04
+    time_taken(interleave4, c4.encode, interleave_any_input_output,
+        integers=(0xFFFF, 0x0000, 0xFFFF, 0x0000))
+    Function (pyindex.interleave.interleave4): 2.034300e-05
+    Function (pyindex.interleave.MortonCodec(4, 16).encode): 1.812400e-05
+    Function (pyindex.interleave.interleave_any_input_output): 1.815820e-04
+    time_taken(deinterleave2, c2.decode, integers=(0xAAAAAAAA,))
+    Function (pyindex.interleave.deinterleave2): 1.676100e-05
+    Function (pyindex.interleave.MortonCodec(2, 16).decode): 1.003100e-05
+    time_taken(deinterleave3, c3.decode, integers=(0x249249,))
+    Function (pyindex.interleave.deinterleave3): 1.280200e-05
+    Function (pyindex.interleave.MortonCodec(3, 10).decode): 9.980999e-06
+    time_taken(deinterleave4, c4.decode, integers=(0xAAAAAAAAAAAAAAAA,))
+    Function (pyindex.interleave.deinterleave4): 2.047300e-05
+    Function (pyindex.interleave.MortonCodec(4, 16).decode): 2.141500e-05
+
+    DEINTERLEAVE_ANY Results
+    ------------------------
+    For a 64-bit and a 256-bit integer, printed by one script running:
+    def deinterleave_any_4(n):
+        return deinterleave_any(n, 4)
+    four_64_bit_integers = (0xFFFFFFFFFFFFFFFF, 0, 0xFFFFFFFFFFFFFFFF, 0)
+    time_taken(deinterleave4_any_length_input, deinterleave_any_4,
+        integers=(0xAAAAAAAAAAAAAAAA,))
+    Function (pyindex.interleave.deinterleave4_any_length_input): 2.200300e-05
+    Function (__main__.deinterleave_any_4): 3.020100e-05
+    time_taken(deinterleave4_any_length_input, deinterleave_any_4,
+        integers=(interleave4_any_length_input(*four_64_bit_integers),))
+    Function (pyindex.interleave.deinterleave4_any_length_input): 9.666600e-05
+    Function (__main__.deinterleave_any_4): 6.479100e-05
+
+    VARIABLEWIDTHCODEC Results
+    --------------------------
+    A 24 + 24 + 16-bit key, against a 3 x 21-bit one and against
+    interleave_any_input_output (which pads the key to 96 bits), printed
+    by one script running:
+    v, c3 = VariableWidthCodec((24, 24, 16)), MortonCodec(3, 21)
+    time_taken(v.encode, c3.encode, interleave_any_input_output,
+        integers=(0xFFFFFF, 0, 0xFFFF))
+    Function (pyindex.interleave.VariableWidthCodec((24, 24, 16)).encode):
+        1.480500e-05
+    Function (pyindex.interleave.MortonCodec(3, 21).encode): 1.856500e-05
+    Function (pyindex.interleave.interleave_any_input_output): 3.242560e-04
+    time_taken(v.decode, c3.decode, integers=(0xFFFFFFFFFFFFFFFF,))
+    Function (pyindex.interleave.VariableWidthCodec((24, 24, 16)).decode):
+        2.668900e-05
+    Function (pyindex.interleave.MortonCodec(3, 21).decode): 1.907800e-05
+
     """
+    import timeit
+
     for func in args:
         min_time = min(
             timeit.Timer(
                 lambda: func(*kwargs['integers']), setup=''
             ).repeat(1000, 10)
         )
+        name = func.__name__
+        if getattr(func, '__self__', None) is not None:
+            # a method of a codec, named after the codec
+            name = '{!r}.{}'.format(func.__self__, name)
         print(
-            "Function ({}.{}): {:e}".format(
-                func.__module__, func.__name__, min_time
-            )
+            "Function ({}.{}): {:e}".format(func.__module__, name, min_time)
         )
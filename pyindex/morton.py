@@ -13,9 +13,17 @@ running this with PyPy.
 
 from __future__ import absolute_import
 
+from ._lazy import LazyModule
+from .compute import get_tables
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
 # Masks
 UINT8 = 0xFF
+UINT10 = 0x3FF
 UINT16 = 0xFFFF
+UINT21 = 0x1FFFFF
 UINT32 = 0xFFFFFFFF
 UINT64 = 0xFFFFFFFFFFFFFFFF
 
@@ -229,3 +237,357 @@ def deinterleave_64(n):
         ((d[0] << 24) | (c[0] << 16) | (b[0] << 8) | a[0]) & UINT32,
         ((d[1] << 24) | (c[1] << 16) | (b[1] << 8) | a[1]) & UINT32
     )
+
+
+# The 3D tables are built (or read from the compute.get_tables() cache) on
+# first use rather than at import time, see _load_tables_3x8().  They are
+# copied to lists, which CPython indexes about 20% faster than arrays.
+
+# 8 bits which will become 24
+MORTON_TABLE_3x256 = []
+
+# 9 bits which will become three times 3 bits, in 21-bit lanes (x in bits
+# 0-2, y in bits 21-23 and z in bits 42-44), so that the lookups of
+# consecutive 9-bit chunks can be shifted and or-ed together and the
+# three integers split apart at the end
+REVERSE_MORTON_TABLE_3x512 = []
+
+
+def _load_tables_3x8():
+    """
+    Fills MORTON_TABLE_3x256 and REVERSE_MORTON_TABLE_3x512 in place.
+    """
+    tables = get_tables(3, 8)
+    MORTON_TABLE_3x256[:] = tables.forward
+    REVERSE_MORTON_TABLE_3x512[:] = tables.reverse
+
+
+def interleave3_32(x, y, z):
+    """
+    Interleaves three 10-bit integers together into one 30-bit integer,
+    using a Morton lookup table.  This gives the same result as
+    interleave.interleave3(), with x in the lowest bit.
+    """
+    if not MORTON_TABLE_3x256:
+        _load_tables_3x8()
+
+    x &= UINT10
+    y &= UINT10
+    z &= UINT10
+
+    return (
+        # Bits 8-9
+        (MORTON_TABLE_3x256[x >> 8] |
+         MORTON_TABLE_3x256[y >> 8] << 1 |
+         MORTON_TABLE_3x256[z >> 8] << 2) << 24 |
+        # Bits 0-7
+        MORTON_TABLE_3x256[x & UINT8] |
+        MORTON_TABLE_3x256[y & UINT8] << 1 |
+        MORTON_TABLE_3x256[z & UINT8] << 2
+    )
+
+
+def interleave3_64(x, y, z):
+    """
+    Interleaves three 21-bit integers together into one 63-bit integer,
+    using a Morton lookup table.
+    """
+    if not MORTON_TABLE_3x256:
+        _load_tables_3x8()
+
+    x &= UINT21
+    y &= UINT21
+    z &= UINT21
+
+    return (
+        # Bits 16-20
+        (MORTON_TABLE_3x256[x >> 16] |
+         MORTON_TABLE_3x256[y >> 16] << 1 |
+         MORTON_TABLE_3x256[z >> 16] << 2) << 48 |
+        # Bits 8-15
+        (MORTON_TABLE_3x256[(x >> 8) & UINT8] |
+         MORTON_TABLE_3x256[(y >> 8) & UINT8] << 1 |
+         MORTON_TABLE_3x256[(z >> 8) & UINT8] << 2) << 24 |
+        # Bits 0-7
+        MORTON_TABLE_3x256[x & UINT8] |
+        MORTON_TABLE_3x256[y & UINT8] << 1 |
+        MORTON_TABLE_3x256[z & UINT8] << 2
+    )
+
+
+def deinterleave3_32(n):
+    """
+    Deinterleaves a 30-bit integer into three 10-bit integers using a
+    Morton lookup table.
+    """
+    if not REVERSE_MORTON_TABLE_3x512:
+        _load_tables_3x8()
+
+    lanes = (
+        REVERSE_MORTON_TABLE_3x512[n & 0x1FF] |
+        REVERSE_MORTON_TABLE_3x512[(n >> 9) & 0x1FF] << 3 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 18) & 0x1FF] << 6 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 27) & 0x7] << 9
+    )
+
+    return lanes & UINT10, (lanes >> 21) & UINT10, (lanes >> 42) & UINT10
+
+
+def deinterleave3_64(n):
+    """
+    Deinterleaves a 63-bit integer into three 21-bit integers using a
+    Morton lookup table.
+    """
+    if not REVERSE_MORTON_TABLE_3x512:
+        _load_tables_3x8()
+
+    lanes = (
+        REVERSE_MORTON_TABLE_3x512[n & 0x1FF] |
+        REVERSE_MORTON_TABLE_3x512[(n >> 9) & 0x1FF] << 3 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 18) & 0x1FF] << 6 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 27) & 0x1FF] << 9 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 36) & 0x1FF] << 12 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 45) & 0x1FF] << 15 |
+        REVERSE_MORTON_TABLE_3x512[(n >> 54) & 0x1FF] << 18
+    )
+
+    return lanes & UINT21, (lanes >> 21) & UINT21, (lanes >> 42) & UINT21
+
+
+def interleave_with_tables(*integers, **kwargs):
+    """
+    Interleaves any number of integers of any (equal) length using the
+    lookup tables of compute.get_tables(), with the first integer in the
+    lowest bit like interleave.interleave_any().
+
+    kwargs['chunk_bits']: width of the table chunks, e.g. 8 (the default),
+                          11 or 16 for larger and faster tables
+    kwargs['cache_dir']: directory to cache the tables in, see
+                         compute.get_tables()
+    """
+    if any(integer < 0 for integer in integers):
+        raise ValueError("cannot interleave negative integers")
+
+    dims = len(integers)
+    tables = get_tables(dims, kwargs.get('chunk_bits', 8),
+                        kwargs.get('cache_dir'))
+    forward = tables.forward
+    chunk_bits = tables.chunk_bits
+    mask = (1 << chunk_bits) - 1
+
+    result = 0
+    shift = 0
+    while any(integers):
+        chunk = 0
+        for offset, integer in enumerate(integers):
+            chunk |= forward[integer & mask] << offset
+        result |= chunk << shift
+        shift += dims * chunk_bits
+        integers = [integer >> chunk_bits for integer in integers]
+
+    return result
+
+
+def deinterleave_with_tables(n, dims, **kwargs):
+    """
+    Deinterleaves an integer of any length into `dims` integers using the
+    lookup tables of compute.get_tables().  This is the inverse of
+    interleave_with_tables().
+
+    kwargs: `chunk_bits` and `cache_dir`, see interleave_with_tables()
+    """
+    if n < 0:
+        raise ValueError("cannot deinterleave a negative integer")
+
+    tables = get_tables(dims, kwargs.get('chunk_bits', 8),
+                        kwargs.get('cache_dir'))
+    reverse = tables.reverse
+    chunk_mask = (1 << tables.reverse_bits) - 1
+    # bits of each integer per chunk, and chunks which fit in a lane
+    chunk_width = tables.reverse_bits // dims
+    lane_chunks = tables.lane_bits // chunk_width
+    lane_mask = (1 << tables.lane_bits) - 1
+
+    integers = [0] * dims
+    shift = 0
+    while n:
+        lanes = 0
+        for i in range(lane_chunks):
+            lanes |= reverse[n & chunk_mask] << (i * chunk_width)
+            n >>= tables.reverse_bits
+        for axis in range(dims):
+            integers[axis] |= \
+                ((lanes >> (axis * tables.lane_bits)) & lane_mask) << shift
+        shift += lane_chunks * chunk_width
+
+    return tuple(integers)
+
+
+# Magic numbers used by the batch functions below, as (shift, mask) pairs
+# for spreading the bits of a 32-bit integer apart.  These are the numpy
+# equivalent of part1by1() in interleave.py, extended to 64 bits.
+PART1BY1_64 = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+
+
+def _batch_buffer(out, shape, dtype):
+    """
+    Returns `out` if it can hold a batch result of the given shape and
+    dtype, or a new array if `out` is None.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError(
+            "out must be a {} array of shape {}, not a {} array of "
+            "shape {}".format(np.dtype(dtype), shape, out.dtype, out.shape)
+        )
+    return out
+
+
+def _part1by1_batch(n, out, bits):
+    """
+    Inserts one 0 bit between each of the `bits` lower bits of every
+    integer in `n`, writing the result to `out`.
+    """
+    dtype = out.dtype.type
+    np.bitwise_and(n, (1 << bits) - 1, out=out, casting='unsafe')
+
+    for shift, mask in PART1BY1_64:
+        if shift >= bits:
+            continue
+        out |= out << dtype(shift)
+        out &= dtype(mask & ((1 << (2 * bits)) - 1))
+
+    return out
+
+
+def _unpart1by1_batch(n, out, bits):
+    """
+    Gets every other bit from every integer in `n`, writing the `bits`
+    resulting bits to `out`.
+    """
+    dtype = n.dtype.type
+    n = n & dtype(PART1BY1_64[-1][1])
+
+    # Walk the magic numbers backwards: shifting right by 1 uses the mask
+    # that part1by1 applied after shifting left by 2, and so on.
+    masks = [(1 << bits) - 1] + [mask for _, mask in PART1BY1_64[:-1]]
+    for shift, mask in zip(reversed([s for s, _ in PART1BY1_64]),
+                           reversed(masks)):
+        if shift >= bits:
+            break
+        n |= n >> dtype(shift)
+        n &= dtype(mask)
+
+    np.bitwise_and(n, (1 << bits) - 1, out=out, casting='unsafe')
+
+    return out
+
+
+def _interleave_batch(x, y, bits, dtype, out):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x.shape != y.shape:
+        raise ValueError(
+            "x and y must have the same shape, not {} and {}".format(
+                x.shape, y.shape
+            )
+        )
+
+    out = _batch_buffer(out, x.shape, dtype)
+    parted_y = _part1by1_batch(y, np.empty(x.shape, dtype=dtype), bits)
+    _part1by1_batch(x, out, bits)
+    out <<= dtype(1)
+    out |= parted_y
+
+    return out
+
+
+def _deinterleave_batch(n, bits, dtype, out):
+    n = np.asarray(n).astype(np.uint64)
+    if out is None:
+        out = (None, None)
+    x = _batch_buffer(out[0], n.shape, dtype)
+    y = _batch_buffer(out[1], n.shape, dtype)
+
+    _unpart1by1_batch(n >> np.uint64(1), x, bits)
+    _unpart1by1_batch(n, y, bits)
+
+    return x, y
+
+
+def interleave_16_batch(x, y, out=None):
+    """
+    Interleaves two arrays of 8-bit integers into one array of 16-bit
+    integers.  This is the array equivalent of interleave_16().
+
+    out: optional uint16 array of the same shape as `x` and `y` to write
+         the result to
+    """
+    return _interleave_batch(x, y, 8, np.uint16, out)
+
+
+def interleave_32_batch(x, y, out=None):
+    """
+    Interleaves two arrays of 16-bit integers into one array of 32-bit
+    integers.  This is the array equivalent of interleave_32().
+
+    out: optional uint32 array of the same shape as `x` and `y` to write
+         the result to
+    """
+    return _interleave_batch(x, y, 16, np.uint32, out)
+
+
+def interleave_64_batch(x, y, out=None):
+    """
+    Interleaves two arrays of 32-bit integers into one array of 64-bit
+    integers.  This is the array equivalent of interleave_64().
+
+    Rather than looking every byte up in MORTON_TABLE_256, the bits are
+    spread apart with whole-array magic number shifts, which benchmarks
+    about twice as fast with numpy (0.25s against 0.55s for 5 million
+    pairs).
+
+    out: optional uint64 array of the same shape as `x` and `y` to write
+         the result to
+    """
+    return _interleave_batch(x, y, 32, np.uint64, out)
+
+
+def deinterleave_16_batch(n, out=None):
+    """
+    Deinterleaves an array of 16-bit integers into two arrays of 8-bit
+    integers.  This is the array equivalent of deinterleave_16().
+
+    out: optional tuple of two uint8 arrays of the same shape as `n` to
+         write the result to
+    """
+    return _deinterleave_batch(n, 8, np.uint8, out)
+
+
+def deinterleave_32_batch(n, out=None):
+    """
+    Deinterleaves an array of 32-bit integers into two arrays of 16-bit
+    integers.  This is the array equivalent of deinterleave_32().
+
+    out: optional tuple of two uint16 arrays of the same shape as `n` to
+         write the result to
+    """
+    return _deinterleave_batch(n, 16, np.uint16, out)
+
+
+def deinterleave_64_batch(n, out=None):
+    """
+    Deinterleaves an array of 64-bit integers into two arrays of 32-bit
+    integers.  This is the array equivalent of deinterleave_64().
+
+    out: optional tuple of two uint32 arrays of the same shape as `n` to
+         write the result to
+    """
+    return _deinterleave_batch(n, 32, np.uint32, out)
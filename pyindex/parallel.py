@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the batch encoders and decoders (interleave_64_batch,
+interleave3_batch, LonLat.interleave_batch, ...) over a pool of processes.
+
+The input arrays are copied once into shared memory blocks and the
+workers write their results into shared output blocks, so only the names
+of the blocks and the bounds of each chunk go through the pool's pipes:
+the arrays themselves are never pickled.
+
+    with ParallelCodec(workers=4) as codec:
+        keys = codec.map(interleave_64_batch, x, y)
+        x, y = codec.map(deinterleave_64_batch, keys)
+
+Requires Python 3.8 or later for multiprocessing.shared_memory.
+"""
+
+from __future__ import division, print_function
+
+from multiprocessing import cpu_count, Pool, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import time
+
+import numpy as np
+
+from .geospatial import LonLat
+from .interleave import interleave3_batch, interleave4_batch
+from .morton import interleave_64_batch
+
+# Number of points handed to a worker at a time; large enough for numpy to
+# amortise the cost of a task, small enough to balance the workers.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def _share(shape, dtype):
+    """
+    Returns a shared memory block and an array of the given shape and dtype
+    backed by it.
+    """
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    block = SharedMemory(create=True, size=size)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _attach(spec):
+    """
+    Returns the shared memory block and the array described by a
+    (name, shape, dtype) spec.
+    """
+    name, shape, dtype = spec
+    block = SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _release(block, unlink=False):
+    """
+    Closes (and optionally unlinks) a shared memory block.
+    """
+    try:
+        block.close()
+    except BufferError:
+        # an exception being raised still holds arrays backed by the block;
+        # it is unmapped once they are garbage collected
+        pass
+    if unlink:
+        block.unlink()
+
+
+def _compute(func, input_specs, output_specs, start, stop, blocks):
+    inputs = []
+    for spec in input_specs:
+        block, array = _attach(spec)
+        blocks.append(block)
+        inputs.append(array[start:stop])
+
+    results = func(*inputs)
+    if not isinstance(results, tuple):
+        results = (results,)
+
+    for spec, result in zip(output_specs, results):
+        block, output = _attach(spec)
+        blocks.append(block)
+        output[start:stop] = result
+
+
+def _run(task):
+    """
+    Worker: runs a batch function on one chunk of the shared inputs and
+    writes its results to the shared outputs.
+    """
+    blocks = []
+    try:
+        # the arrays backed by the blocks go away when _compute returns
+        _compute(*task, blocks=blocks)
+    finally:
+        for block in blocks:
+            _release(block)
+
+
+class ParallelCodec(object):
+    """
+    Pool of worker processes running batch functions on chunks of arrays.
+
+    workers: number of processes, defaults to the number of CPUs
+    chunk_size: number of points handed to a worker at a time
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.workers = workers or cpu_count()
+        self.chunk_size = chunk_size
+        # workers started before the parent's resource tracker would each
+        # start their own, which would unlink the blocks they attached to
+        # when they exit
+        resource_tracker.ensure_running()
+        self.pool = Pool(self.workers)
+
+    def map(self, func, *arrays):
+        """
+        Returns func(*arrays), computed a chunk of `chunk_size` points at a
+        time across the workers.
+
+        func: module-level batch function (or classmethod) taking arrays
+              of the same length and returning an array or a tuple of
+              arrays of that length, e.g. interleave_64_batch
+        """
+        arrays = [np.ascontiguousarray(array) for array in arrays]
+        length = len(arrays[0])
+        if any(len(array) != length for array in arrays):
+            raise ValueError("the arrays must have the same length")
+
+        # not worth the round trip through the pool
+        if length <= self.chunk_size:
+            return func(*arrays)
+
+        # the result of the first point gives the dtypes of the outputs
+        probe = func(*[array[:1] for array in arrays])
+        single = not isinstance(probe, tuple)
+        if single:
+            probe = (probe,)
+
+        blocks = []
+        try:
+            input_specs = []
+            for array in arrays:
+                block, shared = _share(array.shape, array.dtype)
+                blocks.append(block)
+                shared[...] = array
+                input_specs.append((block.name, array.shape, array.dtype))
+
+            output_specs = []
+            outputs = []
+            for result in probe:
+                shape = (length,) + result.shape[1:]
+                block, shared = _share(shape, result.dtype)
+                blocks.append(block)
+                outputs.append(shared)
+                output_specs.append((block.name, shape, result.dtype))
+
+            self.pool.map(_run, [
+                (func, input_specs, output_specs, start,
+                 min(start + self.chunk_size, length))
+                for start in range(0, length, self.chunk_size)
+            ])
+
+            results = tuple(output.copy() for output in outputs)
+            del shared, outputs
+        finally:
+            for block in blocks:
+                _release(block, unlink=True)
+
+        return results[0] if single else results
+
+    def close(self):
+        """
+        Stops the workers.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parallel_map(func, *arrays, **kwargs):
+    """
+    Returns func(*arrays) computed across a temporary pool of processes;
+    see ParallelCodec.map().  Use a ParallelCodec to encode several batches
+    with the same workers.
+
+    kwargs: `workers` and `chunk_size`, see ParallelCodec
+    """
+    with ParallelCodec(**kwargs) as codec:
+        return codec.map(func, *arrays)
+
+
+def benchmark(points=10 ** 7, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              seed=0):
+    """
+    Prints the time taken to encode `points` random points with each batch
+    encoder, in process and across `workers` processes.
+
+    Results
+    -------
+    benchmark() on a single CPU machine:
+    interleave_64_batch: 0.722s in process, 0.708s with 1 workers
+    interleave3_batch: 0.515s in process, 0.405s with 1 workers
+    interleave4_batch: 1.21s in process, 0.897s with 1 workers
+    interleave_batch: 0.836s in process, 0.783s with 1 workers
+
+    The copies to and from shared memory are paid back even by a single
+    worker, as numpy's temporaries for a chunk of 2**20 points stay in
+    cache.  Each worker encodes its own chunks independently, so with more
+    cores the time should divide by about the number of workers; this
+    machine could not measure it.
+    """
+    random = np.random.RandomState(seed)
+    coordinates = random.randint(0, 1 << 32, (4, points), dtype=np.uint64)
+    cases = [
+        (interleave_64_batch, coordinates[:2].astype(np.uint32)),
+        (interleave3_batch, (coordinates[:3] >> np.uint64(22))
+            .astype(np.uint32)),
+        (interleave4_batch, (coordinates >> np.uint64(16)).astype(np.uint16)),
+        (LonLat.interleave_batch, (random.uniform(-180, 180, points),
+                                   random.uniform(-90, 90, points))),
+    ]
+
+    with ParallelCodec(workers, chunk_size) as codec:
+        for func, arrays in cases:
+            start = time.time()
+            func(*arrays)
+            in_process = time.time() - start
+
+            start = time.time()
+            codec.map(func, *arrays)
+            print("{}: {:.3}s in process, {:.3}s with {} workers".format(
+                func.__name__, in_process, time.time() - start, codec.workers
+            ))
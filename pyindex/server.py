@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""
+Query server for a Morton index file, speaking JSON lines over TCP on
+localhost:
+
+    python -m pyindex.server points.idx --port 8765
+
+Each request is a JSON object on one line, answered by a JSON object on
+one line with the same `id`:
+
+    {"id": 1, "op": "bbox", "box": [lon_min, lat_min, lon_max, lat_max]}
+    {"id": 2, "op": "radius", "point": [lon, lat], "metres": 500}
+    {"id": 3, "op": "knn", "point": [lon, lat], "k": 10}
+
+    {"id": 1, "ids": [...]}
+    {"id": 3, "ids": [...], "distances": [...]}
+    {"id": 4, "error": "..."}
+
+Co-ordinates are on the 32-bit grid instead of longitudes and latitudes for
+an index opened with --grid, where radius queries are not available.  An
+index written by ingest.py --mercator is opened with --mercator, and still
+queried with longitudes and latitudes.
+
+A client may send several requests without waiting for the answers, which
+come back in the order they are ready.  Requests arriving together, from
+one client or many, are micro-batched: the server waits up to
+`batch_delay` seconds after the first one for up to `max_batch` of them,
+and answers all the bbox queries with one MortonIndex.query_batch() call
+and all the radius queries with one LonLatIndex.within_batch() call, so
+the range scans and key decoding run as a few vectorised passes rather
+than one per request.  kNN queries search rings of growing size, and are
+answered one at a time within the batch.
+
+Back-pressure: at most `max_pending` requests wait for a batch and each
+connection has at most `max_in_flight` requests being answered.  Past
+these limits the server stops reading the connection, so clients are
+slowed down by TCP flow control rather than queueing without bound.
+"""
+
+from __future__ import division
+
+import asyncio
+import json
+import math
+
+from .cache import RangeCache
+from .diskindex import LonLatIndexFile, MortonIndexFile
+from .geospatial import MercatorLonLat
+from .index import LonLatIndex
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# maximum length of a request line in bytes
+MAX_LINE = 1 << 16
+
+OPS = ('bbox', 'radius', 'knn')
+
+
+def _numbers(value, count, name, types=(int, float)):
+    # json.loads accepts NaN and Infinity, which no query makes sense of
+    if not isinstance(value, list) or len(value) != count or not all(
+        isinstance(number, types) and not isinstance(number, bool) and
+        math.isfinite(number) for number in value
+    ):
+        raise ValueError("{} must be a list of {} finite {}".format(
+            name, count, 'numbers' if float in types else 'integers'
+        ))
+    return value
+
+
+def parse_request(request, lonlat=True):
+    """
+    Checks a decoded request and returns its operation and arguments:
+    ('bbox', box), ('radius', lon, lat, metres) or ('knn', x, y, k).
+
+    Raises ValueError if the request is not valid.
+
+    lonlat: whether the index is a LonLatIndex, which radius queries need
+    """
+    if not isinstance(request, dict):
+        raise ValueError("a request must be a JSON object")
+    op = request.get('op')
+    if op not in OPS:
+        raise ValueError("op must be one of {}".format(', '.join(OPS)))
+
+    if op == 'bbox':
+        # the grid boxes are inclusive ranges of integers
+        types = (int, float) if lonlat else (int,)
+        return op, tuple(_numbers(request.get('box'), 4, 'box', types))
+
+    # the grid points are integers too
+    types = (int, float) if lonlat else (int,)
+    x, y = _numbers(request.get('point'), 2, 'point', types)
+    if op == 'radius':
+        if not lonlat:
+            raise ValueError("radius queries need a lon/lat index")
+        metres = _numbers([request.get('metres')], 1, 'metres')[0]
+        return op, x, y, metres
+
+    k = request.get('k', 1)
+    if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+        raise ValueError("k must be a positive integer")
+    return op, x, y, k
+
+
+def _answer_batch(answer, queries):
+    """
+    Returns the results of answer(queries), a list of arrays of ids, as a
+    list of dicts.  If the batch fails, the queries are answered one at a
+    time, so that only those failing get an error.
+    """
+    try:
+        return [{'ids': ids.tolist()} for ids in answer(queries)]
+    except Exception as error:
+        if len(queries) == 1:
+            return [{'error': str(error)}]
+    return [_answer_batch(answer, [query])[0] for query in queries]
+
+
+def run_batch(index, queries):
+    """
+    Answers a list of queries returned by parse_request(), and returns
+    their results as a list of JSON-serialisable dicts.  A query which
+    fails gets an error result, without failing the others.
+    """
+    results = [None] * len(queries)
+
+    boxes = [i for i, query in enumerate(queries) if query[0] == 'bbox']
+    found = _answer_batch(
+        lambda batch: index.query_batch([query[1] for query in batch]),
+        [queries[i] for i in boxes]
+    ) if boxes else []
+    for i, result in zip(boxes, found):
+        results[i] = result
+
+    circles = [i for i, query in enumerate(queries) if query[0] == 'radius']
+    found = _answer_batch(
+        lambda batch: index.within_batch(*zip(*(query[1:]
+                                                for query in batch))),
+        [queries[i] for i in circles]
+    ) if circles else []
+    for i, result in zip(circles, found):
+        results[i] = result
+
+    for i, query in enumerate(queries):
+        if query[0] == 'knn':
+            try:
+                ids, distances = index.nearest(*query[1:])
+            except Exception as error:
+                results[i] = {'error': str(error)}
+                continue
+            results[i] = {'ids': ids.tolist(),
+                          'distances': distances.tolist()}
+
+    return results
+
+
+class QueryServer(object):
+    """
+    asyncio server answering JSON-lines queries on `index`, a MortonIndex
+    or LonLatIndex (or their disk-backed versions).  See the module
+    docstring for the protocol.
+
+    max_batch: maximum number of queries answered together
+    batch_delay: maximum time in seconds a query waits for others to be
+                 batched with
+    max_pending: maximum number of queries waiting for a batch
+    max_in_flight: maximum number of queries of one connection being
+                   answered at once
+    """
+
+    def __init__(self, index, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_batch=256, batch_delay=0.001, max_pending=4096,
+                 max_in_flight=64):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.lonlat = isinstance(index, LonLatIndex)
+
+        self._queue = None
+        self._batcher = None
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        """
+        Starts listening, and returns the (host, port) the server listens
+        on, which tells the port picked when `port` is 0.
+        """
+        self._queue = asyncio.Queue(self.max_pending)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port, limit=MAX_LINE
+        )
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening and answering queries.
+        """
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+
+    async def query(self, request):
+        """
+        Answers a decoded request, batched with the other requests waiting,
+        and returns its result as a dict.  Raises ValueError if the request
+        is not valid.
+        """
+        query = parse_request(request, self.lonlat)
+        future = asyncio.get_running_loop().create_future()
+        # waits while max_pending queries are queued
+        await self._queue.put((query, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._queue.get(), timeout
+                    ))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [(query, future) for query, future in batch
+                     if not future.done()]
+            if not batch:
+                continue
+            queries, futures = zip(*batch)
+            # in a thread, so that connections are read while the batch runs
+            try:
+                results = await loop.run_in_executor(
+                    None, run_batch, self.index, queries
+                )
+            except Exception as error:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _answer(self, line, writer, in_flight, write_lock):
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise ValueError("a request must be a line of JSON")
+            if isinstance(request, dict):
+                request_id = request.get('id')
+            response = await self.query(request)
+        except Exception as error:
+            response = {'error': str(error)}
+        finally:
+            in_flight.release()
+
+        response = dict(response, id=request_id)
+        try:
+            # waits while the client is not reading its answers
+            async with write_lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _serve(self, reader, writer):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        answers = set()
+        self._writers.add(writer)
+        try:
+            while True:
+                # stop reading while the connection has too many queries
+                await in_flight.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # a line longer than MAX_LINE, or a reset connection
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    in_flight.release()
+                    continue
+                answer = asyncio.ensure_future(
+                    self._answer(line, writer, in_flight, write_lock)
+                )
+                answers.add(answer)
+                answer.add_done_callback(answers.discard)
+            if answers:
+                await asyncio.wait(answers)
+        except asyncio.CancelledError:
+            for answer in answers:
+                answer.cancel()
+            raise
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Answer JSON-lines queries on an index file."
+    )
+    parser.add_argument('index', help="index file, see diskindex.py")
+    projection = parser.add_mutually_exclusive_group()
+    projection.add_argument('--mercator', action='store_true',
+                            help="the keys are Web Mercator co-ordinates")
+    projection.add_argument('--grid', action='store_true',
+                            help="query the 32-bit grid, not lon/lat")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--batch-delay', type=float, default=0.001,
+                        help="seconds a query waits for a batch")
+    parser.add_argument('--max-pending', type=int, default=4096)
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help="number of query boxes to cache the ranges "
+                             "of, 0 for none")
+    args = parser.parse_args(args)
+
+    range_cache = RangeCache(args.cache_size) if args.cache_size else None
+    if args.grid:
+        index = MortonIndexFile(args.index, range_cache=range_cache)
+    else:
+        index = LonLatIndexFile(
+            args.index, lonlat=MercatorLonLat if args.mercator else None,
+            range_cache=range_cache
+        )
+
+    server = QueryServer(index, args.host, args.port,
+                         max_batch=args.max_batch,
+                         batch_delay=args.batch_delay,
+                         max_pending=args.max_pending)
+
+    async def serve():
+        host, port = await server.start()
+        print("Serving {} points on {}:{}".format(len(index), host, port))
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,37 @@
 Some tests for pyindex (currently just very basic tests for interleave.py)
 """
 
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
-import interleave
-import alternative_interleave
+
+import numpy as np
+
+from pyindex import interleave
+from pyindex import alternative_interleave
+from pyindex import bulkload
+from pyindex import cache
+from pyindex import compute
+from pyindex import coverer
+from pyindex import diskindex
+from pyindex import geohash
+from pyindex import geospatial
+from pyindex import hilbert
+from pyindex import index
+from pyindex import ingest
+from pyindex import morton
+from pyindex import parallel
+from pyindex import server
+from pyindex import tiles
+from pyindex import zorder
 
 
 class TestInterleave(unittest.TestCase):
@@ -304,5 +332,1784 @@ class TestInterleave(unittest.TestCase):
         )
 
 
+class TestMortonCodec(unittest.TestCase):
+
+    def test_encode(self):
+        random = np.random.RandomState(42)
+        for dims, bits in [(2, 16), (3, 10), (4, 16), (5, 13), (6, 40)]:
+            codec = interleave.MortonCodec(dims, bits)
+            for _ in range(100):
+                integers = tuple(int(random.randint(0, 1 << min(bits, 31)))
+                                 << max(0, bits - 31) for _ in range(dims))
+                key = codec.encode(*integers)
+                self.assertEqual(
+                    key, interleave.interleave_any_input_output(*integers)
+                )
+                self.assertEqual(codec.decode(key), integers)
+
+    def test_hand_written(self):
+        self.assertEqual(interleave.MortonCodec(2, 16).encode(0x00, 0xFF),
+                         interleave.interleave2(0x00, 0xFF))
+        # the same as the hand-written magic numbers, except for the first
+        # mask of part1by2, which keeps bits that are dropped later anyway
+        self.assertEqual(interleave.MortonCodec(3, 10).part[1][1:],
+                         interleave.PART1BY2_32[1][1:])
+        self.assertEqual(interleave.MortonCodec(4, 16).unpart,
+                         interleave.UNPART1BY3_64)
+        self.assertEqual(interleave.MortonCodec(1, 8).encode(0x1FF), 0xFF)
+
+    def test_batch(self):
+        random = np.random.RandomState(42)
+        codec = interleave.MortonCodec(5, 12)
+        arrays = [random.randint(0, 1 << 12, 1000) for _ in range(5)]
+        keys = codec.encode_batch(*arrays)
+        self.assertEqual(keys.dtype, np.uint64)
+        self.assertEqual(keys.tolist(), [codec.encode(*map(int, integers))
+                                         for integers in zip(*arrays)])
+        decoded = codec.decode_batch(keys)
+        self.assertEqual(decoded[0].dtype, np.uint16)
+        for axis, expected in zip(decoded, arrays):
+            np.testing.assert_array_equal(axis, expected)
+
+        with self.assertRaises(ValueError):
+            codec.encode_batch(*arrays[:4])
+        with self.assertRaises(ValueError):
+            interleave.MortonCodec(3, 32).encode_batch(*arrays[:3])
+
+
+class TestDeinterleaveAny(unittest.TestCase):
+
+    def test_deinterleave_any(self):
+        random = np.random.RandomState(42)
+        for count in range(2, 7):
+            for bits in (8, 16, 32, 33, 90):
+                integers = tuple(
+                    int(random.randint(0, 1 << 30)) << max(0, bits - 30)
+                    for _ in range(count)
+                )
+                self.assertEqual(
+                    interleave.deinterleave_any(
+                        interleave.interleave_any_input_output(*integers),
+                        count
+                    ),
+                    integers
+                )
+
+        self.assertEqual(
+            interleave.deinterleave_any(
+                interleave.interleave_any(0xFF, 0x0F, 0xF0), 3
+            ),
+            (0xFF, 0x0F, 0xF0)
+        )
+        self.assertEqual(
+            interleave.deinterleave_any(
+                interleave.interleave4(0xFFFF, 0, 0xFFFF, 0), 4
+            ),
+            (0xFFFF, 0, 0xFFFF, 0)
+        )
+
+    def test_deinterleave_any_batch(self):
+        random = np.random.RandomState(42)
+        arrays = [random.randint(0, 1 << 12, 1000) for _ in range(5)]
+        keys = interleave.MortonCodec(5, 12).encode_batch(*arrays)
+        for axis, expected in zip(
+                interleave.deinterleave_any_batch(keys, 5), arrays):
+            np.testing.assert_array_equal(axis, expected)
+
+        np.testing.assert_array_equal(
+            interleave.deinterleave_any_batch([0b110101], 3),
+            [[0b01], [0b10], [0b11]]
+        )
+
+
+class TestVariableWidthCodec(unittest.TestCase):
+
+    def test_layout(self):
+        codec = interleave.VariableWidthCodec((24, 24, 16))
+        self.assertEqual(codec.key_bits, 64)
+        self.assertEqual(
+            sorted(sum(codec.positions, [])), list(range(64))
+        )
+        # time bits are spread evenly: two in every byte of the key
+        for byte in range(8):
+            self.assertEqual(
+                sum(byte * 8 <= position < byte * 8 + 8
+                    for position in codec.positions[2]),
+                2
+            )
+        self.assertEqual(codec.encode(0, 0, 0xFFFF),
+                         sum(1 << position for position in codec.positions[2]))
+
+        # equal widths give a plain Morton key
+        self.assertEqual(
+            interleave.VariableWidthCodec((10, 10, 10)).encode(0x3FF, 0, 7),
+            interleave.interleave3(0x3FF, 0, 7)
+        )
+
+    def test_encode(self):
+        random = np.random.RandomState(42)
+        for bits in [(24, 24, 16), (5, 17, 1, 9), (40, 40, 30)]:
+            codec = interleave.VariableWidthCodec(bits)
+            for _ in range(100):
+                integers = tuple(int(random.randint(0, 1 << min(b, 30)))
+                                 << max(0, b - 30) for b in bits)
+                key = codec.encode(*integers)
+                self.assertLess(key, 1 << sum(bits))
+                self.assertEqual(codec.decode(key), integers)
+
+    def test_batch(self):
+        random = np.random.RandomState(42)
+        codec = interleave.VariableWidthCodec((24, 24, 16))
+        arrays = [random.randint(0, 1 << b, 1000) for b in codec.bits]
+        keys = codec.encode_batch(*arrays)
+        self.assertEqual(keys.tolist(), [codec.encode(*map(int, integers))
+                                         for integers in zip(*arrays)])
+        for axis, expected in zip(codec.decode_batch(keys), arrays):
+            np.testing.assert_array_equal(axis, expected)
+
+        with self.assertRaises(ValueError):
+            interleave.VariableWidthCodec((40, 40)).encode_batch(*arrays[:2])
+        with self.assertRaises(ValueError):
+            codec.encode(1, 2)
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def run_python(self, code):
+        return subprocess.check_output(
+            [sys.executable, '-c', code], universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).split()
+
+    def test_lazy_submodules(self):
+        self.assertEqual(self.run_python(
+            "import sys, pyindex\n"
+            "print(sorted(m for m in sys.modules if m.startswith('pyindex')))\n"
+            "print(pyindex.morton.interleave_64(1, 2), 'numpy' in sys.modules)\n"
+            "pyindex.morton.interleave_64_batch([1], [2])\n"
+            "print('numpy' in sys.modules, 'timeit' in sys.modules)\n"
+        ), ["['pyindex']", '6', 'False', 'True', 'False'])
+
+    def test_missing_attribute(self):
+        import pyindex
+        with self.assertRaises(AttributeError):
+            pyindex.nonexistent
+        self.assertIn('zorder', dir(pyindex))
+
+    def test_import_time_modules(self):
+        # every public module of the package is lazily importable, and has
+        # its import time measured
+        import pyindex
+        from pyindex import importtime
+        directory = os.path.dirname(os.path.abspath(pyindex.__file__))
+        self.assertEqual(sorted(pyindex.__all__), sorted(
+            name[:-3] for name in os.listdir(directory)
+            if name.endswith('.py') and not name.startswith('_')
+            and name != 'test.py'
+        ))
+        self.assertEqual(
+            importtime.MODULES,
+            ['pyindex'] + ['pyindex.' + name for name in pyindex.__all__]
+        )
+
+
+class TestMorton3(unittest.TestCase):
+
+    def test_interleave3_32(self):
+        self.assertEqual(morton.interleave3_32(0x3FF, 0, 0), 0x09249249)
+        self.assertEqual(morton.interleave3_32(0, 0, 0x3FF), 0x24924924)
+        random = np.random.RandomState(42)
+        for x, y, z in random.randint(0, 1 << 10, (1000, 3)).tolist():
+            key = morton.interleave3_32(x, y, z)
+            self.assertEqual(key, interleave.interleave3(x, y, z))
+            self.assertEqual(morton.deinterleave3_32(key), (x, y, z))
+
+    def test_interleave3_64(self):
+        self.assertEqual(morton.interleave3_64(0x1FFFFF, 0x1FFFFF, 0x1FFFFF),
+                         (1 << 63) - 1)
+        self.assertEqual(morton.interleave3_64(0, 1 << 20, 0), 1 << 61)
+        random = np.random.RandomState(42)
+        for x, y, z in random.randint(0, 1 << 21, (1000, 3)).tolist():
+            key = morton.interleave3_64(x, y, z)
+            self.assertEqual(morton.deinterleave3_64(key), (x, y, z))
+            if max(x, y, z) < 1 << 10:
+                self.assertEqual(key, morton.interleave3_32(x, y, z))
+
+
+class TestCompute(unittest.TestCase):
+
+    def test_make_tables(self):
+        self.assertEqual(list(compute.make_tables(2, 8).forward),
+                         morton.MORTON_TABLE_256)
+
+        tables = compute.make_tables(3, 8)
+        self.assertEqual(len(tables.forward), 256)
+        self.assertEqual(len(tables.reverse), 512)
+        self.assertEqual(tables.forward[0xFF], 0x249249)
+        # 0b111000001: x gets 0b101, y gets 0b100 and z gets 0b100
+        self.assertEqual(tables.reverse[0x1C1],
+                         0b101 | 0b100 << 21 | 0b100 << 42)
+
+        with self.assertRaises(ValueError):
+            compute.make_tables(8, 16)
+
+    def test_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            tables = compute.make_tables(4, 11)
+            path = os.path.join(directory, 'tables')
+            compute.save_tables(tables, path)
+            self.assertEqual(compute.load_tables(path), tables)
+
+            with open(path, 'r+b') as table_file:
+                table_file.write(b'NOTATABL')
+            with self.assertRaises(ValueError):
+                compute.load_tables(path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tables_codecs(self):
+        random = np.random.RandomState(42)
+        for dims, chunk_bits in [(1, 8), (2, 11), (3, 16), (5, 8)]:
+            for _ in range(100):
+                integers = tuple(int(random.randint(0, 1 << 30)) << 40 |
+                                 int(random.randint(0, 1 << 30))
+                                 for _ in range(dims))
+                key = morton.interleave_with_tables(
+                    *integers, chunk_bits=chunk_bits
+                )
+                self.assertEqual(
+                    morton.deinterleave_with_tables(key, dims,
+                                                    chunk_bits=chunk_bits),
+                    integers
+                )
+                if dims == 3:
+                    self.assertEqual(
+                        key & ((1 << 63) - 1),
+                        morton.interleave3_64(*[integer & 0x1FFFFF
+                                                for integer in integers])
+                    )
+
+        self.assertEqual(morton.interleave_with_tables(0xFF, 0x00),
+                         interleave.interleave_any_with_lookup_table(0xFF, 0))
+
+
+class TestMortonBatch(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 2 ** 32, 500, dtype=np.uint64)\
+            .astype(np.uint32)
+        self.y = random.randint(0, 2 ** 32, 500, dtype=np.uint64)\
+            .astype(np.uint32)
+
+    def test_interleave_64_batch(self):
+        interleaved = morton.interleave_64_batch(self.x, self.y)
+        self.assertEqual(interleaved.dtype, np.uint64)
+        self.assertEqual(
+            [int(n) for n in interleaved],
+            [morton.interleave_64(int(x), int(y))
+             for x, y in zip(self.x, self.y)]
+        )
+
+    def test_interleave_32_and_16_batch(self):
+        self.assertEqual(
+            [int(n) for n in morton.interleave_32_batch(self.x, self.y)],
+            [morton.interleave_32(int(x), int(y))
+             for x, y in zip(self.x, self.y)]
+        )
+        self.assertEqual(
+            [int(n) for n in morton.interleave_16_batch(self.x, self.y)],
+            [morton.interleave_16(int(x), int(y))
+             for x, y in zip(self.x, self.y)]
+        )
+
+    def test_batch_idempotency(self):
+        x, y = morton.deinterleave_64_batch(
+            morton.interleave_64_batch(self.x, self.y)
+        )
+        self.assertTrue((x == self.x).all() and (y == self.y).all())
+
+        x, y = morton.deinterleave_32_batch(
+            morton.interleave_32_batch(self.x, self.y)
+        )
+        self.assertTrue((x == self.x & 0xFFFF).all())
+        self.assertTrue((y == self.y & 0xFFFF).all())
+
+        x, y = morton.deinterleave_16_batch(
+            morton.interleave_16_batch(self.x, self.y)
+        )
+        self.assertTrue((x == self.x & 0xFF).all())
+        self.assertTrue((y == self.y & 0xFF).all())
+
+    def test_batch_out(self):
+        out = np.empty(self.x.shape, dtype=np.uint64)
+        interleaved = morton.interleave_64_batch(self.x, self.y, out=out)
+        self.assertIs(interleaved, out)
+
+        out = (np.empty(self.x.shape, dtype=np.uint32),
+               np.empty(self.x.shape, dtype=np.uint32))
+        x, y = morton.deinterleave_64_batch(interleaved, out=out)
+        self.assertIs(x, out[0])
+        self.assertIs(y, out[1])
+        self.assertTrue((x == self.x).all() and (y == self.y).all())
+
+        with self.assertRaises(ValueError):
+            morton.interleave_64_batch(
+                self.x, self.y, out=np.empty(3, dtype=np.uint64)
+            )
+
+
+class TestGeospatialBatch(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.lon = random.uniform(-180, 180, 500)
+        self.lat = random.uniform(-90, 90, 500)
+
+    def test_interleave_batch(self):
+        self.assertEqual(
+            [int(n) for n in geospatial.LonLat.interleave_batch(
+                self.lon, self.lat
+            )],
+            [geospatial.LonLat(lon, lat).interleaved
+             for lon, lat in zip(self.lon, self.lat)]
+        )
+
+    def test_interleave_batch_with_structured_array(self):
+        points = np.zeros(
+            len(self.lon), dtype=[('lon', np.float64), ('lat', np.float64)]
+        )
+        points['lon'] = self.lon
+        points['lat'] = self.lat
+        self.assertTrue((
+            geospatial.LonLat.interleave_batch(points) ==
+            geospatial.LonLat.interleave_batch(self.lon, self.lat)
+        ).all())
+
+    def test_interleave_batch_clamps(self):
+        interleaved = geospatial.LonLat.interleave_batch(
+            [-200, 200], [-100, 100]
+        )
+        self.assertEqual(int(interleaved[0]), 0)
+        self.assertEqual(int(interleaved[1]), morton.UINT64)
+
+    def test_deinterleave_batch(self):
+        lon, lat = geospatial.LonLat.deinterleave_batch(
+            geospatial.LonLat.interleave_batch(self.lon, self.lat)
+        )
+        # 32 bits per axis is precise to about 1e-7 degrees
+        self.assertTrue((np.abs(lon - self.lon) < 1e-6).all())
+        self.assertTrue((np.abs(lat - self.lat) < 1e-6).all())
+
+        for i in range(len(self.lon)):
+            expected = geospatial.LonLat.deinterleave(
+                geospatial.LonLat(self.lon[i], self.lat[i]).interleaved
+            )
+            self.assertAlmostEqual(lon[i], expected.lon)
+            self.assertAlmostEqual(lat[i], expected.lat)
+
+
+class TestLonLatEncoder(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(11)
+        self.lon = random.uniform(-180, 180, 1000)
+        self.lat = random.uniform(-90, 90, 1000)
+
+    def test_key_size(self):
+        for bits, key_bits in ((1, 16), (8, 16), (9, 32), (16, 32),
+                               (17, 64), (32, 64)):
+            encoder = geospatial.LonLatEncoder(bits)
+            self.assertEqual(encoder.key_bits, key_bits)
+            keys = encoder.encode_batch(self.lon, self.lat)
+            self.assertEqual(keys.dtype, np.dtype('uint{}'.format(key_bits)))
+            self.assertLess(int(keys.max()), 1 << (2 * bits))
+        with self.assertRaises(ValueError):
+            geospatial.LonLatEncoder(33)
+
+    def test_same_as_lonlat(self):
+        encoder = geospatial.LonLatEncoder(32)
+        self.assertEqual(
+            encoder.encode_batch(self.lon, self.lat).tolist(),
+            geospatial.LonLat.interleave_batch(self.lon, self.lat).tolist()
+        )
+        self.assertEqual(encoder.encode(2.3522, 48.8566),
+                         geospatial.LonLat(2.3522, 48.8566).interleaved)
+
+    def test_encode_decode(self):
+        for bits in (5, 16, 26):
+            encoder = geospatial.LonLatEncoder(bits)
+            keys = encoder.encode_batch(self.lon, self.lat)
+            lon, lat = encoder.decode_batch(keys)
+            # the lower corners of the cells of the points
+            width = 360 / encoder.max_value
+            height = 180 / encoder.max_value
+            self.assertTrue(np.all(self.lon - lon >= -1e-9))
+            self.assertTrue(np.all(self.lon - lon <= width + 1e-9))
+            self.assertTrue(np.all(self.lat - lat >= -1e-9))
+            self.assertTrue(np.all(self.lat - lat <= height + 1e-9))
+            for i in range(0, 1000, 71):
+                self.assertEqual(encoder.encode(self.lon[i], self.lat[i]),
+                                 keys[i])
+                lonlat = encoder.decode(int(keys[i]))
+                self.assertAlmostEqual(lonlat.lon, lon[i])
+                self.assertAlmostEqual(lonlat.lat, lat[i])
+
+    def test_mercator(self):
+        encoder = geospatial.LonLatEncoder(16, geospatial.MercatorLonLat)
+        projected = geospatial.MercatorLonLat.project(
+            geospatial.LonLat(2.3522, 48.8566)
+        )
+        decoded = encoder.decode(encoder.encode(*projected))
+        self.assertIsInstance(decoded, geospatial.MercatorLonLat)
+        self.assertLess(abs(decoded.lon - projected.lon), 612)
+        self.assertLess(abs(decoded.lat - projected.lat), 612)
+
+
+class TestMercatorBatch(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.lon = random.uniform(-180, 180, 500)
+        self.lat = random.uniform(-85, 85, 500)
+        self.projected = [
+            geospatial.MercatorLonLat.project(geospatial.LonLat(lon, lat))
+            for lon, lat in zip(self.lon, self.lat)
+        ]
+
+    def test_project_batch(self):
+        lon, lat = geospatial.MercatorLonLat.project_batch(
+            self.lon, self.lat
+        )
+        for i, projected in enumerate(self.projected):
+            self.assertAlmostEqual(lon[i], projected.lon, places=6)
+            self.assertAlmostEqual(lat[i], projected.lat, places=6)
+
+    def test_project_batch_clamps(self):
+        lon, lat = geospatial.MercatorLonLat.project_batch(
+            [0, 0], [90, -90]
+        )
+        half = geospatial.MercatorLonLat.HALF_CIRCUMFERENCE
+        self.assertAlmostEqual(lat[0], half, places=6)
+        self.assertAlmostEqual(lat[1], -half, places=6)
+
+    def test_deproject_batch(self):
+        lon, lat = geospatial.MercatorLonLat.deproject_batch(
+            *geospatial.MercatorLonLat.project_batch(self.lon, self.lat)
+        )
+        self.assertTrue((np.abs(lon - self.lon) < 1e-9).all())
+        self.assertTrue((np.abs(lat - self.lat) < 1e-9).all())
+
+    def test_project_interleave_batch(self):
+        self.assertEqual(
+            [int(n) for n in
+             geospatial.MercatorLonLat.project_interleave_batch(
+                 self.lon, self.lat
+             )],
+            [projected.interleaved for projected in self.projected]
+        )
+
+
+class TestZorder(unittest.TestCase):
+
+    def covered_keys(self, ranges):
+        return [key for first, last in ranges for key in range(first, last + 1)]
+
+    def test_bbox_ranges(self):
+        lower, upper = (3, 5), (12, 9)
+        expected = sorted(
+            interleave.interleave2(x, y)
+            for x in range(lower[0], upper[0] + 1)
+            for y in range(lower[1], upper[1] + 1)
+        )
+        ranges = zorder.bbox_ranges(lower, upper, bits=4, max_ranges=None)
+        self.assertEqual(self.covered_keys(ranges), expected)
+        # ranges are merged, so none of them touch
+        for previous, current in zip(ranges, ranges[1:]):
+            self.assertGreater(current[0], previous[1] + 1)
+
+    def test_bbox_ranges_3d(self):
+        lower, upper = (1, 2, 3), (5, 4, 7)
+        expected = sorted(
+            interleave.interleave3(x, y, z)
+            for x in range(lower[0], upper[0] + 1)
+            for y in range(lower[1], upper[1] + 1)
+            for z in range(lower[2], upper[2] + 1)
+        )
+        ranges = zorder.bbox_ranges(lower, upper, bits=10, max_ranges=None)
+        self.assertEqual(self.covered_keys(ranges), expected)
+
+    def test_bbox_ranges_limits(self):
+        lower, upper = (3, 5), (12, 9)
+        expected = zorder.bbox_ranges(lower, upper, bits=4, max_ranges=None)
+        expected_keys = self.covered_keys(expected)
+
+        for max_ranges in range(1, len(expected)):
+            ranges = zorder.bbox_ranges(
+                lower, upper, bits=4, max_ranges=max_ranges
+            )
+            self.assertLessEqual(len(ranges), max_ranges)
+            keys = set(self.covered_keys(ranges))
+            self.assertTrue(keys.issuperset(expected_keys))
+
+        ranges = zorder.bbox_ranges(lower, upper, bits=4, max_depth=1)
+        keys = set(self.covered_keys(ranges))
+        self.assertTrue(keys.issuperset(expected_keys))
+
+    def test_bbox_ranges_large_box(self):
+        # an exact cover would take about a minute and 2 million ranges
+        ranges = zorder.morton_bbox_ranges(12345, 67890, 1012345, 1067890)
+        self.assertEqual(len(ranges), zorder.MAX_RANGES)
+        self.assertLessEqual(ranges[0][0], morton.interleave_64(12345, 67890))
+        self.assertGreaterEqual(ranges[-1][1],
+                                morton.interleave_64(1012345, 1067890))
+
+    def test_morton_bbox_ranges(self):
+        expected = sorted(
+            morton.interleave_64(x, y)
+            for x in range(10, 14) for y in range(20, 26)
+        )
+        self.assertEqual(
+            self.covered_keys(zorder.morton_bbox_ranges(10, 20, 13, 25)),
+            expected
+        )
+        self.assertEqual(
+            zorder.morton_bbox_ranges(0, 0, morton.UINT32, morton.UINT32),
+            [(0, morton.UINT64)]
+        )
+
+    def test_merge_ranges(self):
+        self.assertEqual(
+            zorder.merge_ranges([(0, 3), (4, 5), (10, 12), (20, 21)]),
+            [(0, 5), (10, 12), (20, 21)]
+        )
+        self.assertEqual(
+            zorder.merge_ranges([(0, 3), (4, 5), (10, 12), (20, 21)], 2),
+            [(0, 12), (20, 21)]
+        )
+
+    def test_cover_ranges_batch(self):
+        def classify_batch(lower, upper):
+            def classify(mins, maxs):
+                kinds = [zorder.box_classifier(lower, upper)(low, high)
+                         for low, high in zip(zip(*mins), zip(*maxs))]
+                return np.array(kinds)
+            return classify
+
+        for lower, upper, bits in [((3, 5), (12, 9), 4),
+                                   ((1, 2, 3), (5, 4, 7), 10),
+                                   ((0, 0), (15, 15), 4)]:
+            for max_ranges in (None, 1, 3, 8):
+                self.assertEqual(
+                    zorder.cover_ranges_batch(
+                        classify_batch(lower, upper), len(lower), bits,
+                        max_ranges=max_ranges
+                    ),
+                    zorder.bbox_ranges(lower, upper, bits,
+                                       max_ranges=max_ranges)
+                )
+        self.assertEqual(
+            zorder.cover_ranges_batch(
+                lambda mins, maxs: np.zeros(len(mins[0])), 2, 4
+            ),
+            []
+        )
+        # cells which never settle stop the cover at a bounded size
+        ranges = zorder.cover_ranges_batch(
+            lambda mins, maxs: np.full(len(mins[0]), zorder.PARTIAL), 2, 32,
+            max_ranges=4
+        )
+        self.assertEqual(ranges, [(0, morton.UINT64)])
+
+
+class TestBigminLitmax(unittest.TestCase):
+
+    def setUp(self):
+        # a long, thin box in a 2D grid of 4 bits per dimension
+        self.lower, self.upper = (2, 5), (13, 6)
+        self.zmin = interleave.interleave2(*self.lower)
+        self.zmax = interleave.interleave2(*self.upper)
+        self.in_box = sorted(
+            interleave.interleave2(x, y)
+            for x in range(self.lower[0], self.upper[0] + 1)
+            for y in range(self.lower[1], self.upper[1] + 1)
+        )
+
+    def test_bigmin(self):
+        for key in range(256):
+            expected = next((k for k in self.in_box if k > key), None)
+            self.assertEqual(
+                zorder.bigmin(key, self.zmin, self.zmax, 2, 4), expected
+            )
+
+    def test_litmax(self):
+        for key in range(256):
+            expected = next(
+                (k for k in reversed(self.in_box) if k < key), None
+            )
+            self.assertEqual(
+                zorder.litmax(key, self.zmin, self.zmax, 2, 4), expected
+            )
+
+    def test_in_box(self):
+        for key in range(256):
+            self.assertEqual(
+                zorder.in_box(key, self.zmin, self.zmax, 2, 4),
+                key in self.in_box
+            )
+        self.assertEqual(
+            list(zorder.in_box_batch(range(256), self.zmin, self.zmax, 2, 4)),
+            [key in self.in_box for key in range(256)]
+        )
+
+    def test_batch(self):
+        for scalar, batch in ((zorder.bigmin, zorder.bigmin_batch),
+                              (zorder.litmax, zorder.litmax_batch)):
+            results, found = batch(range(256), self.zmin, self.zmax, 2, 4)
+            for key in range(256):
+                expected = scalar(key, self.zmin, self.zmax, 2, 4)
+                if expected is None:
+                    self.assertFalse(found[key])
+                else:
+                    self.assertTrue(found[key])
+                    self.assertEqual(int(results[key]), expected)
+
+    def test_interleave4_layout(self):
+        lower, upper = (1, 100, 7, 0), (3, 2000, 9, 65535)
+        zmin = interleave.interleave4(*lower)
+        zmax = interleave.interleave4(*upper)
+        key = interleave.interleave4(2, 50, 8, 10)
+        next_key = zorder.bigmin(key, zmin, zmax, 4, 16)
+        self.assertTrue(zorder.in_box(next_key, zmin, zmax, 4, 16))
+        self.assertGreater(next_key, key)
+        self.assertEqual(
+            int(zorder.bigmin_batch([key], zmin, zmax, 4, 16)[0][0]),
+            next_key
+        )
+
+
+class TestMortonIndex(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 1000, 5000)
+        self.y = random.randint(0, 1000, 5000)
+        self.index = index.MortonIndex.build(self.x, self.y)
+
+    def brute_force(self, x_min, y_min, x_max, y_max):
+        return np.nonzero(
+            (self.x >= x_min) & (self.x <= x_max) &
+            (self.y >= y_min) & (self.y <= y_max)
+        )[0]
+
+    def test_query(self):
+        for box in ((100, 200, 300, 250), (0, 0, 999, 999), (5, 5, 5, 5),
+                    (-10, -10, 20, 2 ** 40), (500, 0, 501, 999)):
+            self.assertEqual(
+                sorted(self.index.query(*box)), list(self.brute_force(*box))
+            )
+            self.assertEqual(
+                self.index.count(*box), len(self.brute_force(*box))
+            )
+
+    def test_query_with_few_ranges(self):
+        few_ranges = index.MortonIndex(
+            self.index.keys, self.index.ids, max_ranges=1
+        )
+        box = (100, 200, 300, 250)
+        self.assertEqual(
+            sorted(few_ranges.query(*box)), list(self.brute_force(*box))
+        )
+
+    def test_empty_query(self):
+        self.assertEqual(len(self.index.query(10, 10, 5, 5)), 0)
+        self.assertEqual(self.index.count(2000, 2000, 3000, 3000), 0)
+
+    def test_lookup(self):
+        x, y = self.x[17], self.y[17]
+        expected = np.nonzero((self.x == x) & (self.y == y))[0]
+        self.assertEqual(list(self.index.lookup(x, y)), list(expected))
+        self.assertEqual(len(self.index.lookup(5000, 5000)), 0)
+
+    def test_ids(self):
+        ids = np.arange(len(self.x)) * 10
+        indexed = index.MortonIndex.build(self.x, self.y, ids)
+        box = (100, 200, 300, 250)
+        self.assertEqual(
+            sorted(indexed.query(*box)), list(self.brute_force(*box) * 10)
+        )
+
+    def test_query_batch(self):
+        boxes = [(100, 200, 300, 250), (0, 0, 999, 999), (10, 10, 5, 5),
+                 (-10, -10, 20, 2 ** 40), (2000, 2000, 3000, 3000)]
+        found = self.index.query_batch(boxes)
+        self.assertEqual(len(found), len(boxes))
+        for ids, box in zip(found, boxes):
+            self.assertEqual(list(ids), list(self.index.query(*box)))
+        self.assertEqual(self.index.query_batch([]), [])
+
+
+class TestNearest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.lon = random.uniform(-180, 180, 5000)
+        self.lat = random.uniform(-90, 90, 5000)
+        self.index = index.LonLatIndex.build(self.lon, self.lat)
+
+    def test_haversine(self):
+        paris = geospatial.LonLat(2.3522, 48.8566)
+        london = geospatial.LonLat(-0.1276, 51.5072)
+        self.assertAlmostEqual(
+            geospatial.haversine(paris, london) / 1000, 343.9, places=0
+        )
+        self.assertAlmostEqual(
+            float(geospatial.haversine_batch(
+                paris.lon, paris.lat, london.lon, london.lat
+            )),
+            geospatial.haversine(paris, london)
+        )
+
+    def test_radius_bboxes(self):
+        self.assertEqual(len(geospatial.radius_bboxes(0, 0, 1000)), 1)
+        # crossing the antimeridian
+        boxes = geospatial.radius_bboxes(179.999, 0, 1000)
+        self.assertEqual(len(boxes), 2)
+        self.assertEqual(boxes[0][2], 180)
+        self.assertEqual(boxes[1][0], -180)
+        # containing the north pole
+        self.assertEqual(
+            geospatial.radius_bboxes(0, 89.999, 1000)[0][0::2], (-180, 180)
+        )
+
+    def test_circle_ranges(self):
+        keys = self.index.keys
+        plon, plat = self.index.lonlat.deinterleave_batch(keys)
+        # including circles across the antimeridian and around the poles
+        for lon, lat, metres in [(2.35, 48.85, 5e5), (179.9, 10, 1e6),
+                                 (-179.95, -10, 1e6), (0, 89.9, 5e5),
+                                 (10, -89, 2e6), (45, 0, 1.2e7)]:
+            ranges = geospatial.circle_ranges(lon, lat, metres)
+            self.assertLessEqual(len(ranges), 64)
+            covered = np.zeros(len(keys), dtype=bool)
+            for first, last in ranges:
+                covered[np.searchsorted(keys, np.uint64(first)):
+                        np.searchsorted(keys, np.uint64(last), 'right')] = True
+            inside = geospatial.haversine_batch(lon, lat, plon, plat) <= \
+                metres
+            self.assertTrue(covered[inside].all())
+            np.testing.assert_array_equal(
+                geospatial.refine_circle_batch(keys[covered], lon, lat,
+                                               metres),
+                inside[covered]
+            )
+        # half way around the Earth or more, the circle is everything
+        for metres in (2e7, float('inf')):
+            self.assertEqual(geospatial.circle_ranges(0, 0, metres),
+                             [(0, morton.UINT64)])
+            self.assertEqual(len(self.index.within(0, 0, metres)),
+                             len(self.index.ids))
+        with self.assertRaises(ValueError):
+            geospatial.circle_ranges(0, 0, float('nan'))
+
+    def test_within(self):
+        lon = np.array([2.35, 179.9, 0, -60])
+        lat = np.array([48.85, 0, 89.5, -30])
+        metres = np.array([5e5, 1e6, 3e5, 1e6])
+        found = self.index.within_batch(lon, lat, metres)
+        plon, plat = self.index.lonlat.deinterleave_batch(self.index.keys)
+        for i, ids in enumerate(found):
+            inside = geospatial.haversine_batch(
+                lon[i], lat[i], plon, plat
+            ) <= metres[i]
+            self.assertEqual(sorted(ids), sorted(self.index.ids[inside]))
+        self.assertEqual(sorted(self.index.within(2.35, 48.85, 5e5)),
+                         sorted(found[0]))
+
+    def test_nearest_in_grid(self):
+        x = (self.lon * 100).astype(int) + 20000
+        y = (self.lat * 100).astype(int) + 10000
+        grid_index = index.MortonIndex.build(x, y)
+        for qx, qy in ((20000, 10000), (0, 0), (35000, 1000)):
+            ids, distances = grid_index.nearest(qx, qy, 10)
+            expected = np.sort(np.hypot(x - qx, y - qy))[:10]
+            self.assertTrue(np.allclose(distances, expected))
+            self.assertTrue(np.allclose(
+                np.hypot(x[ids] - qx, y[ids] - qy), distances
+            ))
+
+    def test_nearest_haversine(self):
+        for lon, lat in ((2.35, 48.85), (179.9, -10), (-30, 89.5)):
+            ids, distances = self.index.nearest(lon, lat, 20)
+            expected = np.sort(
+                geospatial.haversine_batch(lon, lat, self.lon, self.lat)
+            )[:20]
+            # the index holds co-ordinates rounded to its grid
+            self.assertTrue(np.allclose(distances, expected, atol=0.1))
+            self.assertTrue((np.diff(distances) >= 0).all())
+
+    def test_nearest_euclidean(self):
+        ids, distances = self.index.nearest(10, 10, 5, distance='euclidean')
+        expected = np.sort(np.hypot(self.lon - 10, self.lat - 10))[:5]
+        self.assertTrue(np.allclose(distances, expected, atol=1e-6))
+
+        with self.assertRaises(ValueError):
+            self.index.nearest(10, 10, 5, distance='manhattan')
+
+    def test_nearest_more_than_indexed(self):
+        ids, distances = self.index.nearest(0, 0, 10 ** 6)
+        self.assertEqual(len(ids), len(self.lon))
+
+    def test_nearest_with_boxes_missing_points(self):
+        # boxes holding fewer than k points must not keep the search going
+        key = int(self.index.lonlat.interleave_batch([10], [10])[0])
+        x, y = morton.deinterleave_64(key)
+
+        def distances(positions):
+            px, py = morton.deinterleave_64_batch(self.index.keys[positions])
+            return np.hypot(px - float(x), py - float(y))
+
+        # a box around a corner of the grid, holding none of the points
+        positions, found = self.index._nearest(
+            key, 5, distances, lambda radius: [(0, 0, 0, 0)]
+        )
+        self.assertEqual(len(positions), 5)
+        self.assertTrue((np.diff(found) >= 0).all())
+
+
+class TestHilbert(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 2 ** 32, 200, dtype=np.uint64)\
+            .astype(np.uint32)
+        self.y = random.randint(0, 2 ** 32, 200, dtype=np.uint64)\
+            .astype(np.uint32)
+        self.z = random.randint(0, 2 ** 10, 200).astype(np.uint32)
+
+    def test_hilbert_64_is_continuous(self):
+        # consecutive indices are always adjacent cells
+        for n in (0, 1, 2 ** 31 - 1, 0xDEADBEEFCAFE, 2 ** 64 - 2):
+            x1, y1 = hilbert.dehilbert_64(n)
+            x2, y2 = hilbert.dehilbert_64(n + 1)
+            self.assertEqual(abs(x1 - x2) + abs(y1 - y2), 1)
+
+    def test_hilbert3_is_continuous(self):
+        for n in (0, 1, 12345, 2 ** 30 - 2):
+            first = hilbert.dehilbert3(n)
+            second = hilbert.dehilbert3(n + 1)
+            self.assertEqual(
+                sum(abs(a - b) for a, b in zip(first, second)), 1
+            )
+
+    def test_idempotency(self):
+        for x, y, z in zip(self.x[:20], self.y[:20], self.z[:20]):
+            x, y, z = int(x), int(y), int(z)
+            self.assertEqual(hilbert.dehilbert_64(hilbert.hilbert_64(x, y)),
+                             (x, y))
+            self.assertEqual(
+                hilbert.dehilbert3(hilbert.hilbert3(x & 0x3FF, y & 0x3FF, z)),
+                (x & 0x3FF, y & 0x3FF, z)
+            )
+
+    def test_batch(self):
+        keys = hilbert.hilbert_64_batch(self.x, self.y)
+        self.assertEqual(
+            [int(key) for key in keys],
+            [hilbert.hilbert_64(int(x), int(y))
+             for x, y in zip(self.x, self.y)]
+        )
+        x, y = hilbert.dehilbert_64_batch(keys)
+        self.assertTrue((x == self.x).all() and (y == self.y).all())
+
+        keys = hilbert.hilbert3_batch(self.x, self.y, self.z)
+        self.assertEqual(
+            [int(key) for key in keys],
+            [hilbert.hilbert3(int(x), int(y), int(z))
+             for x, y, z in zip(self.x, self.y, self.z)]
+        )
+        x, y, z = hilbert.dehilbert3_batch(keys)
+        self.assertTrue((x == self.x & 0x3FF).all())
+        self.assertTrue((z == self.z).all())
+
+
+class TestRangeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [0.0]
+        self.cache = cache.RangeCache(maxsize=2, ttl=10,
+                                      clock=lambda: self.now[0])
+
+    def test_ranges(self):
+        box = (1000, 2000, 50000, 70000)
+        ranges = self.cache.ranges(*box, max_ranges=8)
+        self.assertEqual(list(ranges),
+                         zorder.morton_bbox_ranges(*box, max_ranges=8))
+        self.assertIs(self.cache.ranges(*box, max_ranges=8), ranges)
+        # a different max_ranges is another entry
+        self.assertNotEqual(self.cache.ranges(*box, max_ranges=4), ranges)
+        self.assertEqual(self.cache.stats(),
+                         cache.CacheStats(1, 2, 0, 0, 2, 2))
+
+    def test_eviction(self):
+        self.cache.ranges(0, 0, 10, 10)
+        self.cache.ranges(0, 0, 20, 20)
+        self.cache.ranges(0, 0, 10, 10)
+        # evicts the least recently used box, (0, 0, 20, 20)
+        self.cache.ranges(0, 0, 30, 30)
+        self.cache.ranges(0, 0, 10, 10)
+        self.assertEqual(self.cache.stats().evictions, 1)
+        self.assertEqual(self.cache.stats().hits, 2)
+
+        self.now[0] = 10
+        self.cache.ranges(0, 0, 10, 10)
+        stats = self.cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.expirations),
+                         (2, 4, 1))
+
+        self.cache.clear()
+        self.assertEqual(self.cache.stats(),
+                         cache.CacheStats(0, 0, 0, 0, 0, 2))
+
+    def test_threads(self):
+        import threading
+
+        shared = cache.RangeCache(maxsize=16)
+        boxes = [(i, i, i + 1000, i + 2000) for i in range(32)]
+
+        def query():
+            for box in boxes * 4:
+                self.assertEqual(list(shared.ranges(*box)),
+                                 zorder.morton_bbox_ranges(*box))
+
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = shared.stats()
+        self.assertEqual(stats.hits + stats.misses, 4 * 4 * 32)
+        self.assertLessEqual(stats.size, 16)
+
+    def test_index(self):
+        random = np.random.RandomState(42)
+        x = random.randint(0, 1 << 20, 1000)
+        y = random.randint(0, 1 << 20, 1000)
+        shared = cache.RangeCache()
+        cached = index.MortonIndex.build(x, y, range_cache=shared)
+        plain = index.MortonIndex.build(x, y)
+        for _ in range(2):
+            self.assertEqual(list(cached.query(1000, 2000, 500000, 700000)),
+                             list(plain.query(1000, 2000, 500000, 700000)))
+        self.assertEqual(shared.stats().hits, 1)
+
+
+class TestDiskIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'index')
+
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 1000, 5000)
+        self.y = random.randint(0, 1000, 5000)
+        self.index = index.MortonIndex.build(self.x, self.y)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        diskindex.write(self.path, self.index, fence_stride=64)
+        with diskindex.MortonIndexFile(self.path) as mapped:
+            self.assertEqual(len(mapped), len(self.index))
+            self.assertTrue((mapped.keys == self.index.keys).all())
+            self.assertTrue((mapped.ids == self.index.ids).all())
+            self.assertTrue((mapped.fence == self.index.keys[::64]).all())
+
+            for box in ((100, 200, 300, 250), (0, 0, 999, 999), (5, 5, 5, 5)):
+                self.assertEqual(
+                    sorted(mapped.query(*box)), sorted(self.index.query(*box))
+                )
+            self.assertEqual(
+                list(mapped.lookup(self.x[3], self.y[3])),
+                list(self.index.lookup(self.x[3], self.y[3]))
+            )
+
+    def test_fenced_search(self):
+        diskindex.write(self.path, self.index, fence_stride=10)
+        with diskindex.MortonIndexFile(self.path) as mapped:
+            values = np.concatenate([
+                self.index.keys[::7],
+                np.array([0, morton.UINT64], dtype=np.uint64)
+            ])
+            for side in ('left', 'right'):
+                self.assertTrue((
+                    mapped._fenced_search(values, side) ==
+                    np.searchsorted(self.index.keys, values, side=side)
+                ).all())
+                self.assertEqual(
+                    mapped._fenced_search(values[3], side),
+                    np.searchsorted(self.index.keys, values[3], side=side)
+                )
+
+    def test_close_with_views(self):
+        diskindex.write(self.path, self.index)
+        mapped = diskindex.MortonIndexFile(self.path)
+        keys = mapped.keys
+        mapped.close()
+        mapped.close()
+        # the view keeps the file mapped
+        self.assertTrue((keys == self.index.keys).all())
+
+    def test_writer_in_chunks(self):
+        with diskindex.IndexWriter(self.path, len(self.index), 100) as writer:
+            for start in range(0, len(self.index), 333):
+                writer.append(self.index.keys[start:start + 333],
+                              self.index.ids[start:start + 333])
+        with diskindex.MortonIndexFile(self.path) as mapped:
+            self.assertTrue((mapped.keys == self.index.keys).all())
+            self.assertTrue((mapped.fence == self.index.keys[::100]).all())
+
+    def test_writer_checks(self):
+        writer = diskindex.IndexWriter(self.path, 10)
+        with self.assertRaises(ValueError):
+            writer.append([3, 2, 1], [0, 1, 2])
+        writer.append([1, 2, 3], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            writer.append([0], [3])
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def test_lonlat_index_file(self):
+        random = np.random.RandomState(42)
+        lonlat_index = index.LonLatIndex.build(
+            random.uniform(-180, 180, 1000), random.uniform(-90, 90, 1000)
+        )
+        diskindex.write(self.path, lonlat_index)
+        with diskindex.LonLatIndexFile(self.path) as mapped:
+            self.assertEqual(
+                sorted(mapped.query(-30, -20, 40, 10)),
+                sorted(lonlat_index.query(-30, -20, 40, 10))
+            )
+            self.assertEqual(
+                list(mapped.nearest(2.35, 48.85, 5)[0]),
+                list(lonlat_index.nearest(2.35, 48.85, 5)[0])
+            )
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as not_an_index:
+            not_an_index.write(b'\0' * 100)
+        with self.assertRaises(ValueError):
+            diskindex.MortonIndexFile(self.path)
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'index')
+
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 2 ** 32, 20000, dtype=np.uint64)\
+            .astype(np.uint32)
+        self.y = random.randint(0, 2 ** 32, 20000, dtype=np.uint64)\
+            .astype(np.uint32)
+        self.chunks = [
+            (self.x[start:start + 1500], self.y[start:start + 1500])
+            for start in range(0, len(self.x), 1500)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_index(self):
+        keys = morton.interleave_64_batch(self.x, self.y)
+        with diskindex.MortonIndexFile(self.path) as mapped:
+            self.assertTrue((mapped.keys == np.sort(keys)).all())
+            self.assertTrue((keys[mapped.ids] == mapped.keys).all())
+
+    def test_bulk_load(self):
+        progress = []
+        count = bulkload.bulk_load(
+            self.chunks, self.path, memory_limit='100KB',
+            temp_dir=self.directory, report=progress.append
+        )
+        self.assertEqual(count, len(self.x))
+        self.check_index()
+
+        self.assertEqual(progress[-1].stage, 'merge')
+        self.assertEqual(progress[-1].rows, len(self.x))
+        # the runs are removed once merged
+        self.assertEqual(os.listdir(self.directory), ['index'])
+
+    def test_bulk_load_in_several_passes(self):
+        # 100 runs of 100 points, merged 10 runs at a time
+        bulkload.bulk_load(
+            self.chunks, self.path,
+            memory_limit=bulkload.BYTES_PER_POINT * 200,
+            temp_dir=self.directory
+        )
+        self.check_index()
+
+    def test_bulk_load_with_ids(self):
+        chunks = [(x, y, np.arange(len(x)) + 1000 * i)
+                  for i, (x, y) in enumerate(self.chunks[:3])]
+        count = bulkload.bulk_load(chunks, self.path, with_ids=True)
+        self.assertEqual(count, 4500)
+        with diskindex.MortonIndexFile(self.path) as mapped:
+            self.assertEqual(int(mapped.ids.max()), 2000 + 1499)
+
+    def test_bulk_load_lonlat(self):
+        random = np.random.RandomState(42)
+        lon = random.uniform(-180, 180, 1000)
+        lat = random.uniform(-90, 90, 1000)
+        bulkload.bulk_load([(lon, lat)], self.path,
+                           encode=geospatial.LonLat.interleave_batch)
+        with diskindex.LonLatIndexFile(self.path) as mapped:
+            self.assertEqual(
+                sorted(mapped.query(-30, -20, 40, 10)),
+                list(np.nonzero((lon >= -30) & (lon <= 40) &
+                                (lat >= -20) & (lat <= 10))[0])
+            )
+
+    def test_parse_size(self):
+        self.assertEqual(bulkload.parse_size('2GB'), 2 * 1024 ** 3)
+        self.assertEqual(bulkload.parse_size('1.5 GiB'), 1.5 * 1024 ** 3)
+        self.assertEqual(bulkload.parse_size('512k'), 512 * 1024)
+        self.assertEqual(bulkload.parse_size(1000), 1000)
+        with self.assertRaises(ValueError):
+            bulkload.parse_size('lots')
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(7)
+        self.lon = random.uniform(-180, 180, 2000)
+        self.lat = random.uniform(-85, 85, 2000)
+        self.index = index.LonLatIndex.build(self.lon, self.lat)
+
+    def exchange(self, requests, **kwargs):
+        """
+        Sends `requests` (as lines of text) on one connection without
+        waiting for the answers, and returns the answers by id.
+        """
+        async def run():
+            query_server = server.QueryServer(self.index, port=0, **kwargs)
+            host, port = await query_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(''.join(line + '\n' for line in requests)
+                             .encode('utf-8'))
+                await writer.drain()
+                answers = [json.loads(await reader.readline())
+                           for _ in requests]
+                writer.close()
+                return answers
+            finally:
+                await query_server.close()
+
+        return {answer['id']: answer for answer in asyncio.run(run())}
+
+    def test_queries(self):
+        boxes = [(-10, -10, 10, 10), (100, 20, 140, 60), (179, -5, 180, 5)]
+        requests = [json.dumps({'id': i, 'op': 'bbox', 'box': box})
+                    for i, box in enumerate(boxes)]
+        requests.append(json.dumps({'id': 'r', 'op': 'radius',
+                                    'point': [2.35, 48.85], 'metres': 2e6}))
+        requests.append(json.dumps({'id': 'k', 'op': 'knn',
+                                    'point': [0, 0], 'k': 3}))
+
+        answers = self.exchange(requests)
+        for i, box in enumerate(boxes):
+            self.assertEqual(answers[i]['ids'],
+                             self.index.query(*box).tolist())
+        self.assertEqual(sorted(answers['r']['ids']),
+                         sorted(self.index.within(2.35, 48.85, 2e6)))
+        ids, distances = self.index.nearest(0, 0, k=3)
+        self.assertEqual(answers['k']['ids'], ids.tolist())
+        self.assertEqual(answers['k']['distances'], distances.tolist())
+
+    def test_errors(self):
+        answers = self.exchange([
+            'not json',
+            json.dumps({'id': 1, 'op': 'nearest'}),
+            json.dumps({'id': 2, 'op': 'bbox', 'box': [0, 0, 1]}),
+            json.dumps({'id': 3, 'op': 'knn', 'point': [0, 0], 'k': 0}),
+            json.dumps({'id': 4, 'op': 'bbox', 'box': [0, 0, 1, 1]}),
+        ])
+        self.assertIn('error', answers[None])
+        for i in (1, 2, 3):
+            self.assertIn('error', answers[i])
+        self.assertEqual(answers[4]['ids'],
+                         self.index.query(0, 0, 1, 1).tolist())
+
+        with self.assertRaises(ValueError):
+            server.parse_request({'op': 'radius', 'point': [0, 0],
+                                  'metres': 1}, lonlat=False)
+        with self.assertRaises(ValueError):
+            server.parse_request({'op': 'bbox', 'box': [0.5, 0, 1, 1]},
+                                 lonlat=False)
+        # json.loads accepts NaN, which must not reach the index
+        for request in ('{"op": "knn", "point": [NaN, 0]}',
+                        '{"op": "radius", "point": [0, 0], '
+                        '"metres": Infinity}'):
+            with self.assertRaises(ValueError):
+                server.parse_request(json.loads(request))
+        with self.assertRaises(ValueError):
+            self.index.nearest(float('nan'), 0)
+        with self.assertRaises(ValueError):
+            server.parse_request({'op': 'knn', 'point': [1.5, 2]},
+                                 lonlat=False)
+
+    def test_run_batch_isolation(self):
+        class Failing(object):
+            # fails the boxes starting at 666 and the kNN queries
+            def query_batch(self, boxes):
+                if any(box[0] == 666 for box in boxes):
+                    raise ValueError("bad box")
+                return [np.arange(box[0], box[0] + 2) for box in boxes]
+
+            def nearest(self, x, y, k):
+                raise ValueError("no kNN")
+
+        results = server.run_batch(Failing(), [
+            ('bbox', (1, 0, 2, 2)), ('bbox', (666, 0, 667, 1)),
+            ('knn', 0, 0, 1), ('bbox', (5, 0, 6, 6)),
+        ])
+        self.assertEqual(results, [{'ids': [1, 2]}, {'error': 'bad box'},
+                                   {'error': 'no kNN'}, {'ids': [5, 6]}])
+
+    def test_batching(self):
+        calls = []
+        query_batch = self.index.query_batch
+
+        def counted(boxes):
+            calls.append(len(boxes))
+            return query_batch(boxes)
+
+        self.index.query_batch = counted
+        requests = [
+            json.dumps({'id': i, 'op': 'bbox', 'box': [i, 0, i + 5, 5]})
+            for i in range(40)
+        ]
+        answers = self.exchange(requests, max_batch=16, batch_delay=0.05,
+                                max_pending=8, max_in_flight=20)
+        for i in range(40):
+            self.assertEqual(answers[i]['ids'],
+                             self.index.query(i, 0, i + 5, 5).tolist())
+        self.assertEqual(sum(calls), 40)
+        self.assertLessEqual(max(calls), 16)
+        self.assertLess(len(calls), 40)
+
+
+class TestTiles(unittest.TestCase):
+
+    def test_quadkey(self):
+        # the example of the Bing Maps tile system
+        self.assertEqual(tiles.tile_quadkey((3, 3, 5)), '213')
+        self.assertEqual(tiles.quadkey_tile('213'), tiles.Tile(3, 3, 5))
+        self.assertEqual(tiles.tile_quadkey((0, 0, 0)), '')
+        for quadkey in ('0', '1', '2', '3', '0123' * 8):
+            self.assertEqual(
+                tiles.tile_quadkey(tiles.quadkey_tile(quadkey)), quadkey
+            )
+        with self.assertRaises(ValueError):
+            tiles.quadkey_prefix('124')
+        with self.assertRaises(ValueError):
+            tiles.tile_prefix((2, 4, 0))
+        with self.assertRaises(ValueError):
+            tiles.key_prefix(0, 33)
+
+    def test_key_tile(self):
+        # north-west, north-east, south-west and south-east corners
+        for lon, lat, tile in ((-179, 85, (1, 0, 0)), (179, 85, (1, 1, 0)),
+                               (-179, -85, (1, 0, 1)),
+                               (179, -85, (1, 1, 1))):
+            key = geospatial.WebMercatorLonLat.project(
+                geospatial.LonLat(lon, lat)
+            ).interleaved
+            self.assertEqual(tiles.key_tile(key, 1), tile)
+        # Paris, at zoom 10
+        key = int(geospatial.WebMercatorLonLat.project_interleave_batch(
+            [2.3522], [48.8566]
+        )[0])
+        self.assertEqual(tiles.key_tile(key, 10), (10, 518, 352))
+        self.assertEqual(tiles.key_tile(key, 0), (0, 0, 0))
+
+        prefix = tiles.key_prefix(key, 10)
+        first, last = tiles.prefix_range(prefix, 10)
+        self.assertTrue(first <= key <= last)
+        self.assertEqual(tiles.tile_prefix((10, 518, 352)), prefix)
+
+    def test_hierarchy(self):
+        prefix = tiles.tile_prefix((10, 518, 352))
+        self.assertEqual(tiles.prefix_tile(tiles.parent(prefix), 9),
+                         (9, 259, 176))
+        self.assertEqual(tiles.prefix_tile(tiles.ancestor(prefix, 10, 5), 5),
+                         (5, 16, 11))
+        self.assertEqual(tiles.ancestor(prefix, 10, 0), 0)
+        self.assertEqual(
+            sorted(tiles.prefix_tile(child, 11)
+                   for child in tiles.children(prefix)),
+            [(11, 1036, 704), (11, 1036, 705), (11, 1037, 704),
+             (11, 1037, 705)]
+        )
+        with self.assertRaises(ValueError):
+            tiles.ancestor(prefix, 10, 11)
+
+    def test_batch(self):
+        random = np.random.RandomState(5)
+        lon = random.uniform(-180, 180, 1000)
+        lat = random.uniform(-85, 85, 1000)
+        keys = geospatial.WebMercatorLonLat.project_interleave_batch(lon, lat)
+
+        for zoom in (1, 12, 18):
+            x, y = tiles.lonlat_tiles_batch(lon, lat, zoom)
+            prefixes = tiles.key_prefixes_batch(keys, zoom)
+            quadkeys = tiles.prefix_quadkeys_batch(prefixes, zoom)
+            for i in range(0, 1000, 97):
+                key = int(keys[i])
+                self.assertEqual(tiles.key_tile(key, zoom),
+                                 (zoom, x[i], y[i]))
+                self.assertEqual(tiles.prefix_quadkey(prefixes[i], zoom),
+                                 quadkeys[i])
+                # the standard formula of slippy map tiles
+                n = 2 ** zoom
+                self.assertEqual(x[i], int((lon[i] + 180) / 360 * n))
+                self.assertEqual(y[i], int(
+                    (1 - math.asinh(math.tan(math.radians(lat[i]))) /
+                     math.pi) / 2 * n
+                ))
+            self.assertEqual(
+                tiles.quadkey_prefixes_batch(quadkeys).tolist(),
+                prefixes.tolist()
+            )
+            self.assertEqual(
+                tiles.tile_prefixes_batch(x, y, zoom).tolist(),
+                prefixes.tolist()
+            )
+            self.assertEqual(
+                tiles.ancestor(prefixes, zoom, zoom - 1).tolist(),
+                tiles.key_prefixes_batch(keys, zoom - 1).tolist()
+            )
+        self.assertEqual(tiles.key_prefixes_batch(keys, 0).tolist(),
+                         [0] * 1000)
+        with self.assertRaises(ValueError):
+            tiles.quadkey_prefixes_batch(['12', '1'])
+
+
+class TestGeohash(unittest.TestCase):
+
+    def bisect(self, lon, lat, precision):
+        """
+        Encodes a geohash the usual way, a bit at a time.
+        """
+        lon_range, lat_range = [-180.0, 180.0], [-90.0, 90.0]
+        value = 0
+        for bit in range(5 * precision):
+            interval, coordinate = (lon_range, lon) if bit % 2 == 0 \
+                else (lat_range, lat)
+            middle = (interval[0] + interval[1]) / 2
+            value <<= 1
+            if coordinate >= middle:
+                value |= 1
+                interval[0] = middle
+            else:
+                interval[1] = middle
+        return ''.join(
+            geohash.BASE32[(value >> shift) & 31]
+            for shift in range(5 * precision - 5, -1, -5)
+        )
+
+    def test_encode(self):
+        self.assertEqual(geohash.encode(-5.6, 42.6, 5), 'ezs42')
+        self.assertEqual(geohash.encode(10.40744, 57.64911, 11),
+                         'u4pruydqqvj')
+        self.assertEqual(geohash.encode(-180, -90, 3), '000')
+        self.assertEqual(geohash.encode(180, 90, 3), 'zzz')
+        with self.assertRaises(ValueError):
+            geohash.encode(0, 0, 13)
+
+    def test_decode(self):
+        centre = geohash.decode('ezs42')
+        self.assertAlmostEqual(centre.lon, -5.603, places=3)
+        self.assertAlmostEqual(centre.lat, 42.605, places=3)
+        lon_min, lat_min, lon_max, lat_max = geohash.bbox('ezs42')
+        self.assertTrue(lon_min <= -5.6 <= lon_max)
+        self.assertTrue(lat_min <= 42.6 <= lat_max)
+        with self.assertRaises(ValueError):
+            geohash.decode('ezs4a')
+
+    def test_batch(self):
+        random = np.random.RandomState(9)
+        lon = random.uniform(-180, 180, 500)
+        lat = random.uniform(-90, 90, 500)
+        for precision in (1, 4, 7, 12):
+            geohashes = geohash.encode_batch(lon, lat, precision)
+            centres = geohash.decode_batch(geohashes)
+            for i in range(0, 500, 23):
+                self.assertEqual(geohashes[i],
+                                 self.bisect(lon[i], lat[i], precision))
+                self.assertEqual(geohash.encode(lon[i], lat[i], precision),
+                                 geohashes[i])
+                centre = geohash.decode(geohashes[i])
+                self.assertAlmostEqual(centres[0][i], centre.lon)
+                self.assertAlmostEqual(centres[1][i], centre.lat)
+        with self.assertRaises(ValueError):
+            geohash.decode_batch(['ezs42', 'ezs4'])
+
+    def test_neighbours(self):
+        self.assertEqual(geohash.neighbours('u4pruydqqvj'), {
+            'n': 'u4pruydqqvm', 'ne': 'u4pruydqqvq', 'e': 'u4pruydqqvn',
+            'se': 'u4pruydqquy', 's': 'u4pruydqquv', 'sw': 'u4pruydqquu',
+            'w': 'u4pruydqqvh', 'nw': 'u4pruydqqvk',
+        })
+        # across the antimeridian, and none past the north pole
+        corner = geohash.neighbours('zz')
+        self.assertEqual(sorted(corner), ['e', 's', 'se', 'sw', 'w'])
+        self.assertEqual(corner['e'], 'bp')
+
+    def test_prefix_range(self):
+        first, last = geohash.prefix_range('ezs42')
+        self.assertTrue(first <= geohash.key(-5.6, 42.6) <= last)
+        self.assertEqual(last - first + 1, 1 << (64 - 25))
+        keys = geohash.keys_batch([-5.6, 5.6], [42.6, 42.6])
+        self.assertEqual(int(keys[0]), geohash.key(-5.6, 42.6))
+        self.assertFalse(first <= int(keys[1]) <= last)
+
+
+class TestCoverer(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(7)
+        self.lon = random.uniform(0, 12, 20000)
+        self.lat = random.uniform(40, 52, 20000)
+        self.keys = geospatial.LonLat.interleave_batch(self.lon, self.lat)
+        # a square with a triangular hole, and a concave polygon
+        self.polygons = [
+            coverer.Polygon([(1, 41), (7, 41), (7, 47), (1, 47)],
+                            holes=[[(3, 43), (5, 43), (4, 45)]]),
+            coverer.Polygon([(6, 44), (11, 44), (11, 51), (8.5, 46),
+                             (6, 51)]),
+        ]
+
+    def covered(self, cells):
+        found = np.zeros(len(self.keys), dtype=bool)
+        for first, last in coverer.covering_ranges(cells):
+            found |= (self.keys >= np.uint64(first)) & \
+                (self.keys <= np.uint64(last))
+        return found
+
+    def test_contains_batch(self):
+        square = self.polygons[0]
+        np.testing.assert_array_equal(
+            square.contains_batch([0, 2, 4, 4, 6.9], [45, 42, 44, 42, 46.9]),
+            [False, True, False, True, True]
+        )
+        with self.assertRaises(ValueError):
+            coverer.Polygon([(0, 0), (1, 1)])
+
+    def test_covering(self):
+        for polygon in self.polygons:
+            inside = polygon.contains_batch(self.lon, self.lat)
+            for min_level, max_level, max_cells in [(0, 32, 8), (0, 32, 64),
+                                                    (4, 10, 16), (6, 6, 1)]:
+                covering = coverer.RegionCoverer(
+                    min_level, max_level, max_cells
+                ).covering(polygon)
+                cells = covering.interior + covering.boundary
+                levels = [level for _, level in cells]
+                self.assertGreaterEqual(min(levels), min_level)
+                self.assertLessEqual(max(levels), max_level)
+                if min_level < 6:
+                    self.assertLessEqual(len(cells), max_cells)
+
+                interior = self.covered(covering.interior)
+                boundary = self.covered(covering.boundary)
+                self.assertFalse((interior & boundary).any())
+                self.assertTrue(inside[interior].all())
+                self.assertTrue((interior | boundary)[inside].all())
+            region_coverer = coverer.RegionCoverer(max_cells=64)
+            interior = region_coverer.interior_covering(polygon)
+            self.assertGreater(len(interior), 0)
+            self.assertEqual(interior,
+                             region_coverer.covering(polygon).interior)
+
+        with self.assertRaises(ValueError):
+            coverer.RegionCoverer(min_level=10, max_level=5)
+        far = coverer.Polygon([(100, 0), (101, 0), (101, 1)])
+        self.assertEqual(
+            coverer.RegionCoverer(min_level=3).covering(far).interior, []
+        )
+
+    def test_geofence_index(self):
+        fences = coverer.GeofenceIndex(self.polygons)
+        points, found = fences.locate_batch(self.lon, self.lat)
+        expected = np.array([
+            polygon.contains_batch(self.lon, self.lat)
+            for polygon in self.polygons
+        ])
+        expected_points, expected_found = np.nonzero(expected.T)
+        np.testing.assert_array_equal(points, expected_points)
+        np.testing.assert_array_equal(found, expected_found)
+        np.testing.assert_array_equal(
+            fences.contains_batch(self.lon, self.lat), expected.any(axis=0)
+        )
+        empty = coverer.GeofenceIndex([])
+        self.assertEqual(len(empty.locate_batch(self.lon, self.lat)[0]), 0)
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.lon = random.uniform(-180, 180, 1000)
+        self.lat = random.uniform(-90, 90, 1000)
+        self.csv = u'id,lat,lon\n' + u''.join(
+            u'{},{!r},{!r}\n'.format(i, float(lat), float(lon))
+            for i, (lon, lat) in enumerate(zip(self.lon, self.lat))
+        )
+        self.geojson = u''.join(
+            json.dumps({'type': 'Feature', 'properties': {'id': i},
+                        'geometry': {'type': 'Point',
+                                     'coordinates': [float(lon), float(lat)]}})
+            + u'\n'
+            for i, (lon, lat) in enumerate(zip(self.lon, self.lat))
+        )
+
+    def test_csv(self):
+        chunks = list(ingest.ingest(io.StringIO(self.csv), chunk_size=300))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        np.testing.assert_array_equal(
+            np.concatenate(chunks),
+            geospatial.LonLat.interleave_batch(self.lon, self.lat)
+        )
+
+    def test_geojson_mercator(self):
+        keys = np.concatenate(list(ingest.ingest(
+            io.StringIO(self.geojson), format='geojson', mercator=True
+        )))
+        np.testing.assert_array_equal(
+            keys,
+            geospatial.MercatorLonLat.project_interleave_batch(
+                self.lon, self.lat
+            )
+        )
+
+    def test_geojson_geometries(self):
+        lines = u'{"type": "Point", "coordinates": [10, 20]}\n\n'
+        lon, lat = next(ingest.read_geojson(io.StringIO(lines)))
+        self.assertEqual((list(lon), list(lat)), ([10.0], [20.0]))
+
+    def test_bad_rows(self):
+        csv = u'lon,lat\n1,2\nthree,4\n5,6\n'
+        with self.assertRaises(ValueError):
+            list(ingest.read_csv(io.StringIO(csv)))
+        lon, lat = next(ingest.read_csv(io.StringIO(csv), errors='skip'))
+        self.assertEqual(list(lon), [1.0, 5.0])
+
+        with self.assertRaises(ValueError):
+            list(ingest.read_csv(io.StringIO(u'x,y\n1,2\n')))
+        with self.assertRaises(ValueError):
+            ingest.ingest(io.StringIO(csv), format='shapefile')
+
+    def test_non_finite_rows(self):
+        csv = u'lon,lat\n1,2\nnan,4\n5,inf\n-inf,6\n7,8\n'
+        with self.assertRaises(ValueError):
+            list(ingest.read_csv(io.StringIO(csv)))
+        lon, lat = next(ingest.read_csv(io.StringIO(csv), errors='skip'))
+        self.assertEqual((list(lon), list(lat)), ([1.0, 7.0], [2.0, 8.0]))
+
+        geojson = u''.join(
+            json.dumps({'type': 'Point', 'coordinates': point}) + u'\n'
+            for point in ([1, 2], [float('nan'), 4], [5, float('inf')])
+        )
+        with self.assertRaises(ValueError):
+            list(ingest.read_geojson(io.StringIO(geojson)))
+        lon, lat = next(ingest.read_geojson(io.StringIO(geojson),
+                                            errors='skip'))
+        self.assertEqual((list(lon), list(lat)), ([1.0], [2.0]))
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, 'points.csv')
+            with io.open(source, 'w') as csv_file:
+                csv_file.write(self.csv)
+
+            keys = os.path.join(directory, 'keys.bin')
+            ingest.main([source, '--output', keys, '--chunk-size', '128'])
+            np.testing.assert_array_equal(
+                np.fromfile(keys, dtype='<u8'),
+                geospatial.LonLat.interleave_batch(self.lon, self.lat)
+            )
+
+            path = os.path.join(directory, 'index')
+            ingest.main([source, '--index', path])
+            with diskindex.LonLatIndexFile(path) as mapped:
+                self.assertEqual(
+                    sorted(mapped.query(-30, -20, 40, 10)),
+                    list(np.nonzero((self.lon >= -30) & (self.lon <= 40) &
+                                    (self.lat >= -20) & (self.lat <= 10))[0])
+                )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_main_bad_rows(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, 'points.csv')
+            with io.open(source, 'w') as csv_file:
+                csv_file.write(u'lon,lat\n1,2\nnan,4\n')
+            keys = os.path.join(directory, 'keys.bin')
+            # reported as a usage error rather than a traceback
+            with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                with self.assertRaises(SystemExit):
+                    ingest.main([source, '--output', keys])
+            self.assertIn('line 3', stderr.getvalue())
+
+            ingest.main([source, '--output', keys, '--skip-errors'])
+            np.testing.assert_array_equal(
+                np.fromfile(keys, dtype='<u8'),
+                geospatial.LonLat.interleave_batch([1.0], [2.0])
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_main_mercator(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, 'cities.csv')
+            with io.open(source, 'w') as csv_file:
+                csv_file.write(u'lon,lat\n2.3522,48.8566\n'
+                               u'-0.1276,51.5072\n139.6917,35.6895\n')
+            path = os.path.join(directory, 'index')
+            ingest.main([source, '--mercator', '--index', path])
+
+            with diskindex.LonLatIndexFile(
+                path, lonlat=geospatial.MercatorLonLat
+            ) as mapped:
+                # queries are in degrees, like the points ingested
+                self.assertEqual(list(mapped.query(1, 47, 4, 50)), [0])
+                self.assertEqual(list(mapped.within(2.35, 48.85, 10000)),
+                                 [0])
+                self.assertEqual(sorted(mapped.within(2.35, 48.85, 4e5)),
+                                 [0, 1])
+                ids, distances = mapped.nearest(2.35, 48.85, k=2)
+                self.assertEqual(list(ids), [0, 1])
+                self.assertLess(distances[0], 1000)
+                self.assertAlmostEqual(distances[1] / 1000, 344, places=-1)
+                ids, distances = mapped.nearest(140, 36, k=1)
+                self.assertEqual(list(ids), [2])
+                self.assertEqual(list(mapped.lookup(139.6917, 35.6895)), [2])
+
+            # and so are those of a random sample
+            path = os.path.join(directory, 'random')
+            source = os.path.join(directory, 'points.csv')
+            with io.open(source, 'w') as csv_file:
+                csv_file.write(self.csv)
+            ingest.main([source, '--mercator', '--index', path])
+            inside = geospatial.haversine_batch(20, 30, self.lon, self.lat) \
+                <= 2e6
+            # beyond 85 degrees, latitudes are clamped by the projection
+            inside &= np.abs(self.lat) < 85
+            with diskindex.LonLatIndexFile(
+                path, lonlat=geospatial.MercatorLonLat
+            ) as mapped:
+                self.assertEqual(sorted(mapped.within(20, 30, 2e6)),
+                                 list(np.nonzero(inside)[0]))
+                ids, distances = mapped.nearest(20, 30, k=10)
+                expected = np.sort(geospatial.haversine_batch(
+                    20, 30, self.lon, self.lat
+                ))[:10]
+                self.assertTrue(np.allclose(distances, expected, atol=1))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestInterleaveBatch(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.xyz = [random.randint(0, 1 << 10, 1000) for _ in range(3)]
+        self.vxyz = [random.randint(0, 1 << 16, 1000) for _ in range(4)]
+
+    def test_interleave3_batch(self):
+        keys = interleave.interleave3_batch(*self.xyz)
+        self.assertEqual(keys.dtype, np.uint32)
+        self.assertEqual(
+            keys.tolist(),
+            [interleave.interleave3(*map(int, xyz)) for xyz in zip(*self.xyz)]
+        )
+        for axis, expected in zip(interleave.deinterleave3_batch(keys),
+                                  self.xyz):
+            np.testing.assert_array_equal(axis, expected)
+
+    def test_interleave4_batch(self):
+        keys = interleave.interleave4_batch(*self.vxyz)
+        self.assertEqual(keys.dtype, np.uint64)
+        self.assertEqual(
+            keys.tolist(),
+            [interleave.interleave4(*map(int, vxyz))
+             for vxyz in zip(*self.vxyz)]
+        )
+        for axis, expected in zip(interleave.deinterleave4_batch(keys),
+                                  self.vxyz):
+            np.testing.assert_array_equal(axis, expected)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            interleave.interleave3_batch(*[axis[:10] for axis in self.xyz[:2]]
+                                         + [self.xyz[2]])
+        with self.assertRaises(ValueError):
+            interleave.interleave3_batch(*self.xyz,
+                                         out=np.empty(1000, dtype=np.uint64))
+        with self.assertRaises(ValueError):
+            interleave.interleave4_batch(*[axis / 2 for axis in self.vxyz])
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.x = random.randint(0, 1 << 32, 10000, dtype=np.uint64) \
+            .astype(np.uint32)
+        self.y = random.randint(0, 1 << 32, 10000, dtype=np.uint64) \
+            .astype(np.uint32)
+        self.codec = parallel.ParallelCodec(workers=2, chunk_size=999)
+
+    def tearDown(self):
+        self.codec.close()
+
+    def test_map(self):
+        keys = self.codec.map(morton.interleave_64_batch, self.x, self.y)
+        np.testing.assert_array_equal(
+            keys, morton.interleave_64_batch(self.x, self.y)
+        )
+
+        x, y = self.codec.map(morton.deinterleave_64_batch, keys)
+        self.assertEqual(x.dtype, np.uint32)
+        np.testing.assert_array_equal(x, self.x)
+        np.testing.assert_array_equal(y, self.y)
+
+    def test_map_classmethod(self):
+        lon = self.x / 2 ** 32 * 360 - 180
+        lat = self.y / 2 ** 32 * 180 - 90
+        np.testing.assert_array_equal(
+            self.codec.map(geospatial.MercatorLonLat.project_interleave_batch,
+                           lon, lat),
+            geospatial.MercatorLonLat.project_interleave_batch(lon, lat)
+        )
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.codec.map(morton.interleave_64_batch, self.x, self.y[:10])
+        with self.assertRaises(ValueError):
+            self.codec.map(interleave.interleave3_batch,
+                           self.x / 2, self.y, self.y)
+
+
 if __name__ == '__main__':
     unittest.main()
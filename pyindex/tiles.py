@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+Slippy map tiles and quadkeys of morton.interleave_64 keys.
+
+The tile of a key at zoom `zoom` is given by the top 2 * zoom bits of the
+key, its prefix: a 2D Morton code of the tile's column and row, which a
+quadkey writes in base 4.  So assigning keys to tiles, or tiles to their
+parent, children or ancestors, is a matter of shifting the keys, with no
+decoding.  Prefixes are what the functions below take and return; tiles
+as (zoom, x, y) and quadkeys are only needed at the edges.
+
+The tiles are those of the grid of the keys.  For the tiles of web maps,
+encode the points with geospatial.WebMercatorLonLat, whose grid is the
+Web Mercator square, e.g. with lonlat_tiles_batch().  These match the
+tiles computed in floating point up to zoom 22; beyond, as the grid is
+scaled to UINT32 rather than 2 ** 32, points a few millimetres from the
+edge of a tile may fall in its neighbour.
+
+Tile rows are counted from the north, as in web maps, while the keys count
+them from the south: the prefix and quadkey of a tile differ by swapping
+the two bits of each digit and flipping the row bit.
+
+Ref.: https://learn.microsoft.com/en-us/bingmaps/articles/bing-maps-tile-system
+"""
+
+from collections import namedtuple
+
+from ._lazy import LazyModule
+from .geospatial import WebMercatorLonLat
+from .morton import deinterleave_64, deinterleave_64_batch, interleave_64, \
+    interleave_64_batch
+from .zorder import cell_range
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
+# zoom at which a tile is a single cell of the 32-bit grid
+MAX_ZOOM = 32
+
+Tile = namedtuple('Tile', ['zoom', 'x', 'y'])
+
+# the row bit (the lower one) of every base 4 digit
+ROW_BITS = 0x5555555555555555
+
+
+def _check_zoom(zoom):
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(
+            "zoom must be between 0 and {}, not {}".format(MAX_ZOOM, zoom)
+        )
+
+
+def _like(prefix, value):
+    """
+    Returns `value` as the type of `prefix`: numpy < 2 turns uint64 values
+    combined with Python integers into floats.
+    """
+    return value if isinstance(prefix, int) else np.uint64(value)
+
+
+def _shift(prefix, bits):
+    """
+    Returns `prefix` shifted right by `bits`, which may be 64.
+    """
+    if bits >= 64:
+        # shifting a uint64 by 64 bits is undefined
+        return prefix & _like(prefix, 0)
+    return prefix >> _like(prefix, bits)
+
+
+def _quad(prefix, zoom):
+    """
+    Returns the quadkey digits of a prefix as an integer.
+    """
+    rows = _like(prefix, ROW_BITS & ((1 << (2 * zoom)) - 1))
+    one = _like(prefix, 1)
+    # (column, south row) bits -> (north row, column) bits
+    return ((prefix >> one) & rows) | ((~prefix & rows) << one)
+
+
+def _unquad(quad, zoom):
+    """
+    Returns the prefix of quadkey digits given as an integer.  This is the
+    inverse of _quad().
+    """
+    rows = _like(quad, ROW_BITS & ((1 << (2 * zoom)) - 1))
+    one = _like(quad, 1)
+    # (north row, column) bits -> (column, south row) bits
+    return ((quad & rows) << one) | ((~quad >> one) & rows)
+
+
+def key_prefix(key, zoom):
+    """
+    Returns the prefix of the tile of `key` at `zoom`.
+    """
+    _check_zoom(zoom)
+    return _shift(key, 64 - 2 * zoom)
+
+
+def prefix_range(prefix, zoom):
+    """
+    Returns the inclusive (first, last) range of the keys in the tile of
+    `prefix` at `zoom`.
+    """
+    _check_zoom(zoom)
+    return cell_range(prefix, zoom)
+
+
+def parent(prefix):
+    """
+    Returns the prefix of the parent of the tile of `prefix`.  This works
+    on uint64 arrays of prefixes too.
+    """
+    return prefix >> _like(prefix, 2)
+
+
+def ancestor(prefix, zoom, level):
+    """
+    Returns the prefix of the ancestor at zoom `level` of the tile of
+    `prefix` at `zoom`.  This works on uint64 arrays of prefixes too.
+    """
+    _check_zoom(zoom)
+    if not 0 <= level <= zoom:
+        raise ValueError(
+            "level must be between 0 and {}, not {}".format(zoom, level)
+        )
+    return _shift(prefix, 2 * (zoom - level))
+
+
+def children(prefix):
+    """
+    Returns the prefixes of the four children of the tile of `prefix`, in
+    key order.
+    """
+    return [(prefix << _like(prefix, 2)) | _like(prefix, child)
+            for child in range(4)]
+
+
+def prefix_tile(prefix, zoom):
+    """
+    Returns the Tile of a prefix at `zoom`.
+    """
+    _check_zoom(zoom)
+    x, y = deinterleave_64(prefix)
+    return Tile(zoom, x, ((1 << zoom) - 1) - y)
+
+
+def tile_prefix(tile):
+    """
+    Returns the prefix of a Tile, or of a (zoom, x, y) tuple.
+    """
+    zoom, x, y = tile
+    _check_zoom(zoom)
+    if not (0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+        raise ValueError("{} is not a tile".format(tuple(tile)))
+    return interleave_64(x, ((1 << zoom) - 1) - y)
+
+
+def key_tile(key, zoom):
+    """
+    Returns the Tile of `key` at `zoom`.
+    """
+    return prefix_tile(key_prefix(key, zoom), zoom)
+
+
+def prefix_quadkey(prefix, zoom):
+    """
+    Returns the quadkey of a prefix at `zoom`, a string of `zoom` digits.
+    """
+    _check_zoom(zoom)
+    quad = _quad(prefix, zoom)
+    return ''.join(
+        str((quad >> shift) & 3) for shift in range(2 * zoom - 2, -1, -2)
+    )
+
+
+def quadkey_prefix(quadkey):
+    """
+    Returns the prefix of a quadkey, whose zoom is its length.
+    """
+    _check_zoom(len(quadkey))
+    if quadkey.strip('0123') or quadkey.strip() != quadkey:
+        raise ValueError("{!r} is not a quadkey".format(quadkey))
+    return _unquad(int(quadkey, 4) if quadkey else 0, len(quadkey))
+
+
+def tile_quadkey(tile):
+    """
+    Returns the quadkey of a Tile, or of a (zoom, x, y) tuple.
+    """
+    return prefix_quadkey(tile_prefix(tile), tile[0])
+
+
+def quadkey_tile(quadkey):
+    """
+    Returns the Tile of a quadkey.
+    """
+    return prefix_tile(quadkey_prefix(quadkey), len(quadkey))
+
+
+def key_prefixes_batch(keys, zoom):
+    """
+    Returns the prefixes of the tiles of an array of keys at `zoom`, as a
+    uint64 array.  Use ancestor() for the other zooms.
+    """
+    _check_zoom(zoom)
+    return _shift(np.asarray(keys, dtype=np.uint64), 64 - 2 * zoom)
+
+
+def prefix_tiles_batch(prefixes, zoom):
+    """
+    Returns arrays of the x and y of the tiles of an array of prefixes at
+    `zoom`.  This is the array equivalent of prefix_tile().
+    """
+    _check_zoom(zoom)
+    x, y = deinterleave_64_batch(prefixes)
+    # y <= 2 ** zoom - 1, so this cannot wrap around
+    np.subtract(np.uint32((1 << zoom) - 1), y, out=y)
+    return x, y
+
+
+def tile_prefixes_batch(x, y, zoom):
+    """
+    Returns the prefixes of the tiles of arrays of x and y at `zoom`, as a
+    uint64 array.  This is the array equivalent of tile_prefix().
+    """
+    _check_zoom(zoom)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if (x.size and (x.min() < 0 or x.max() >= 1 << zoom)) or \
+            (y.size and (y.min() < 0 or y.max() >= 1 << zoom)):
+        raise ValueError("x and y must be below {}".format(1 << zoom))
+    return interleave_64_batch(
+        x, np.uint32((1 << zoom) - 1) - y.astype(np.uint32)
+    )
+
+
+def key_tiles_batch(keys, zoom):
+    """
+    Returns arrays of the x and y of the tiles of an array of keys at
+    `zoom`.  This is the array equivalent of key_tile().
+    """
+    return prefix_tiles_batch(key_prefixes_batch(keys, zoom), zoom)
+
+
+def lonlat_tiles_batch(lon, lat, zoom):
+    """
+    Returns arrays of the x and y of the web map tiles of arrays of
+    longitudes and latitudes at `zoom`.
+    """
+    return key_tiles_batch(
+        WebMercatorLonLat.project_interleave_batch(lon, lat), zoom
+    )
+
+
+def prefix_quadkeys_batch(prefixes, zoom):
+    """
+    Returns the quadkeys of an array of prefixes at `zoom`, as an array of
+    strings.  This is the array equivalent of prefix_quadkey().
+    """
+    _check_zoom(zoom)
+    prefixes = np.asarray(prefixes, dtype=np.uint64)
+    if zoom == 0:
+        return np.full(prefixes.shape, '', dtype='U1')
+
+    quads = _quad(prefixes, zoom)
+    shifts = np.arange(2 * zoom - 2, -1, -2, dtype=np.uint64)
+    # one byte per digit, read back as strings of `zoom` bytes
+    digits = ((quads[..., np.newaxis] >> shifts) & np.uint64(3)).astype(
+        np.uint8
+    )
+    digits += ord('0')
+    return digits.view('S{}'.format(zoom))[..., 0].astype(
+        'U{}'.format(zoom)
+    )
+
+
+def quadkey_prefixes_batch(quadkeys):
+    """
+    Returns the prefixes of an array of quadkeys, which must all have the
+    same zoom, as a uint64 array.  This is the array equivalent of
+    quadkey_prefix().
+    """
+    quadkeys = np.asarray(quadkeys, dtype=np.bytes_)
+    zoom = quadkeys.dtype.itemsize
+    _check_zoom(zoom)
+
+    # numpy pads shorter strings with null bytes, which are caught here
+    digits = np.frombuffer(
+        np.ascontiguousarray(quadkeys).tobytes(), dtype=np.uint8
+    ).reshape(quadkeys.shape + (zoom,)) - np.uint8(ord('0'))
+    if (digits > 3).any():
+        raise ValueError("quadkeys must be strings of the same length of "
+                         "the digits 0 to 3")
+
+    quads = np.zeros(quadkeys.shape, dtype=np.uint64)
+    for digit in range(zoom):
+        quads <<= np.uint64(2)
+        quads |= digits[..., digit]
+    return _unquad(quads, zoom)
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decomposition of query regions into ranges of Z-order (Morton) keys.
+
+A Morton key orders points along a Z-shaped curve, so every cell of the
+implicit quadtree (octree, ...) over the key space is a contiguous range
+of keys.  Covering a query box with such cells therefore gives a list of
+key intervals which can be looked up with bisection in a sorted column of
+keys, instead of testing every key.
+
+The functions here work with keys laid out like interleave.interleave_any
+(the first dimension in the lowest bit).  morton.interleave_64(x, y) puts
+`x` above `y`, so use morton_bbox_ranges() for those keys.
+"""
+
+from __future__ import division
+
+from ._lazy import LazyModule
+
+# numpy is only imported once a batch function needs it
+np = LazyModule('numpy')
+
+# Results of a classify(mins, maxs) callback
+OUTSIDE = 0
+PARTIAL = 1
+INSIDE = 2
+
+# default maximum number of ranges of a box cover: exact covers have as
+# many ranges as cells along the perimeter of the box
+MAX_RANGES = 64
+
+
+def cell_range(prefix, level, dims=2, bits=32):
+    """
+    Returns the (first, last) keys of the cell at the given level whose
+    keys all start with `prefix`.
+
+    A cell at level `level` has `level` bits resolved in each dimension,
+    so level 0 is the whole key space and level `bits` a single key.
+    """
+    shift = dims * (bits - level)
+    return prefix << shift, ((prefix + 1) << shift) - 1
+
+
+def cover_cells(classify, dims=2, bits=32, max_depth=None, max_cells=None):
+    """
+    Walks the quadtree (octree, ...) over the key space breadth first and
+    returns the cells covering a region, as a list of
+    (prefix, level, inside) tuples sorted by key.
+
+    Cells are only split while they are partially inside the region and
+    `max_depth` is not reached.  Partially covered cells that are not
+    split further are returned with `inside` set to False, so the cover
+    may include keys outside the region but never misses one.
+
+    classify: function taking the inclusive (mins, maxs) corners of a cell
+              and returning OUTSIDE, PARTIAL or INSIDE
+    dims: number of dimensions interleaved in the keys
+    bits: number of bits per dimension
+    max_depth: maximum level to split cells to, defaults to `bits`
+    max_cells: stop splitting before the cover exceeds this many cells
+    """
+    if max_depth is None or max_depth > bits:
+        max_depth = bits
+
+    mins = (0,) * dims
+    maxs = ((1 << bits) - 1,) * dims
+    kind = classify(mins, maxs)
+    if kind == OUTSIDE:
+        return []
+    if kind == INSIDE:
+        return [(0, 0, True)]
+
+    inside = []
+    partial = [(0, mins)]
+    level = 0
+    while partial and level < max_depth:
+        new_inside, new_partial = _split(classify, partial, level, dims,
+                                         bits)
+
+        if max_cells is not None and \
+                len(inside) + len(new_inside) + len(new_partial) > max_cells:
+            break
+
+        inside.extend(new_inside)
+        partial = new_partial
+        level += 1
+
+    return _cells(inside, partial, level, dims, bits)
+
+
+def _split(classify, partial, level, dims, bits):
+    """
+    Splits the partially covered cells at `level`, given as
+    (prefix, mins) tuples, and returns the lists of their children inside
+    the region, as (prefix, level) tuples, and partially inside it, as
+    (prefix, mins) tuples.
+    """
+    half = 1 << (bits - level - 1)
+
+    inside = []
+    new_partial = []
+    for prefix, mins in partial:
+        for child in range(1 << dims):
+            child_mins = tuple(
+                low + half if (child >> d) & 1 else low
+                for d, low in enumerate(mins)
+            )
+            child_maxs = tuple(low + half - 1 for low in child_mins)
+
+            kind = classify(child_mins, child_maxs)
+            if kind == OUTSIDE:
+                continue
+            child_prefix = (prefix << dims) | child
+            if kind == INSIDE:
+                inside.append((child_prefix, level + 1))
+            else:
+                new_partial.append((child_prefix, child_mins))
+
+    return inside, new_partial
+
+
+def _cells(inside, partial, level, dims, bits):
+    """
+    Returns the (prefix, level, inside) tuples of the cells inside the
+    region and of the partially covered cells at `level`, sorted by key.
+    """
+    cells = [(prefix, cell_level, True) for prefix, cell_level in inside]
+    cells.extend((prefix, level, False) for prefix, _ in partial)
+    cells.sort(key=lambda cell: cell_range(cell[0], cell[1], dims, bits))
+
+    return cells
+
+
+def merge_ranges(ranges, max_ranges=None):
+    """
+    Merges a sorted list of inclusive (first, last) key ranges so that
+    adjacent or overlapping ranges become one.
+
+    If `max_ranges` is given, the ranges separated by the smallest gaps are
+    merged too until at most `max_ranges` are left, which covers the fewest
+    extra keys for that number of ranges.
+    """
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+
+    if max_ranges is None or len(merged) <= max_ranges:
+        return merged
+    if max_ranges < 1:
+        raise ValueError("max_ranges must be at least 1")
+
+    # keep the largest max_ranges - 1 gaps, close all the others
+    gaps = sorted(
+        range(1, len(merged)),
+        key=lambda i: merged[i][0] - merged[i - 1][1],
+        reverse=True
+    )
+    splits = sorted(gaps[:max_ranges - 1])
+
+    reduced = []
+    start = 0
+    for split in splits + [len(merged)]:
+        reduced.append((merged[start][0], merged[split - 1][1]))
+        start = split
+
+    return reduced
+
+
+def cover_ranges(classify, dims=2, bits=32, max_ranges=None, max_depth=None):
+    """
+    Returns a sorted list of inclusive (first, last) key ranges covering
+    the region described by `classify` (see cover_cells()).
+
+    Cells are split level by level until `max_depth` is reached or the
+    number of ranges would exceed `max_ranges`, in which case the ranges
+    with the smallest gaps between them are merged.
+    """
+    if max_depth is None or max_depth > bits:
+        max_depth = bits
+
+    if max_ranges is None:
+        return merge_ranges(
+            cell_range(prefix, level, dims, bits)
+            for prefix, level, _ in cover_cells(classify, dims, bits,
+                                                max_depth=max_depth)
+        )
+
+    mins = (0,) * dims
+    maxs = ((1 << bits) - 1,) * dims
+    kind = classify(mins, maxs)
+    if kind == OUTSIDE:
+        return []
+
+    # split the cells one more level at a time, rather than covering the
+    # region again from the top for every depth
+    inside = []
+    partial = [] if kind == INSIDE else [(0, mins)]
+    level = 0
+    ranges = [cell_range(0, 0, dims, bits)]
+    while partial and level < max_depth and len(ranges) <= max_ranges:
+        new_inside, partial = _split(classify, partial, level, dims, bits)
+        inside.extend(new_inside)
+        level += 1
+        ranges = merge_ranges(
+            cell_range(prefix, cell_level, dims, bits)
+            for prefix, cell_level, _ in _cells(inside, partial, level,
+                                                dims, bits)
+        )
+
+    return merge_ranges(ranges, max_ranges)
+
+
+def _cell_ranges_batch(prefixes, level, dims, bits):
+    """
+    Returns uint64 arrays of the first and last keys of the cells of an
+    array of prefixes at `level`.  This is the array equivalent of
+    cell_range() for 0 < level.
+    """
+    shift = np.uint64(dims * (bits - level))
+    # the last key of the last cell wraps around to 2 ** 64 - 1
+    return prefixes << shift, ((prefixes + np.uint64(1)) << shift) - \
+        np.uint64(1)
+
+
+def _merge_ranges_batch(firsts, lasts):
+    """
+    Returns the (firsts, lasts) arrays of disjoint ranges sorted by key,
+    with the adjacent ones merged.
+    """
+    if not len(firsts):
+        return firsts, lasts
+    order = np.argsort(firsts)
+    firsts, lasts = firsts[order], lasts[order]
+    starts = np.flatnonzero(firsts[1:] != lasts[:-1] + np.uint64(1)) + 1
+    return (firsts[np.concatenate(([0], starts))],
+            lasts[np.concatenate((starts - 1, [len(lasts) - 1]))])
+
+
+def cover_ranges_batch(classify, dims=2, bits=32, max_ranges=None,
+                       max_depth=None):
+    """
+    Returns the ranges of cover_ranges() for a classify function
+    working on arrays: it takes the inclusive (mins, maxs) corners of many
+    cells, as tuples of int64 arrays with one array per dimension, and
+    returns an array of OUTSIDE, PARTIAL or INSIDE.
+
+    All the cells of a level are classified in one call, which is much
+    faster than one call per cell for regions needing floating point
+    geometry, like circles.  The keys must fit in 64 bits.
+
+    With `max_ranges`, splitting also stops once more than
+    2 ** (2 * dims) * max_ranges cells are partially inside, so that a
+    classifier which never settles cells cannot make the cover descend to
+    single keys while their ranges merge into a few.
+    """
+    if dims * bits > 64:
+        raise ValueError("the keys must fit in 64 bits")
+    if max_depth is None or max_depth > bits:
+        max_depth = bits
+
+    zero = np.zeros(1, dtype=np.int64)
+    kind = classify((zero,) * dims, (zero + ((1 << bits) - 1),) * dims)[0]
+    if kind == OUTSIDE:
+        return []
+    if kind == INSIDE or max_depth == 0:
+        return [cell_range(0, 0, dims, bits)]
+
+    children = np.arange(1 << dims, dtype=np.uint64)
+    offsets = [((children >> np.uint64(d)) & np.uint64(1)).astype(np.int64)
+               for d in range(dims)]
+
+    inside_firsts, inside_lasts = [], []
+    prefixes = np.zeros(1, dtype=np.uint64)
+    mins = (zero,) * dims
+    level = 0
+
+    def cover():
+        # the merged ranges of the inside cells and of the partial ones
+        firsts, lasts = _cell_ranges_batch(prefixes, level, dims, bits)
+        return _merge_ranges_batch(np.concatenate(inside_firsts + [firsts]),
+                                   np.concatenate(inside_lasts + [lasts]))
+
+    if max_ranges is not None:
+        max_partial = max_ranges << (2 * dims)
+    firsts = [0]
+    while prefixes.size and level < max_depth and (
+        max_ranges is None or
+        (len(firsts) <= max_ranges and len(prefixes) <= max_partial)
+    ):
+        half = 1 << (bits - level - 1)
+        level += 1
+        prefixes = ((prefixes[:, None] << np.uint64(dims)) |
+                    children).ravel()
+        mins = tuple((low[:, None] + offset * half).ravel()
+                     for low, offset in zip(mins, offsets))
+        kinds = classify(mins, tuple(low + (half - 1) for low in mins))
+
+        firsts, lasts = _cell_ranges_batch(prefixes[kinds == INSIDE], level,
+                                           dims, bits)
+        inside_firsts.append(firsts)
+        inside_lasts.append(lasts)
+        partial = kinds == PARTIAL
+        prefixes = prefixes[partial]
+        mins = tuple(low[partial] for low in mins)
+        if max_ranges is not None:
+            firsts, lasts = cover()
+
+    if max_ranges is None:
+        firsts, lasts = cover()
+    return merge_ranges(zip(firsts.tolist(), lasts.tolist()), max_ranges)
+
+
+def box_classifier(lower, upper):
+    """
+    Returns a classify function for cover_cells() for the inclusive box
+    between the `lower` and `upper` corners.
+    """
+    def classify(mins, maxs):
+        inside = True
+        for low, high, cell_low, cell_high in zip(lower, upper, mins, maxs):
+            if cell_high < low or cell_low > high:
+                return OUTSIDE
+            if cell_low < low or cell_high > high:
+                inside = False
+        return INSIDE if inside else PARTIAL
+
+    return classify
+
+
+def bbox_ranges(lower, upper, bits=32, max_ranges=MAX_RANGES,
+                max_depth=None):
+    """
+    Returns a sorted list of inclusive (first, last) key ranges covering
+    the inclusive box between the `lower` and `upper` corners.
+
+    The corners are given in the order the dimensions are interleaved by
+    interleave.interleave_any, e.g. (x, y, z) for interleave.interleave3.
+
+    bits: number of bits per dimension in the keys
+    max_ranges: maximum number of ranges to return, None for no limit
+    max_depth: maximum number of bits per dimension to split cells to
+
+    Without either limit the cover is exact, but the number of ranges, and
+    the time to compute them, grow with the perimeter of the box in cells
+    of the finest level: a box 10 ** 6 grid units wide takes about a
+    minute and 2 million ranges.  Use max_ranges=None only for small
+    boxes or with `max_depth`.
+    """
+    if len(lower) != len(upper):
+        raise ValueError("lower and upper must have the same dimensions")
+    if any(low > high for low, high in zip(lower, upper)):
+        return []
+
+    return cover_ranges(
+        box_classifier(lower, upper), len(lower), bits,
+        max_ranges=max_ranges, max_depth=max_depth
+    )
+
+
+def morton_bbox_ranges(x_min, y_min, x_max, y_max, max_ranges=MAX_RANGES,
+                       max_depth=None):
+    """
+    Returns a sorted list of inclusive (first, last) ranges of
+    morton.interleave_64 keys covering the inclusive box between
+    (x_min, y_min) and (x_max, y_max).  See bbox_ranges() for the limits.
+    """
+    # interleave_64 puts y in the lowest bit
+    return bbox_ranges(
+        (y_min, x_min), (y_max, x_max), 32,
+        max_ranges=max_ranges, max_depth=max_depth
+    )
+
+
+def _dimension_masks(dims, bits):
+    """
+    Returns, for each dimension, the mask of the key bits belonging to it.
+    """
+    return [
+        sum(1 << (i * dims + d) for i in range(bits)) for d in range(dims)
+    ]
+
+
+def in_box(key, zmin, zmax, dims=2, bits=32):
+    """
+    Returns whether `key` lies inside the box whose lowest and highest
+    corners have the keys `zmin` and `zmax`.
+    """
+    for mask in _dimension_masks(dims, bits):
+        if not zmin & mask <= key & mask <= zmax & mask:
+            return False
+    return True
+
+
+def bigmin(key, zmin, zmax, dims=2, bits=32):
+    """
+    Returns the smallest key greater than `key` inside the box whose
+    lowest and highest corners have the keys `zmin` and `zmax`, or None if
+    there is none.
+
+    This is the BIGMIN computation from Tropf and Herzog, "Multidimensional
+    Range Search in Dynamically Balanced Trees" (1981).  When scanning a
+    sorted run of keys and hitting one outside the box, seeking to BIGMIN
+    skips every key between it and the next one which can be in the box.
+
+    dims, bits: the key layout, e.g. 2 and 32 for morton.interleave_64,
+                3 and 10 for interleave.interleave3, 4 and 16 for
+                interleave.interleave4
+    """
+    masks = _dimension_masks(dims, bits)
+    result = None
+
+    for position in range(dims * bits - 1, -1, -1):
+        bit = 1 << position
+        # the lower bits of the dimension `position` belongs to
+        below = masks[position % dims] & (bit - 1)
+
+        if not key & bit:
+            if zmin & bit:
+                return zmin
+            if zmax & bit:
+                # the next key is either in the upper half, starting at
+                # its lowest corner, or still to be found in the lower half
+                result = (zmin | bit) & ~below
+                zmax = (zmax & ~bit) | below
+        elif not zmin & bit:
+            if not zmax & bit:
+                return result
+            zmin = (zmin | bit) & ~below
+
+    return result
+
+
+def litmax(key, zmin, zmax, dims=2, bits=32):
+    """
+    Returns the largest key less than `key` inside the box whose lowest
+    and highest corners have the keys `zmin` and `zmax`, or None if there
+    is none.  This is the mirror of bigmin() for scanning backwards.
+    """
+    masks = _dimension_masks(dims, bits)
+    result = None
+
+    for position in range(dims * bits - 1, -1, -1):
+        bit = 1 << position
+        below = masks[position % dims] & (bit - 1)
+
+        if not key & bit:
+            if zmin & bit:
+                return result
+            if zmax & bit:
+                zmax = (zmax & ~bit) | below
+        elif not zmin & bit:
+            if not zmax & bit:
+                return zmax
+            result = (zmax & ~bit) | below
+            zmin = (zmin | bit) & ~below
+
+    return result
+
+
+def _batch_layout(dims, bits):
+    if dims * bits > 64:
+        raise ValueError(
+            "batch functions only work with keys of up to 64 bits, not "
+            "{} x {} bits".format(dims, bits)
+        )
+    return [np.uint64(mask) for mask in _dimension_masks(dims, bits)]
+
+
+def in_box_batch(keys, zmin, zmax, dims=2, bits=32):
+    """
+    Returns a boolean array telling which `keys` lie inside the box whose
+    lowest and highest corners have the keys `zmin` and `zmax`.
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    result = np.ones(keys.shape, dtype=bool)
+    for mask in _batch_layout(dims, bits):
+        masked = keys & mask
+        result &= masked >= (np.uint64(zmin) & mask)
+        result &= masked <= (np.uint64(zmax) & mask)
+    return result
+
+
+def _skip_batch(keys, zmin, zmax, dims, bits, forward):
+    """
+    Shared implementation of bigmin_batch() and litmax_batch(), following
+    the same cases as bigmin() and litmax() for every key at once.
+    """
+    masks = _batch_layout(dims, bits)
+    keys = np.asarray(keys, dtype=np.uint64)
+
+    zmin = np.full(keys.shape, zmin, dtype=np.uint64)
+    zmax = np.full(keys.shape, zmax, dtype=np.uint64)
+    result = np.zeros(keys.shape, dtype=np.uint64)
+    found = np.zeros(keys.shape, dtype=bool)
+    active = np.ones(keys.shape, dtype=bool)
+
+    for position in range(dims * bits - 1, -1, -1):
+        bit = np.uint64(1 << position)
+        below = masks[position % dims] & np.uint64((1 << position) - 1)
+
+        key_bit = (keys & bit) != 0
+        min_bit = (zmin & bit) != 0
+        max_bit = (zmax & bit) != 0
+
+        # (key, zmin, zmax) bits of 0, 1, 1 and 1, 0, 0 end the search
+        low_box = active & ~key_bit & min_bit
+        high_box = active & key_bit & ~min_bit & ~max_bit
+        # 0, 0, 1 and 1, 0, 1 split the box
+        split_low = active & ~key_bit & ~min_bit & max_bit
+        split_high = active & key_bit & ~min_bit & max_bit
+
+        if forward:
+            result = np.where(low_box, zmin, result)
+            found |= low_box
+            result = np.where(split_low, (zmin | bit) & ~below, result)
+            found |= split_low
+        else:
+            result = np.where(high_box, zmax, result)
+            found |= high_box
+            result = np.where(split_high, (zmax & ~bit) | below, result)
+            found |= split_high
+
+        zmax = np.where(split_low, (zmax & ~bit) | below, zmax)
+        zmin = np.where(split_high, (zmin | bit) & ~below, zmin)
+        active &= ~(low_box | high_box)
+
+        if not active.any():
+            break
+
+    return result, found
+
+
+def bigmin_batch(keys, zmin, zmax, dims=2, bits=32):
+    """
+    Returns bigmin() for every key of `keys` against the same box, as a
+    tuple of a uint64 array of results and a boolean array telling which
+    results were found (bigmin() returning None).
+    """
+    return _skip_batch(keys, zmin, zmax, dims, bits, True)
+
+
+def litmax_batch(keys, zmin, zmax, dims=2, bits=32):
+    """
+    Returns litmax() for every key of `keys` against the same box, as a
+    tuple of a uint64 array of results and a boolean array telling which
+    results were found (litmax() returning None).
+    """
+    return _skip_batch(keys, zmin, zmax, dims, bits, False)